@@ -1,114 +1,407 @@
 from tasks.models import Task
+from agents.base import Agent
 from .steps.a_get_relevant_files import a
 from .steps.b_get_relevant_locations import b, ProblemLocation 
 from .steps.c_get_edits import c, SearchReplaceEdit
-from .steps.d_rerank import d
+from .steps.d_rerank import d, applying_sample, tally_votes, format_edits
 from .utils.directory import NLDirectory
+from .utils.retrieval import FileIndex
+from .utils.symbols import SymbolIndex
+from .utils.sampling import sample_until_consensus, asample_until_consensus
+from .utils.gateway import DIR_CACHES, GatewayLM, apredict
+from .utils.trace import TRACES_DIR, configure_logging, step, tracing
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+import asyncio
+import hashlib
+import logging
 import os
+import threading
 import dspy
-from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
 
 N_SAMPLES = 8
+# Enough concurrent samples that a unanimous first wave settles the vote on its own
+MAX_SAMPLES_IN_FLIGHT = N_SAMPLES // 2 + 1
+# Token budget for the file skeletons sent to steps b and c
+SKELETON_TOKEN_BUDGET = 24000
+# Number of candidate files retrieved for step a
+RETRIEVAL_TOP_K = 30
+# "vote" to pick the most common sample, or "tests" to pick the one passing the most env tests
+RERANK_MODE = os.getenv("AL_MOD_RERANK_MODE", "vote")
+# Comma-separated pytest paths or node ids, relative to the env, run for each candidate in
+# "tests" mode. Without any, "tests" mode falls back to voting rather than running the whole suite
+RERANK_TESTS = [path.strip() for path in os.getenv("AL_MOD_RERANK_TESTS", "").split(",") if path.strip()]
+# Ranking by tests needs distinct candidates, so every sample is drawn instead of stopping at a vote
+RERANK_BY_TESTS = RERANK_MODE == "tests" and bool(RERANK_TESTS)
+# "full" describes every file of an env up front, "lazy" only lists them and describes
+# the candidates step a is shown, on first use, so cold starts on big repos take seconds
+DIRECTORY_MODE = os.getenv("AL_MOD_DIRECTORY_MODE", "full")
+
+# Created once and shared by all tasks; every call goes through the shared gateway.
+# LMs are scoped with dspy.context rather than dspy.configure so that
+# concurrent tasks (do_things.py --workers) don't overwrite each other
+gpt4o = GatewayLM("openai/gpt-4o", temperature=0)
+gpt4o_with_temp = GatewayLM("openai/gpt-4o", temperature=0.9, cache=False)
+
+class EnvState:
+  """An env's directory, retrieval documents and indexes, built by its first task and reused by the rest
+  
+  Shared by concurrent tasks on the same env. Only a lazy directory changes after
+  construction, as step a describes its candidates, and NLDirectory.expand_files
+  is safe to call concurrently.
+  """
+  
+  def __init__(self, env: str, directory: NLDirectory):
+    """Initialize EnvState, syncing the env's persisted indexes
+    
+    Args:
+      env (str): Name of the env folder in envs/
+      directory (NLDirectory): The env's refreshed directory
+    """
+    self.env = env
+    self.directory = directory
+    self.documents = directory.documents()
+    # Small envs show step a their whole structure and never need the retrieval index
+    self.index: Optional[FileIndex] = None
+    if len(self.documents) > RETRIEVAL_TOP_K:
+      # Lazy documents have no descriptions, so they get their own embeddings
+      index_name = f'{env}.lazy.index' if directory.lazy else f'{env}.index'
+      self.index = FileIndex(os.path.join(DIR_CACHES, index_name))
+      self.index.update(self.documents)
+    self.symbols = SymbolIndex(os.path.join(DIR_CACHES, f'{env}.symbols.json'))
+    self.symbols.update(directory.root_path, list(self.documents))
 
-def main(task: Task) -> None:
-  print(f"AL-MOD agent processing task:")
-  print(f"- Problem: {task.problem}")
-  print(f"- Environment: {task.env}")
+def get_candidates(state: EnvState, problem: str) -> Optional[list[str]]:
+  """Files shown to step a: only the top candidates from the local index, so its prompt stays flat as the repo grows
   
-  gpt4o = dspy.LM("openai/gpt-4o", temperature=0)
-  dspy.configure(lm=gpt4o)
+  Returns:
+    Optional[list[str]]: Candidate paths, or None to show the whole described structure
+  """
+  if state.index is not None:
+    return state.index.search(problem, RETRIEVAL_TOP_K)
+  return list(state.documents) if state.directory.lazy else None
+
+def get_repository_structure(state: EnvState, problem: str) -> str:
+  """Structure shown to step a, describing a lazy directory's candidates first"""
+  candidates = get_candidates(state, problem)
+  if candidates is None:
+    return state.directory.structure
+  if state.directory.lazy:
+    state.directory.expand_files(candidates)
+  return state.directory.get_candidate_structure(candidates)
+
+async def aget_repository_structure(state: EnvState, problem: str) -> str:
+  """Async version of get_repository_structure, describing candidates on the running event loop"""
+  candidates = await asyncio.to_thread(get_candidates, state, problem)
+  if candidates is None:
+    return state.directory.structure
+  if state.directory.lazy:
+    await state.directory.aexpand_files(candidates)
+  return state.directory.get_candidate_structure(candidates)
 
-  problem = task.problem
-  env = task.env
+def get_locations_skeleton(
+  state: EnvState,
+  relevant_files: list[str],
+  potential_problem_locations: list[ProblemLocation],
+) -> str:
+  """Resolve b's locations to exact spans, then re-budget the skeleton around them so c
+  sees their full bodies, followed by their callers and callees if there is room"""
+  symbols = state.symbols
+  location_files = [location.full_file_path for location in potential_problem_locations]
+  skeleton_files = list(dict.fromkeys(location_files + relevant_files))
+  ranked_locations = []
+  neighbour_locations = []
+  for location in potential_problem_locations:
+    for code_location in location.code_locations:
+      symbol = symbols.resolve(location.full_file_path, code_location.name)
+      if symbol is None:
+        logger.info(f"Could not resolve {code_location.kind} {code_location.name} in {location.full_file_path}")
+        continue
+      ranked_locations.append((symbol['file'], symbol['name']))
+      for neighbour in symbols.get_callees(symbol['qualname']) + symbols.get_callers(symbol['qualname']):
+        if neighbour['file'] in skeleton_files:
+          neighbour_locations.append((neighbour['file'], neighbour['name']))
+  relevant_files_skeleton, skeleton_tokens = state.directory.get_budgeted_skeleton(
+    skeleton_files,
+    SKELETON_TOKEN_BUDGET,
+    locations=ranked_locations + neighbour_locations + [(file_path, None) for file_path in skeleton_files],
+  )
+  logger.info(f'Problem locations skeleton: {skeleton_tokens} tokens')
+  return relevant_files_skeleton
+@contextmanager
+def task_trace(task: Task) -> Iterator[None]:
+  """Trace a task's steps and LLM calls, logging a summary and exporting the trace as JSON when it ends"""
+  configure_logging()
+  logger.info(f"AL-MOD agent processing task in {task.env}: {task.problem}")
+  with tracing(problem=task.problem, env=task.env) as trace:
+    try:
+      yield
+    finally:
+      task_id = hashlib.sha256(f"{task.env}\n{task.problem}".encode()).hexdigest()[:16]
+      trace_path = os.path.join(TRACES_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{task_id}.json")
+      trace.export(trace_path)
+      for name, totals in trace.summary().items():
+        logger.info(
+          f"{name}: {totals['duration']:.2f}s, {totals['calls']} LLM calls ({totals['cached']} cached), "
+          f"{totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens, ${totals['cost']:.4f}"
+        )
+      logger.info(f"Trace written to {trace_path}")
 
-  # Check for cached directory structure
-  directory = None
-  cache_path = os.path.join(os.path.dirname(__file__), 'dir_caches', f'{env}.xml')
-  if os.path.exists(cache_path):
-    print(f"Using cached directory structure from {cache_path}")
-    with open(cache_path, 'r') as f:
-      directory_str = f.read()
-    # Create NLDirectory with the cached structure
-    directory = NLDirectory(f'envs/{env}', structure=directory_str)
+def log_edits(reranked_edits: List[SearchReplaceEdit]) -> None:
+  if reranked_edits:
+    logger.info("Top ranked sample:\n" + format_edits(reranked_edits))
   else:
-    # Create NLDirectory and generate the structure
-    directory = NLDirectory(f'envs/{env}')
+    logger.info("No edits were found after reranking.")
+
+
+class AlModAgent(Agent):
+  """al-mod as a long-lived agent
   
-  relevant_files: list[str] = a(
-    repository_structure=directory.structure,
-    github_problem_description=problem, 
-  ).full_paths
-  # print('RELEVANT FILES', relevant_files)
+  The LMs and gateway are shared module-wide. Each env's directory, documents and
+  indexes are built by the first task on it and memoized, so later tasks on the
+  same env skip straight to step a. Call forget() after an env changes on disk.
+  """
   
-  relevant_files_skeleton: str = directory.get_skeleton(relevant_files)
-  # print('RELEVANT FILES SKELETON:', relevant_files_skeleton)
+  def __init__(self):
+    # One future per env, so each env is built once however many tasks ask for it at once
+    self.envs: dict[str, Future] = {}
+    self.lock = threading.Lock()
   
-  potential_problem_locations: list[ProblemLocation] = b(
-    github_problem_description=problem,
-    skeleton_of_relevant_files=relevant_files_skeleton # TODO improve get_skeleton
-  ).locations
-  print('POTENTIAL PROBLEM LOCATIONS:', potential_problem_locations)
-
-  gpt4o_with_temp = dspy.LM("openai/gpt-4o", temperature=0.9, cache=False)
-  dspy.configure(lm=gpt4o_with_temp)
-
-  def generate_sample(args) -> List[SearchReplaceEdit]:
-    problem, skeleton, locations = args
+  def setup(self) -> None:
+    configure_logging()
+  
+  def _claim_env(self, env: str) -> tuple[Future, bool]:
+    """Get the future for an env's state, and whether the caller must build it"""
+    with self.lock:
+      future = self.envs.get(env)
+      if future is not None:
+        return future, False
+      future = self.envs[env] = Future()
+      return future, True
+  
+  def _settle_env(self, env: str, future: Future, state: Optional[EnvState], error: Optional[BaseException]) -> None:
+    """Hand a built env to everyone waiting on it, or forget it on failure so the next task retries"""
+    if error is None:
+      future.set_result(state)
+      return
+    with self.lock:
+      if self.envs.get(env) is future:
+        del self.envs[env]
+    future.set_exception(error)
+  
+  def _open_directory(self, env: str) -> NLDirectory:
+    if DIRECTORY_MODE == "lazy":
+      return NLDirectory(f'envs/{env}', lazy=True)
+    # Refresh the cached directory structure, re-describing only changed files
+    return NLDirectory(f'envs/{env}', structure_path=os.path.join(DIR_CACHES, f'{env}.xml'))
+  
+  def env_state(self, env: str) -> EnvState:
+    """Get an env's memoized state, building it on first use
+    
+    Tasks on the same env wait for the first one to build it; tasks on other envs aren't blocked.
+    """
+    future, owner = self._claim_env(env)
+    if not owner:
+      logger.info(f"Reusing state for env {env}")
+      return future.result()
     try:
-      return c(
-        github_problem_description=problem,
-        skeleton_of_relevant_files=skeleton, 
-        potential_problem_locations=locations
-      ).edits
-    except Exception as e:
-      print(f"Failed to generate sample: {e}")
-      return None
+      state = EnvState(env, self._open_directory(env))
+    except BaseException as e:
+      self._settle_env(env, future, None, e)
+      raise
+    self._settle_env(env, future, state, None)
+    return state
   
-  samples = []
-  with ThreadPoolExecutor(max_workers=16) as executor:
-    args = [(problem, relevant_files_skeleton, potential_problem_locations)] * N_SAMPLES
-    for result in executor.map(generate_sample, args):
-      if result is not None:
-        samples.append(result)
-        print('SAMPLE', result)
+  async def aenv_state(self, env: str) -> EnvState:
+    """Async version of env_state, sharing its builds with sync callers"""
+    future, owner = self._claim_env(env)
+    if not owner:
+      logger.info(f"Reusing state for env {env}")
+      return await asyncio.wrap_future(future)
+    try:
+      if DIRECTORY_MODE == "lazy":
+        directory = await asyncio.to_thread(NLDirectory, f'envs/{env}', lazy=True)
+      else:
+        directory = await NLDirectory.aopen(f'envs/{env}', structure_path=os.path.join(DIR_CACHES, f'{env}.xml'))
+      state = await asyncio.to_thread(EnvState, env, directory)
+    except BaseException as e:
+      self._settle_env(env, future, None, e)
+      raise
+    self._settle_env(env, future, state, None)
+    return state
   
-  # Rerank the samples and get the best one
-  reranked_edits = d(samples)
+  def forget(self, env: Optional[str] = None) -> None:
+    """Drop the memoized state of one env, or of every env if None, so it is rebuilt by the next task"""
+    with self.lock:
+      if env is None:
+        self.envs.clear()
+      else:
+        self.envs.pop(env, None)
   
-  print("\n=== Top Ranked Sample ===")
-  if reranked_edits:
-    for i, edit in enumerate(reranked_edits):
-      print(f"\nEdit {i + 1}:")
-      print(f"File: {edit.full_file_path}")
-      print("Edit:")
-      # Pretty print the search/replace blocks
-      lines = edit.search_replace_edit.split('\n')
-      in_code_block = False
-      for line in lines:
-        if line.startswith('```'):
-          in_code_block = not in_code_block
-          continue
-        if line.startswith('###'):
-          print('\n' + line)
-          continue
-        if '<<<<<<< SEARCH' in line:
-          print('\n' + line)
-          continue
-        if '=======' in line:
-          print(line)
-          continue  
-        if '>>>>>>> REPLACE' in line:
-          print(line)
-          continue
-        if in_code_block:
-          print('  ' + line)
-      print("-" * 50)
-  else:
-    print("No edits were found after reranking.")
+  def run(self, task: Task) -> List[SearchReplaceEdit]:
+    problem = task.problem
+    
+    with task_trace(task):
+      with step("directory"):
+        state = self.env_state(task.env)
+        directory = state.directory
+        repository_structure = get_repository_structure(state, problem)
+      
+      with step("a"), dspy.context(lm=gpt4o):
+        relevant_files: list[str] = a(
+          repository_structure=repository_structure,
+          github_problem_description=problem, 
+        ).full_paths
+      logger.debug(f"Relevant files: {relevant_files}")
+      
+      # Signatures for every relevant file, full bodies for the most relevant files that fit
+      relevant_files_skeleton, skeleton_tokens = directory.get_budgeted_skeleton(relevant_files, SKELETON_TOKEN_BUDGET)
+      logger.info(f'Relevant files skeleton: {skeleton_tokens} tokens')
+      
+      with step("b"), dspy.context(lm=gpt4o):
+        potential_problem_locations: list[ProblemLocation] = b(
+          github_problem_description=problem,
+          skeleton_of_relevant_files=relevant_files_skeleton
+        ).locations
+      logger.info(f'Potential problem locations: {potential_problem_locations}')
+      
+      with step("locations"):
+        relevant_files_skeleton = get_locations_skeleton(state, relevant_files, potential_problem_locations)
+      
+      # File contents shared by the samples' overlays, so each file is read once
+      disk_cache = {}
+      
+      def generate_sample() -> List[SearchReplaceEdit]:
+        try:
+          # Sampling threads don't inherit the caller's dspy.context, so set it here
+          with dspy.context(lm=gpt4o_with_temp):
+            edits = c(
+              github_problem_description=problem,
+              skeleton_of_relevant_files=relevant_files_skeleton, 
+              potential_problem_locations=potential_problem_locations
+            ).edits
+          logger.debug(f'Sample: {edits}')
+          return applying_sample(edits, directory.root_path, disk_cache)
+        except Exception as e:
+          logger.warning(f"Failed to generate sample: {e}")
+          return None
+      
+      # Vote on samples that apply as they finish and, unless ranking by tests, stop once the winner can't change
+      with step("c"):
+        samples = sample_until_consensus(
+          generate_sample,
+          n_samples=N_SAMPLES,
+          tally=tally_votes,
+          max_in_flight=MAX_SAMPLES_IN_FLIGHT,
+          stop_early=not RERANK_BY_TESTS,
+        )
+      
+      # Rerank the samples, which all apply to the env, and get the best one
+      with step("d"):
+        reranked_edits = d(samples, root_path=directory.root_path, mode=RERANK_MODE, test_paths=RERANK_TESTS)
+      log_edits(reranked_edits)
+    
+    # Return the reranked edits
+    return reranked_edits
   
-  # Return the reranked edits
-  return reranked_edits
+  async def arun(self, task: Task) -> List[SearchReplaceEdit]:
+    """Same pipeline as run, with every LLM call on the running event loop
+    
+    Concurrency is bounded by the shared gateway's per-loop request limit and token rate
+    limit, so many tasks can be gathered on one loop. Local indexing runs in worker threads.
+    """
+    problem = task.problem
+    
+    with task_trace(task):
+      with step("directory"):
+        state = await self.aenv_state(task.env)
+        directory = state.directory
+        repository_structure = await aget_repository_structure(state, problem)
+      
+      with step("a"):
+        relevant_files: list[str] = (await apredict(
+          a,
+          gpt4o,
+          repository_structure=repository_structure,
+          github_problem_description=problem,
+        )).full_paths
+      logger.debug(f"Relevant files: {relevant_files}")
+      
+      relevant_files_skeleton, skeleton_tokens = await asyncio.to_thread(
+        directory.get_budgeted_skeleton, relevant_files, SKELETON_TOKEN_BUDGET
+      )
+      logger.info(f'Relevant files skeleton: {skeleton_tokens} tokens')
+      
+      with step("b"):
+        potential_problem_locations: list[ProblemLocation] = (await apredict(
+          b,
+          gpt4o,
+          github_problem_description=problem,
+          skeleton_of_relevant_files=relevant_files_skeleton,
+        )).locations
+      logger.info(f'Potential problem locations: {potential_problem_locations}')
+      
+      with step("locations"):
+        relevant_files_skeleton = await asyncio.to_thread(
+          get_locations_skeleton, state, relevant_files, potential_problem_locations
+        )
+      
+      disk_cache = {}
+      
+      async def generate_sample() -> List[SearchReplaceEdit]:
+        try:
+          edits = (await apredict(
+            c,
+            gpt4o_with_temp,
+            github_problem_description=problem,
+            skeleton_of_relevant_files=relevant_files_skeleton,
+            potential_problem_locations=potential_problem_locations,
+          )).edits
+          logger.debug(f'Sample: {edits}')
+          return await asyncio.to_thread(applying_sample, edits, directory.root_path, disk_cache)
+        except Exception as e:
+          logger.warning(f"Failed to generate sample: {e}")
+          return None
+      
+      with step("c"):
+        samples = await asample_until_consensus(
+          generate_sample,
+          n_samples=N_SAMPLES,
+          tally=tally_votes,
+          max_in_flight=MAX_SAMPLES_IN_FLIGHT,
+          stop_early=not RERANK_BY_TESTS,
+        )
+      
+      # Reranking, and running tests in "tests" mode, are blocking, so they run in a worker thread
+      with step("d"):
+        reranked_edits = await asyncio.to_thread(
+          d, samples, root_path=directory.root_path, mode=RERANK_MODE, test_paths=RERANK_TESTS
+        )
+      log_edits(reranked_edits)
+    return reranked_edits
+
+_default_agent = None
+_default_agent_lock = threading.Lock()
+
+def get_agent() -> AlModAgent:
+  """The process-wide agent behind main() and main_async(), so they reuse env state too"""
+  global _default_agent
+  with _default_agent_lock:
+    if _default_agent is None:
+      _default_agent = AlModAgent()
+      _default_agent.setup()
+    return _default_agent
+
+def main(task: Task) -> List[SearchReplaceEdit]:
+  return get_agent().run(task)
+
+async def main_async(task: Task) -> List[SearchReplaceEdit]:
+  """Async version of main; see AlModAgent.arun"""
+  return await get_agent().arun(task)
     
     
 if __name__ == "__main__":
@@ -118,4 +411,3 @@ if __name__ == "__main__":
     env="kg-gen-c88908c"
   )
   main(task)
-
@@ -1,83 +1,151 @@
+import ast
+import difflib
+import hashlib
+import io
 import json
-import os
+import logging
 import re
+import textwrap
+import tokenize
 from collections import Counter
-from typing import List, Dict, Tuple, Any, Optional
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
 
 from ..steps.c_get_edits import SearchReplaceEdit
+from ..utils.overlay import Overlay, parse_search_replace
+from ..utils.testrun import DEFAULT_TIMEOUT, run_candidates
 
+logger = logging.getLogger(__name__)
 
-def extract_search_replace_content(edit_text: str) -> Tuple[str, str]:
+# Samples differing only in message literals at least this similar vote together
+CLUSTER_SIMILARITY = 0.9
+
+# Calls whose string arguments are messages for people; exception constructors count too
+MESSAGE_CALLS = {"print", "debug", "info", "warning", "warn", "error", "exception", "critical", "log", "fail", "skip"}
+EXCEPTION_SUFFIXES = ("Error", "Exception", "Warning")
+
+# Tokens that carry no meaning once layout is normalized
+LAYOUT_TOKENS = {
+    tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT,
+    tokenize.DEDENT, tokenize.ENCODING, tokenize.ENDMARKER,
+}
+
+
+@lru_cache(maxsize=4096)
+def code_tokens(code: str) -> Optional[tuple]:
     """
-    Extract the search and replace content from a search/replace edit.
+    Python tokens of a code fragment as (type, string) pairs, without comments or layout.
     
-    Args:
-        edit_text: The search/replace edit text
-        
     Returns:
-        Tuple of (search_content, replace_content)
+        The tokens, or None if the fragment can't be tokenized
     """
-    search_pattern = r'<<<<<<< SEARCH\n(.*?)\n=======\n'
-    replace_pattern = r'=======\n(.*?)\n>>>>>>> REPLACE'
-    
-    search_match = re.search(search_pattern, edit_text, re.DOTALL)
-    replace_match = re.search(replace_pattern, edit_text, re.DOTALL)
-    
-    search_content = search_match.group(1) if search_match else ""
-    replace_content = replace_match.group(1) if replace_match else ""
-    
-    return search_content, replace_content
+    try:
+        tokens = tokenize.generate_tokens(io.StringIO(textwrap.dedent(code)).readline)
+        return tuple((token.type, token.string) for token in tokens if token.type not in LAYOUT_TOKENS)
+    except (tokenize.TokenError, SyntaxError):
+        return None
 
 
-def remove_comments_and_whitespace(code: str) -> str:
+@lru_cache(maxsize=4096)
+def normalize_code(code: str) -> str:
     """
-    Remove comments and normalize whitespace in code.
-    This is a simplified version of the reference implementation.
+    Normalize a code fragment so that formatting and comments don't matter.
+    Fragments that parse are compared by their AST, others by their tokens without
+    comments or layout. Either way a '#' inside a string literal is kept.
     
     Args:
         code: The code to normalize
         
     Returns:
-        Normalized code
+        Normalized code, prefixed with the fragment's indentation
     """
-    # Remove Python comments
-    code = re.sub(r'#.*$', '', code, flags=re.MULTILINE)
-    
-    # Remove empty lines
-    code = re.sub(r'\n\s*\n', '\n', code)
+    lines = [line for line in code.split('\n') if line.strip()]
+    indent = min((len(line) - len(line.lstrip()) for line in lines), default=0)
+    try:
+        return f"{indent}:{ast.dump(ast.parse(textwrap.dedent(code)))}"
+    except (SyntaxError, ValueError):
+        pass
+    tokens = code_tokens(code)
+    if tokens is None:
+        return f"{indent}:" + " ".join(code.split())
+    return f"{indent}:" + " ".join(string for _, string in tokens)
+
+
+def message_tokens(tokens: tuple) -> List[bool]:
+    """
+    Which tokens are inside the arguments of a message call, e.g. raise ValueError(...),
+    logger.info(...) or print(...).
+    """
+    flags = []
+    # Whether each open bracket is the argument list of a message call
+    stack = []
+    previous = None
+    for kind, string in tokens:
+        flags.append(any(stack))
+        if kind == tokenize.OP and string in "([{":
+            stack.append(
+                string == "(" and previous is not None and previous[0] == tokenize.NAME
+                and (previous[1] in MESSAGE_CALLS or previous[1].endswith(EXCEPTION_SUFFIXES))
+            )
+        elif kind == tokenize.OP and string in ")]}" and stack:
+            stack.pop()
+        previous = (kind, string)
+    return flags
+
+
+def string_skeleton(edit: SearchReplaceEdit) -> tuple[str, str]:
+    """
+    Split an edit into its code with message literals blanked out, and the message literals themselves.
+    Edits with the same skeleton differ only in messages. Message literals are strings with
+    whitespace passed to a message call; identifier-like strings such as dict keys, attribute
+    names or format specs stay in the skeleton, so edits that differ in them never merge.
     
-    # Normalize whitespace
-    code = re.sub(r'\s+', ' ', code)
+    Returns:
+        Tuple of (skeleton, message literals)
+    """
+    skeleton, strings = [edit.full_file_path], []
+    for search, replace in parse_search_replace(edit.search_replace_edit) or [("", edit.search_replace_edit)]:
+        for code in (search, replace):
+            tokens = code_tokens(code)
+            if tokens is None:
+                skeleton.append(" ".join(code.split()))
+                continue
+            parts = []
+            for (kind, string), in_message in zip(tokens, message_tokens(tokens)):
+                if kind == tokenize.STRING and in_message and re.search(r"\s", string):
+                    parts.append('""')
+                    strings.append(string)
+                else:
+                    parts.append(string)
+            skeleton.append(" ".join(parts))
+        skeleton.append("|")
+    return "\n".join(skeleton), "\n".join(strings)
+
+
+def normalize_edit(edit: SearchReplaceEdit) -> str:
+    """
+    Normalize every SEARCH/REPLACE block of an edit, keeping the file it applies to.
     
-    return code.strip()
+    Args:
+        edit: The edit to normalize
+        
+    Returns:
+        Normalized edit text
+    """
+    blocks = parse_search_replace(edit.search_replace_edit)
+    if not blocks:
+        return f"{edit.full_file_path}\n{edit.search_replace_edit.strip()}"
+    return edit.full_file_path + "".join(
+        f"\nSEARCH:{normalize_code(search)}|REPLACE:{normalize_code(replace)}" for search, replace in blocks
+    )
 
 
-# Helper function to normalize a patch
 def normalize_patch(edit: SearchReplaceEdit) -> str:
     """
-    Normalize a patch by removing whitespace, comments, and other non-essential differences.
+    Hash of the normalized edit, so equal patches up to formatting and comments share a key.
     This helps with deduplication and voting.
     """
-    try:
-        # Extract search and replace content
-        search_content, replace_content = extract_search_replace_content(edit.search_replace_edit)
-        
-        # Normalize the search and replace content
-        normalized_search = remove_comments_and_whitespace(search_content)
-        normalized_replace = remove_comments_and_whitespace(replace_content)
-        
-        # Combine the normalized content
-        normalized = f"SEARCH:{normalized_search}|REPLACE:{normalized_replace}"
-        
-        # Log the normalization for debugging
-        print(f"DEBUG - Normalizing patch for file: {edit.full_file_path}")
-        print(f"DEBUG - Original length: {len(edit.search_replace_edit)}, Normalized length: {len(normalized)}")
-        
-        return normalized
-    except Exception as e:
-        print(f"ERROR - Failed to normalize patch: {e}")
-        # Fall back to simple normalization
-        return edit.search_replace_edit.strip()
+    return hashlib.sha256(normalize_edit(edit).encode()).hexdigest()[:16]
 
 
 # Class to handle JSON encoding of sets
@@ -88,6 +156,19 @@ class SetEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def normalize_sample(sample: List[SearchReplaceEdit]) -> str:
+    """
+    Combine the normalized patches of a sample into the single string that is voted on.
+    
+    Args:
+        sample: List of SearchReplaceEdit objects
+        
+    Returns:
+        Order-independent normalized representation of the sample
+    """
+    return "|".join(sorted(normalize_patch(edit) for edit in sample))
+
+
 def normalize_samples(samples: List[List[SearchReplaceEdit]]) -> List[Dict[str, Any]]:
     """
     Normalize all samples.
@@ -99,144 +180,325 @@ def normalize_samples(samples: List[List[SearchReplaceEdit]]) -> List[Dict[str,
         List of normalized samples with their metadata
     """
     normalized_samples = []
-    
-    print(f"DEBUG - Normalizing {len(samples)} samples")
-    
     for i, sample in enumerate(samples):
-        print(f"DEBUG - Sample {i} has {len(sample)} edits")
-        
-        # Normalize each edit in the sample
-        normalized_edits = []
-        for edit in sample:
-            normalized_patch = normalize_patch(edit)
-            normalized_edits.append({
-                "normalized_patch": normalized_patch,
-                "patch": edit.search_replace_edit,
-                "full_file_path": edit.full_file_path
-            })
-        
-        # Create a combined normalized representation of the entire sample
-        # This is used for voting
-        combined_normalized = "|".join(sorted([e["normalized_patch"] for e in normalized_edits]))
-        
+        skeletons = sorted(string_skeleton(edit) for edit in sample)
         normalized_samples.append({
             "sample_id": i,
-            "normalized_sample": combined_normalized,
+            # Exact key, used for voting and deduplication
+            "normalized_sample": normalize_sample(sample),
+            # Code without message literals, and the messages, used for fuzzy clustering
+            "skeleton": "\n".join(skeleton for skeleton, _ in skeletons),
+            "strings": "\n".join(strings for _, strings in skeletons),
             "edits": sample,  # Keep the original edits
-            "normalized_edits": normalized_edits  # Store normalized edits for debugging
         })
-    
     return normalized_samples
 
 
-def majority_voting(normalized_samples: List[Dict[str, Any]]) -> List[SearchReplaceEdit]:
+def cluster_samples(
+    normalized_samples: List[Dict[str, Any]],
+    threshold: float = CLUSTER_SIMILARITY,
+) -> List[List[List[Dict[str, Any]]]]:
     """
-    Perform majority voting on the normalized samples.
+    Group samples with the same normalized key, then merge groups that differ only in
+    nearly identical message literals, e.g. a reworded error message. Differences in
+    code, names, numbers or any other string always keep groups apart. Groups are compared once per
+    distinct key, so the cost grows with the number of unique patches rather than
+    the number of samples.
     
     Args:
         normalized_samples: List of normalized samples with their metadata
+        threshold: Minimum difflib similarity ratio of the message literals for two groups to be merged
         
     Returns:
-        List of SearchReplaceEdit objects from the winning sample
+        Clusters in order of first appearance, each a list of groups of identical samples
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for sample in normalized_samples:
+        if sample["normalized_sample"].strip():
+            groups.setdefault(sample["normalized_sample"], []).append(sample)
+    
+    clusters = []
+    # Clusters with each skeleton, with the message literals of their first group
+    by_skeleton: Dict[str, List[tuple]] = {}
+    for group in groups.values():
+        strings = group[0]["strings"]
+        candidates = by_skeleton.setdefault(group[0]["skeleton"], [])
+        for cluster, representative in candidates:
+            matcher = difflib.SequenceMatcher(None, representative, strings, autojunk=False)
+            if (matcher.real_quick_ratio() >= threshold
+                    and matcher.quick_ratio() >= threshold
+                    and matcher.ratio() >= threshold):
+                cluster.append(group)
+                break
+        else:
+            clusters.append([group])
+            candidates.append((clusters[-1], strings))
+    return clusters
+
+
+def tally_votes(samples: List[List[SearchReplaceEdit]]) -> Counter:
     """
-    print(f"DEBUG - Performing majority voting on {len(normalized_samples)} samples")
+    Count the votes for each cluster of near-identical samples, as majority_voting does.
+    Used to stop sampling early on the same notion of consensus that decides the vote.
     
-    if not normalized_samples:
+    Args:
+        samples: List of sample edits, where each sample is a list of SearchReplaceEdit objects
+        
+    Returns:
+        Votes keyed on the normalized form of each cluster's first sample
+    """
+    return Counter({
+        cluster[0][0]["normalized_sample"]: sum(len(group) for group in cluster)
+        for cluster in cluster_samples(normalize_samples(samples))
+    })
+
+
+def majority_voting(normalized_samples: List[Dict[str, Any]]) -> List[SearchReplaceEdit]:
+    """
+    Perform majority voting on clusters of near-identical normalized samples.
+    
+    Args:
+        normalized_samples: List of normalized samples with their metadata
+        
+    Returns:
+        List of SearchReplaceEdit objects from the most common sample of the winning cluster
+    """
+    clusters = cluster_samples(normalized_samples)
+    if not clusters:
         return []
     
-    # Count votes for each normalized sample
-    vote = Counter()
-    first_appear_idx = {}
+    # Get the cluster with the most votes, then its most common exact sample.
+    # If there's a tie, choose the one that appeared first
+    def votes(groups: List[List[Dict[str, Any]]]) -> tuple:
+        return (sum(len(group) for group in groups), -groups[0][0]["sample_id"])
     
-    for sample in normalized_samples:
-        sample_key = sample["normalized_sample"]
-        if sample_key.strip():
-            vote[sample_key] += 1
-            if sample_key not in first_appear_idx:
-                first_appear_idx[sample_key] = sample["sample_id"]
+    majority_cluster = max(clusters, key=votes)
+    majority_group = max(majority_cluster, key=lambda group: votes([group]))
     
-    print(f"DEBUG - Vote counts: {dict(vote)}")
+    logger.info(f"Majority vote: sample {majority_group[0]['sample_id']} with {votes(majority_cluster)[0]} votes "
+          f"({len(clusters)} clusters from {len(normalized_samples)} samples)")
+    return majority_group[0]["edits"]
+
+
+def format_edits(edits: List[SearchReplaceEdit]) -> str:
+    """
+    Pretty print edits, showing only their file headers and search/replace blocks.
     
-    # Find the majority vote
-    if not vote:
-        return []
+    Args:
+        edits: List of SearchReplaceEdit objects
+        
+    Returns:
+        Readable text of the edits
+    """
+    output = []
+    for i, edit in enumerate(edits):
+        output.append(f"\nEdit {i + 1}:")
+        output.append(f"File: {edit.full_file_path}")
+        output.append("Edit:")
+        lines = edit.search_replace_edit.split('\n')
+        # Unfenced edits are all code
+        in_code_block = '```' not in edit.search_replace_edit
+        for line in lines:
+            if line.startswith('```'):
+                in_code_block = not in_code_block
+                continue
+            if line.startswith('###') or '<<<<<<< SEARCH' in line:
+                output.append('\n' + line)
+            elif '=======' in line or '>>>>>>> REPLACE' in line:
+                output.append(line)
+            elif in_code_block:
+                output.append('  ' + line)
+        output.append("-" * 50)
+    return "\n".join(output)
+
+
+def apply_sample(sample: List[SearchReplaceEdit], root_path: str, disk_cache: Dict[str, Optional[str]]) -> Overlay:
+    """
+    Apply a sample's edits to an in-memory overlay of the repository.
     
-    # Get the sample with the most votes
-    # If there's a tie, choose the one that appeared first
-    majority_sample_key = max(vote.keys(), key=lambda k: (vote[k], -first_appear_idx[k]))
-    majority_sample_id = first_appear_idx[majority_sample_key]
+    Args:
+        sample: List of SearchReplaceEdit objects
+        root_path: Root of the repository the edits are for
+        disk_cache: File contents read from disk, shared between samples
+        
+    Returns:
+        The overlay holding the edited files
+        
+    Raises:
+        ValueError: If the sample is empty, an edit doesn't apply or an edited Python file doesn't compile
+    """
+    if not sample:
+        raise ValueError("no edits")
+    overlay = Overlay(root_path, disk_cache)
+    for edit in sample:
+        overlay.apply(edit.full_file_path, edit.search_replace_edit)
+    return overlay
+
+
+def validate_sample(sample: List[SearchReplaceEdit], root_path: str, disk_cache: Dict[str, Optional[str]]) -> Optional[str]:
+    """
+    Check that a sample applies to the repository.
     
-    print(f"DEBUG - Majority vote: Sample {majority_sample_id} with {vote[majority_sample_key]} votes")
+    Returns:
+        None if every edit applies and the edited Python files compile, else the reason it doesn't
+    """
+    try:
+        apply_sample(sample, root_path, disk_cache)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def applying_sample(
+    sample: List[SearchReplaceEdit],
+    root_path: str,
+    disk_cache: Dict[str, Optional[str]],
+) -> Optional[List[SearchReplaceEdit]]:
+    """
+    Check a sample as it is drawn, so samples that don't apply never count toward consensus.
     
-    # Return the edits from the winning sample
-    for sample in normalized_samples:
-        if sample["sample_id"] == majority_sample_id:
-            return sample["edits"]
+    Args:
+        sample: List of SearchReplaceEdit objects
+        root_path: Root of the repository the edits are for
+        disk_cache: File contents read from disk, shared between samples
+        
+    Returns:
+        The sample if it applies cleanly, else None, which the sampler treats as a failed draw
+    """
+    reason = validate_sample(sample, root_path, disk_cache)
+    if reason is not None:
+        logger.info(f"Rejected sample: {reason}")
+        return None
+    return sample
+
+
+def filter_valid_samples(samples: List[List[SearchReplaceEdit]], root_path: str) -> List[List[SearchReplaceEdit]]:
+    """
+    Drop samples whose edits don't apply cleanly or leave a file that doesn't compile.
     
-    # This should never happen
-    return []
+    Args:
+        samples: List of sample edits, where each sample is a list of SearchReplaceEdit objects
+        root_path: Root of the repository the edits are for
+        
+    Returns:
+        The valid samples, in their original order
+    """
+    disk_cache = {}
+    valid_samples = []
+    for i, sample in enumerate(samples):
+        reason = validate_sample(sample, root_path, disk_cache)
+        if reason is None:
+            valid_samples.append(sample)
+        else:
+            logger.info(f"Rejected sample {i}: {reason}")
+    logger.info(f"{len(valid_samples)} of {len(samples)} samples apply cleanly")
+    return valid_samples
 
 
-def d(samples: Optional[List[List[SearchReplaceEdit]]] = None) -> List[SearchReplaceEdit]:
+def test_execution_ranking(
+    normalized_samples: List[Dict[str, Any]],
+    root_path: str,
+    test_paths: Optional[List[str]] = None,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> List[SearchReplaceEdit]:
+    """
+    Rank samples by how many tests pass with their edits applied.
+    
+    Samples are deduplicated on their normalized form first, so tests run once per
+    unique patch, each in its own copy of the repository and all in parallel.
+    Ties are broken by votes, then by which sample appeared first.
+    
+    Args:
+        normalized_samples: List of normalized samples with their metadata, all of which apply cleanly
+        root_path: Root of the repository the edits are for
+        test_paths: Tests to run for each candidate. None runs the whole suite.
+        timeout: Seconds before a candidate's test run is killed
+        
+    Returns:
+        List of SearchReplaceEdit objects from the best sample
+    """
+    candidates = {}
+    for sample in normalized_samples:
+        candidate = candidates.setdefault(sample["normalized_sample"], {"sample": sample, "votes": 0})
+        candidate["votes"] += 1
+    candidates = list(candidates.values())
+    
+    disk_cache = {}
+    files = [apply_sample(candidate["sample"]["edits"], root_path, disk_cache).files for candidate in candidates]
+    logger.info(f"Running tests for {len(candidates)} unique candidates of {len(normalized_samples)} samples")
+    results = run_candidates(root_path, files, test_paths=test_paths, timeout=timeout)
+    
+    for candidate, result in zip(candidates, results):
+        status = "timed out" if result["timed_out"] else f"{result['passed']}/{result['tests']} passed"
+        logger.info(f"Sample {candidate['sample']['sample_id']} ({candidate['votes']} votes): {status}")
+    
+    best, _ = max(
+        zip(candidates, results),
+        key=lambda pair: (pair[1]["passed"], pair[0]["votes"], -pair[0]["sample"]["sample_id"]),
+    )
+    return best["sample"]["edits"]
+
+
+def d(
+    samples: Optional[List[List[SearchReplaceEdit]]] = None,
+    root_path: Optional[str] = None,
+    mode: str = "vote",
+    test_paths: Optional[List[str]] = None,
+    test_timeout: float = DEFAULT_TIMEOUT,
+) -> List[SearchReplaceEdit]:
     """
     Main reranking function.
     
     Args:
         samples: List of sample edits, where each sample is a list of SearchReplaceEdit objects.
                 If None, this function will be a no-op and return an empty list.
+        root_path: Root of the repository the edits are for. If given, samples that don't
+                apply cleanly or don't compile are dropped before voting.
+        mode: "vote" for majority voting on normalized patches, or "tests" to rank by
+                passing tests (requires root_path and test_paths)
+        test_paths: Tests to run for each candidate in "tests" mode. Without any, "tests" mode
+                falls back to voting, since a whole suite may be slow or call paid APIs.
+        test_timeout: Seconds before a candidate's test run is killed in "tests" mode
     
     Returns:
         List of SearchReplaceEdit objects from the winning sample
     """
     if samples is None:
-        print("No samples provided for reranking.")
+        logger.warning("No samples provided for reranking.")
         return []
     
-    print("\n=== Reranking Edits ===")
-    print(f"DEBUG - Received {len(samples)} samples for reranking")
+    logger.info(f"Reranking {len(samples)} samples")
     
     # Check if samples is empty
     if len(samples) == 0:
-        print("WARNING: Empty samples list provided for reranking.")
+        logger.warning("Empty samples list provided for reranking.")
         return []
     
-    # Check the structure of the samples
-    print(f"DEBUG - First sample has {len(samples[0])} edits")
+    if root_path is not None:
+        samples = filter_valid_samples(samples, root_path)
+        if not samples:
+            logger.warning("No samples apply cleanly.")
+            return []
     
     # Normalize samples
     normalized_samples = normalize_samples(samples)
     
-    # Perform majority voting at the sample level
-    reranked_edits = majority_voting(normalized_samples)
+    if mode == "tests" and not test_paths:
+        logger.warning('No test_paths for mode="tests", falling back to majority voting')
+        mode = "vote"
     
-    print(f"Reranked to select the best sample with {len(reranked_edits)} edits.")
+    if mode == "tests":
+        if root_path is None:
+            raise ValueError('mode="tests" requires root_path')
+        reranked_edits = test_execution_ranking(normalized_samples, root_path, test_paths, test_timeout)
+    elif mode == "vote":
+        # Perform majority voting at the sample level
+        reranked_edits = majority_voting(normalized_samples)
+    else:
+        raise ValueError(f"Unknown rerank mode: {mode}")
     
-    # Print the reranked edits
-    for i, edit in enumerate(reranked_edits):
-        print(f"\nReranked Edit {i + 1}:")
-        print(f"File: {edit.full_file_path}")
-        print("Edit:")
-        # Pretty print the search/replace blocks
-        lines = edit.search_replace_edit.split('\n')
-        in_code_block = False
-        for line in lines:
-            if line.startswith('```'):
-                in_code_block = not in_code_block
-                continue
-            if line.startswith('###'):
-                print('\n' + line)
-                continue
-            if '<<<<<<< SEARCH' in line:
-                print('\n' + line)
-                continue
-            if '=======' in line:
-                print(line)
-                continue  
-            if '>>>>>>> REPLACE' in line:
-                print(line)
-                continue
-            if in_code_block:
-                print('  ' + line)
-        print("-" * 50)
+    logger.info(f"Reranked to select the best sample with {len(reranked_edits)} edits.")
+    
+    logger.debug("Reranked edits:\n" + format_edits(reranked_edits))
     
     return reranked_edits
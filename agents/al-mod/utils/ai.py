@@ -1,25 +1,52 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import dspy
 
+from .gateway import GatewayLM, get_gateway
+
 
 load_dotenv()
-client = OpenAI()
 
-gpt4o = dspy.LM("openai/gpt-4o", temperature=0)
+gpt4o = GatewayLM("openai/gpt-4o", temperature=0)
 dspy.configure(lm=gpt4o)
 
-def ai(system_prompt="You are a helpful assistant", user_prompt="Hello"):
-    response = client.chat.completions.create(
-        # model="deepseek-chat",
-        model="gpt-4o-mini",
+# Default model for ai(); also part of cache keys for anything derived from it
+MODEL = "gpt-4o-mini"
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Roughly the embedding model's 8191 token input limit, in characters
+EMBEDDING_MAX_CHARS = 24000
+EMBEDDING_BATCH_SIZE = 256
+
+def ai(system_prompt="You are a helpful assistant", user_prompt="Hello", model=MODEL):
+    result = get_gateway().complete(
+        # model="openai/deepseek-chat",
+        model=f"openai/{model}",
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ],
-        stream=False,
     )
-    return response.choices[0].message.content
+    return result["outputs"][0]
+
+
+async def aai(system_prompt="You are a helpful assistant", user_prompt="Hello", model=MODEL):
+    """Async version of ai()"""
+    result = await get_gateway().acomplete(
+        model=f"openai/{model}",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+    )
+    return result["outputs"][0]
+
+
+def embed(texts, model=EMBEDDING_MODEL):
+    """Embed texts in batches, returning one vector per text"""
+    vectors = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = [text[:EMBEDDING_MAX_CHARS] or " " for text in texts[i:i + EMBEDDING_BATCH_SIZE]]
+        vectors.extend(get_gateway().embed(f"openai/{model}", batch))
+    return vectors
 
 
 if __name__ == "__main__":
@@ -0,0 +1,18 @@
+"""Crash-safe file writes for the caches and indexes kept in dir_caches"""
+
+import os
+import tempfile
+from typing import Union
+
+def write_atomic(path: str, content: Union[str, bytes]) -> None:
+  """Write a file so readers never see it half written"""
+  directory = os.path.dirname(os.path.abspath(path))
+  os.makedirs(directory, exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb' if isinstance(content, bytes) else 'w') as f:
+      f.write(content)
+    os.replace(tmp_path, path)
+  except BaseException:
+    os.remove(tmp_path)
+    raise
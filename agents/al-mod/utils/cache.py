@@ -0,0 +1,52 @@
+"""Persistent, content-addressed cache for LLM-generated file descriptions"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+def content_hash(content: bytes) -> str:
+  """Hash raw file bytes into a cache key"""
+  return hashlib.sha256(content).hexdigest()
+
+class DescriptionCache:
+  """SQLite-backed store of file descriptions keyed on (content hash, model)
+  
+  Keys only depend on file contents, so unchanged files hit the cache no matter
+  where they live or which env they belong to. Safe to share across threads.
+  """
+  
+  def __init__(self, path: str):
+    """Initialize DescriptionCache
+    
+    Args:
+      path (str): Path to the SQLite database file, created if missing
+    """
+    self.path = path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(path, check_same_thread=False)
+    with self.lock, self.conn:
+      self.conn.execute(
+        "CREATE TABLE IF NOT EXISTS descriptions ("
+        "content_hash TEXT NOT NULL, model TEXT NOT NULL, description TEXT NOT NULL, "
+        "PRIMARY KEY (content_hash, model))"
+      )
+  
+  def get(self, key: str, model: str) -> Optional[str]:
+    """Get the cached description for a content hash and model, or None"""
+    with self.lock:
+      row = self.conn.execute(
+        "SELECT description FROM descriptions WHERE content_hash = ? AND model = ?",
+        (key, model),
+      ).fetchone()
+    return row[0] if row else None
+  
+  def set(self, key: str, model: str, description: str) -> None:
+    """Store the description for a content hash and model"""
+    with self.lock, self.conn:
+      self.conn.execute(
+        "INSERT OR REPLACE INTO descriptions (content_hash, model, description) VALUES (?, ?, ?)",
+        (key, model, description),
+      )
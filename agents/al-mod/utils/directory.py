@@ -1,13 +1,33 @@
 """Get the folder structure in a string, given a folder path, with AI-generated descriptions"""
 
+import asyncio
 import os
-from .ai import ai
+from .ai import ai, aai, MODEL
+from .atomic import write_atomic
+from .cache import DescriptionCache, content_hash
+from .gateway import DIR_CACHES
+from .ratelimit import RateLimiter
+from .ignore import IgnoreMatcher
+from .skeleton import get_outline, render_signatures
+from .tokens import count_tokens
+from .trace import in_context
+from concurrent.futures import Future, ThreadPoolExecutor
 import html
+import json
+import logging
+import threading
+import xml.etree.ElementTree as ET
 from typing import Optional
-import re
 
-# Paths to ignore
-IGNORE_PATHS = {
+logger = logging.getLogger(__name__)
+
+# Shared across envs, since descriptions are keyed on file content rather than path
+DESCRIPTION_CACHE_PATH = os.path.join(DIR_CACHES, 'descriptions.sqlite')
+
+DESCRIBE_SYSTEM_PROMPT = "You are a helpful assistant that writes 1 sentence summaries of files."
+
+# Paths to ignore, as .gitignore patterns
+IGNORE_PATHS = [
   # Default folders
   "__pycache__",
   "scratch",
@@ -17,16 +37,69 @@ IGNORE_PATHS = {
   "*.pyo",
   "*.pyd",
   ".DS_Store"
-}
+]
+
+EMPTY_OUTLINE = {'classes': [], 'functions': [], 'variables': []}
 
 def escape_xml(text: str) -> str:
   """Escape special characters for XML"""
   return html.escape(text, quote=True)
 
+def format_file(file_path: str, content: str, structure: dict) -> str:
+  """Format one file's structure information and content as a <file> XML element"""
+  output = []
+  
+  # Start file tag
+  output.append(f'  <file path="{escape_xml(file_path)}">')
+  
+  # Add structure information
+  if structure['classes'] or structure['functions'] or structure['variables']:
+    output.append('    <structure>')
+  
+    # Add classes
+    for cls in structure['classes']:
+      output.append(f'      <class name="{escape_xml(cls["name"])}" start_line="{cls["start_line"]}" end_line="{cls["end_line"]}">')
+      for method in cls['methods']:
+        output.append(f'        <method name="{escape_xml(method["name"])}" start_line="{method["start_line"]}" end_line="{method["end_line"]}" />')
+      output.append('      </class>')
+  
+    # Add functions
+    for func in structure['functions']:
+      output.append(f'      <function name="{escape_xml(func["name"])}" start_line="{func["start_line"]}" end_line="{func["end_line"]}" />')
+  
+    # Add top-level variables
+    for var in structure['variables']:
+      output.append(f'      <variable name="{escape_xml(var["name"])}" start_line="{var["start_line"]}" end_line="{var["end_line"]}" />')
+  
+    output.append('    </structure>')
+  
+  # Add file content with proper CDATA handling
+  # CDATA sections can't contain the sequence ']]>', so we need to split and rejoin if it exists
+  output.append('    <content><![CDATA[')
+  # Replace any ']]>' in the content with ']]]]><![CDATA[>' to properly escape it in CDATA
+  safe_content = content.replace(']]>', ']]]]><![CDATA[>')
+  output.append(safe_content)
+  output.append('    ]]></content>')
+  
+  # Close file tag
+  output.append('  </file>')
+  return "\n".join(output)
+
 class NLDirectory:
   """Natural language directory class for getting folder structure with brief LLM-generated file descriptions"""
   
-  def __init__(self, root_path: str, max_depth: Optional[int] = None, structure: Optional[str] = None):
+  def __init__(
+    self,
+    root_path: str,
+    max_depth: Optional[int] = None,
+    structure: Optional[str] = None,
+    cache_path: Optional[str] = DESCRIPTION_CACHE_PATH,
+    model: str = MODEL,
+    max_workers: int = 16,
+    requests_per_minute: Optional[float] = 500,
+    structure_path: Optional[str] = None,
+    lazy: bool = False,
+  ):
     """Initialize NLDirectory
     
     Args:
@@ -36,38 +109,67 @@ class NLDirectory:
                                None means no limit. Defaults to None.
       structure (str, optional): Pre-existing directory structure in XML format.
                                If provided, skips the directory scanning process.
+      cache_path (str, optional): SQLite file caching descriptions per (file content hash, model).
+                               None disables the cache. Defaults to DESCRIPTION_CACHE_PATH.
+      model (str): Model used to describe files. Defaults to ai.MODEL.
+      max_workers (int): Maximum number of files described concurrently. Defaults to 16.
+      requests_per_minute (float, optional): Cap on description requests per minute
+                               across all workers. None means no limit. Defaults to 500.
+      structure_path (str, optional): Path of a cached XML structure to refresh incrementally.
+                               A manifest of per-file (mtime, size, hash) is kept next to it
+                               so only added or modified files are re-described.
+      lazy (bool): Build only a cheap tree of file names and sizes, with no LLM calls.
+                               Descriptions are generated for subtrees passed to expand()
+                               and files passed to expand_files(). Defaults to False.
     """
-    self.root_path = root_path
-    self.max_depth = max_depth
+    self._setup(root_path, max_depth, cache_path, model, max_workers, requests_per_minute, lazy)
     
     # If structure is provided, use it directly
     if structure is not None:
       self.structure = structure
       return
     
-    # Start with default ignore paths
-    self.ignore_paths = set(IGNORE_PATHS)
-    
-    # Add patterns from .gitignore if it exists
-    gitignore_path = os.path.join(root_path, '.gitignore')
-    if os.path.exists(gitignore_path):
-      with open(gitignore_path, 'r') as f:
-        for line in f:
-          line = line.strip()
-          # Skip empty lines and comments
-          if line and not line.startswith('#'):
-            self.ignore_paths.add(line.strip('/'))
-    
-    self.structure = self.get_structure()
+    if lazy:
+      self.entries = self.walk(max_depth=self.max_depth)
+      self.descriptions = {}
+      self.structure = self.render(self.entries, self.descriptions)
+    elif structure_path is not None:
+      self.structure = self.refresh(structure_path)
+    else:
+      self.structure = self.get_structure()
   
-  def get_skeleton(self, file_paths: list[str]) -> str:
-    """Get raw contents of specified files with structure information in XML format
+  def _setup(
+    self,
+    root_path: str,
+    max_depth: Optional[int],
+    cache_path: Optional[str],
+    model: str,
+    max_workers: int,
+    requests_per_minute: Optional[float],
+    lazy: bool,
+  ) -> None:
+    """Settings shared by __init__ and aopen; see __init__ for the arguments"""
+    self.root_path = root_path
+    self.max_depth = max_depth
+    self.model = model
+    self.cache = DescriptionCache(cache_path) if cache_path else None
+    self.max_workers = max_workers
+    self.rate_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+    self.lazy = lazy
+    # Files being described on demand, so concurrent expansions describe each file once
+    self.expanding: dict[str, Future] = {}
+    self.expand_lock = threading.Lock()
+    # Default ignore patterns, overridden by .gitignore files found while walking
+    self.ignore = IgnoreMatcher.for_root(root_path, IGNORE_PATHS)
+  
+  def read_files(self, file_paths: list[str]) -> tuple[dict[str, str], dict[str, dict]]:
+    """Read files and extract their structure, skipping paths that don't exist
     
     Args:
-      file_paths (list[str]): List of file paths to get contents for
+      file_paths (list[str]): List of file paths relative to root_path
       
     Returns:
-      str: Combined raw contents of all specified files with structure information in XML format
+      tuple[dict[str, str], dict[str, dict]]: Mappings of file path to content and to outline
     """
     file_contents = {}
     file_structures = {}
@@ -78,255 +180,556 @@ class NLDirectory:
         try:
           with open(full_path, 'r') as f:
             content = f.read()
-            file_contents[file_path] = content
-            
-            # Extract classes and functions
-            classes = []
-            functions = []
-            
-            # Simple parsing for Python files
-            if file_path.endswith('.py'):
-              lines = content.split('\n')
-              current_class = None
-              class_stack = []  # Stack to track nested classes
-              function_stack = []  # Stack to track functions/methods
-              
-              for i, line in enumerate(lines):
-                line_num = i + 1  # 1-indexed line numbers
-                stripped_line = line.strip()
-                indentation = len(line) - len(line.lstrip())
-                
-                # Skip empty lines and comments
-                if not stripped_line or stripped_line.startswith('#'):
-                  continue
-                
-                # Match class definitions
-                class_match = re.match(r'^\s*class\s+(\w+)', line)
-                if class_match:
-                  class_name = class_match.group(1)
-                  
-                  # Close any functions at the same or higher indentation level
-                  while function_stack and function_stack[-1]['indentation'] >= indentation:
-                    func = function_stack.pop()
-                    func['end_line'] = line_num - 1
-                  
-                  # Close any classes at the same indentation level
-                  while class_stack and class_stack[-1]['indentation'] == indentation:
-                    cls = class_stack.pop()
-                    cls['end_line'] = line_num - 1
-                  
-                  new_class = {
-                    'name': class_name,
-                    'start_line': line_num,
-                    'end_line': None,
-                    'indentation': indentation,
-                    'methods': []
-                  }
-                  
-                  classes.append(new_class)
-                  class_stack.append(new_class)
-                  current_class = new_class
-                
-                # Match function/method definitions
-                func_match = re.match(r'^\s*def\s+(\w+)', line)
-                if func_match:
-                  func_name = func_match.group(1)
-                  
-                  # Close any functions at the same or higher indentation level
-                  while function_stack and function_stack[-1]['indentation'] >= indentation:
-                    func = function_stack.pop()
-                    func['end_line'] = line_num - 1
-                  
-                  # Determine if this is a method or a standalone function
-                  is_method = False
-                  for cls in reversed(class_stack):
-                    if indentation > cls['indentation']:
-                      is_method = True
-                      method = {
-                        'name': func_name,
-                        'start_line': line_num,
-                        'end_line': None,
-                        'indentation': indentation
-                      }
-                      cls['methods'].append(method)
-                      function_stack.append(method)
-                      break
-                  
-                  if not is_method:
-                    # This is a standalone function
-                    func = {
-                      'name': func_name,
-                      'start_line': line_num,
-                      'end_line': None,
-                      'indentation': indentation,
-                      'file': file_path
-                    }
-                    functions.append(func)
-                    function_stack.append(func)
-              
-              # Close any remaining open functions and classes
-              for func in function_stack:
-                func['end_line'] = len(lines)
-              
-              for cls in class_stack:
-                cls['end_line'] = len(lines)
-            
-            # Clean up the structures by removing temporary fields
-            for cls in classes:
-              if 'indentation' in cls:
-                del cls['indentation']
-              for method in cls['methods']:
-                if 'indentation' in method:
-                  del method['indentation']
-            
-            for func in functions:
-              if 'indentation' in func:
-                del func['indentation']
-            
-            file_structures[file_path] = {
-              'classes': classes,
-              'functions': functions
-            }
+          file_contents[file_path] = content
+          
+          # Extract classes, functions and top-level variables from Python files
+          if file_path.endswith('.py'):
+            file_structures[file_path] = get_outline(content)
+          else:
+            file_structures[file_path] = EMPTY_OUTLINE
             
         except Exception as e:
-          print(f"Error reading file {file_path}: {str(e)}")
+          logger.warning(f"Error reading file {file_path}: {str(e)}")
           file_contents[file_path] = f"# Error reading file: {str(e)}"
-          file_structures[file_path] = {'classes': [], 'functions': []}
+          file_structures[file_path] = EMPTY_OUTLINE
     
-    # Format the content with file paths and structure information in XML
-    output = ['<files>']
-    output.append("<files>")
+    return file_contents, file_structures
+  
+  def get_skeleton(self, file_paths: list[str]) -> str:
+    """Get raw contents of specified files with structure information in XML format
+    
+    Args:
+      file_paths (list[str]): List of file paths to get contents for
+      
+    Returns:
+      str: Combined raw contents of all specified files with structure information in XML format
+    """
+    file_contents, file_structures = self.read_files(file_paths)
     
+    # Format the content with file paths and structure information in XML
+    output = ["<files>"]
     for file_path, content in file_contents.items():
-      structure = file_structures[file_path]
+      output.append(format_file(file_path, content, file_structures[file_path]))
+    output.append("</files>")
+    return "\n".join(output)
+  
+  def get_budgeted_skeleton(
+    self,
+    file_paths: list[str],
+    token_budget: int,
+    locations: Optional[list[tuple[str, Optional[str]]]] = None,
+  ) -> tuple[str, int]:
+    """Get a skeleton of specified files that fits a token budget, in the same XML format as get_skeleton
+    
+    Every file gets its structure plus signatures and docstrings, with function bodies
+    elided to "...". Full bodies are then added for locations in rank order, skipping
+    any that would overflow the budget. Non-Python files are only included in full
+    when they are listed as a whole-file location.
+    
+    Args:
+      file_paths (list[str]): List of file paths to get skeletons for
+      token_budget (int): Maximum number of tokens to fill
+      locations (list[tuple[str, Optional[str]]], optional): Ranked (file path, name) pairs whose
+                               full bodies to include, best first. name may be a function, class
+                               or 'Class.method'; None means the whole file.
+                               Defaults to each of file_paths as a whole file, in order.
+      
+    Returns:
+      tuple[str, int]: The skeleton in XML format and the number of tokens it uses
+    """
+    if locations is None:
+      locations = [(file_path, None) for file_path in file_paths]
+    
+    file_contents, file_structures = self.read_files(file_paths)
+    expanded = {file_path: set() for file_path in file_contents}
+    whole_files = set()
+    
+    def render(file_path: str) -> str:
+      content = file_contents[file_path]
+      if file_path not in whole_files:
+        if file_path.endswith('.py'):
+          content = render_signatures(content, file_structures[file_path], expanded[file_path])
+        else:
+          content = "..."
+      return format_file(file_path, content, file_structures[file_path])
+    
+    rendered = {file_path: render(file_path) for file_path in file_contents}
+    tokens = {file_path: count_tokens(text) for file_path, text in rendered.items()}
+    used = sum(tokens.values())
+    if used > token_budget:
+      logger.warning(f"Skeleton signatures alone use {used} tokens, over the budget of {token_budget}")
+    
+    for file_path, name in locations:
+      if file_path not in file_contents or file_path in whole_files or name in expanded[file_path]:
+        continue
+      if name is None:
+        whole_files.add(file_path)
+      else:
+        expanded[file_path].add(name)
+      text = render(file_path)
+      text_tokens = count_tokens(text)
+      if used - tokens[file_path] + text_tokens > token_budget:
+        # Doesn't fit; undo and try smaller locations further down the ranking
+        whole_files.discard(file_path)
+        expanded[file_path].discard(name)
+        continue
+      used += text_tokens - tokens[file_path]
+      rendered[file_path], tokens[file_path] = text, text_tokens
+    
+    skeleton = "\n".join(["<files>"] + list(rendered.values()) + ["</files>"])
+    return skeleton, count_tokens(skeleton)
+  
+  def _prepare_description(self, rel_path: str) -> tuple[str, Optional[str], str]:
+    """Read a file for describing
+    
+    Returns:
+      tuple[str, Optional[str], str]: The file's content hash, its cached description
+                                      (None if there isn't one) and the prompt to describe it
+    """
+    with open(os.path.join(self.root_path, rel_path), "rb") as f:
+      raw = f.read()
+    
+    key = content_hash(raw)
+    if self.cache is not None:
+      description = self.cache.get(key, self.model)
+      if description is not None:
+        logger.debug(f"Using cached description for {rel_path}")
+        return key, description, ""
+    
+    try:
+      content = raw.decode("utf-8")
+    except Exception as e:
+      logger.warning(f"Error reading file {rel_path}: {str(e)}")
+      content = ""
+    logger.debug(f"Getting AI description for {rel_path}")
+    return key, None, f"File: {rel_path}\n\nSummarize this file in 1 sentence: {content}"
+  
+  def describe_file(self, rel_path: str) -> str:
+    """Get a 1 sentence AI description of a file, reusing the cached one if its content is unchanged
+    
+    Args:
+      rel_path (str): Path of the file relative to root_path
       
-      # Start file tag
-      output.append(f'  <file path="{escape_xml(file_path)}">')
+    Returns:
+      str: Description of the file
+    """
+    key, description, user_prompt = self._prepare_description(rel_path)
+    if description is not None:
+      return description
+    
+    if self.rate_limiter is not None:
+      self.rate_limiter.acquire()
+    description = ai(DESCRIBE_SYSTEM_PROMPT, user_prompt, model=self.model)
+    
+    if self.cache is not None:
+      self.cache.set(key, self.model, description)
+    return description
+  
+  async def adescribe_file(self, rel_path: str) -> str:
+    """Async version of describe_file; reading the file and the cache run in a worker thread"""
+    key, description, user_prompt = await asyncio.to_thread(self._prepare_description, rel_path)
+    if description is not None:
+      return description
+    
+    if self.rate_limiter is not None:
+      await self.rate_limiter.aacquire()
+    description = await aai(DESCRIBE_SYSTEM_PROMPT, user_prompt, model=self.model)
+    
+    if self.cache is not None:
+      await asyncio.to_thread(self.cache.set, key, self.model, description)
+    return description
+  
+  def walk(self, rel_dir: str = "", max_depth: Optional[int] = None) -> list[tuple]:
+    """Walk the directory tree without describing anything
+    
+    Args:
+      rel_dir (str): Subdirectory to walk, relative to root_path. Defaults to the root.
+      max_depth (int, optional): Maximum depth below rel_dir. None means no limit.
+    
+    Returns:
+      list[tuple]: Entries in output order, each one of ("file", level, name, rel_path, size, mtime),
+                   ("open", level, name) or ("close", level), with levels relative to rel_dir
+    """
+    entries = []
+    
+    def process_dir(path: str, rel_path: str, matcher: IgnoreMatcher, level: int = 0) -> None:
+      if max_depth is not None and level > max_depth:
+        return
       
-      # Add structure information
-      if structure['classes'] or structure['functions']:
-        output.append('    <structure>')
-        
-        # Add classes
-        for cls in structure['classes']:
-          output.append(f'      <class name="{escape_xml(cls["name"])}" start_line="{cls["start_line"]}" end_line="{cls["end_line"]}">')
-          for method in cls['methods']:
-            output.append(f'        <method name="{escape_xml(method["name"])}" start_line="{method["start_line"]}" end_line="{method["end_line"]}" />')
-          output.append('      </class>')
-        
-        # Add functions
-        for func in structure['functions']:
-          output.append(f'      <function name="{escape_xml(func["name"])}" start_line="{func["start_line"]}" end_line="{func["end_line"]}" />')
-        
-        output.append('    </structure>')
+      # One scandir pass per directory; files are listed before subdirectories
+      files, subdirs = [], []
+      with os.scandir(path) as it:
+        for entry in it:
+          entry_rel_path = f"{rel_path}/{entry.name}" if rel_path else entry.name
+          if entry.is_dir():
+            if not matcher.ignored(entry_rel_path, True):
+              subdirs.append((entry, entry_rel_path))
+          elif entry.is_file() and not matcher.ignored(entry_rel_path, False):
+            files.append((entry, entry_rel_path))
       
-      # Add file content with proper CDATA handling
-      # CDATA sections can't contain the sequence ']]>', so we need to split and rejoin if it exists
-      output.append('    <content><![CDATA[')
-      # Replace any ']]>' in the content with ']]]]><![CDATA[>' to properly escape it in CDATA
-      safe_content = content.replace(']]>', ']]]]><![CDATA[>')
-      output.append(safe_content)
-      output.append('    ]]></content>')
+      for entry, entry_rel_path in files:
+        stat = entry.stat()
+        entries.append(("file", level, entry.name, entry_rel_path, stat.st_size, stat.st_mtime))
       
-      # Close file tag
-      output.append('  </file>')
+      for entry, entry_rel_path in subdirs:
+        entries.append(("open", level, entry.name))
+        process_dir(entry.path, entry_rel_path, matcher.child(entry.path, entry_rel_path), level + 1)
+        entries.append(("close", level))
+
+    # Pick up .gitignore files from the root down to rel_dir
+    rel_dir = rel_dir.strip('/').replace(os.sep, '/')
+    matcher = self.ignore
+    path, parts = self.root_path, []
+    for part in rel_dir.split('/') if rel_dir else []:
+      path = os.path.join(path, part)
+      parts.append(part)
+      matcher = matcher.child(path, '/'.join(parts))
+    process_dir(path, rel_dir, matcher)
+    return entries
+  
+  def describe_files(self, rel_paths: list[str]) -> dict[str, str]:
+    """Describe files concurrently on a bounded pool, rate limited across workers
     
-    output.append("</files>")
+    Args:
+      rel_paths (list[str]): Paths of files relative to root_path
+      
+    Returns:
+      dict[str, str]: Mapping of path to description
+    """
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      descriptions = executor.map(in_context(self.describe_file), rel_paths)
+      return dict(zip(rel_paths, descriptions))
+  
+  async def adescribe_files(self, rel_paths: list[str]) -> dict[str, str]:
+    """Async version of describe_files, with at most max_workers descriptions in flight"""
+    semaphore = asyncio.Semaphore(self.max_workers)
+    
+    async def describe(rel_path: str) -> str:
+      async with semaphore:
+        return await self.adescribe_file(rel_path)
+    
+    descriptions = await asyncio.gather(*(describe(rel_path) for rel_path in rel_paths))
+    return dict(zip(rel_paths, descriptions))
+  
+  def render(self, entries: list[tuple], descriptions: dict[str, str]) -> str:
+    """Render walked entries and their descriptions into the XML structure
+    
+    Args:
+      entries (list[tuple]): Entries from walk()
+      descriptions (dict[str, str]): Mapping of file path to description.
+                               Files without one are rendered with their size instead.
+      
+    Returns:
+      str: XML string containing folder structure with descriptions
+    """
+    output = ["<directory>"]
+    for entry in entries:
+      kind, level = entry[0], entry[1]
+      indent = "  " * (level + 1)
+      if kind == "file":
+        name, rel_path, size = entry[2], entry[3], entry[4]
+        if rel_path in descriptions:
+          output.append(
+            f'{indent}<file name="{escape_xml(name)}" description="{escape_xml(descriptions[rel_path])}" />'
+          )
+        else:
+          output.append(f'{indent}<file name="{escape_xml(name)}" size="{size}" />')
+      elif kind == "open":
+        output.append(f'{indent}<folder name="{escape_xml(entry[2])}">')
+      else:
+        output.append(f"{indent}</folder>")
+    output.append("</directory>")
     return "\n".join(output)
   
   def get_structure(self) -> str:
     """Get folder structure with AI descriptions in XML format
     
+    The tree is walked first, then all files are described concurrently,
+    then the XML is assembled in walk order so output stays deterministic.
+    
     Returns:
       str: XML string containing folder structure with descriptions
     """
-    print(f"Starting to process directory: {self.root_path}")
-    print(f"Max depth: {self.max_depth}")
-    print(f"Ignore patterns: {self.ignore_paths}")
+    logger.info(f"Processing directory {self.root_path} (max depth {self.max_depth})")
     
-    output = ["<directory>"]
+    self.entries = self.walk(max_depth=self.max_depth)
+    rel_paths = [entry[3] for entry in self.entries if entry[0] == "file"]
+    logger.info(f"Describing {len(rel_paths)} files with {self.max_workers} workers")
+    self.descriptions = self.describe_files(rel_paths)
+
+    return self.render(self.entries, self.descriptions)
+
+  def documents(self) -> dict[str, str]:
+    """Get a retrieval document per file: its path, description and Python symbol names
     
-    def process_dir(path: str, level: int = 0) -> None:
-      if self.max_depth is not None and level > self.max_depth:
-        print(f"Reached max depth {self.max_depth}, stopping at {path}")
-        return
+    Returns:
+      dict[str, str]: Mapping of file path to document text
+    """
+    documents = {}
+    for entry in self.entries:
+      if entry[0] != "file":
+        continue
+      rel_path = entry[3]
+      parts = [rel_path, self.descriptions.get(rel_path, "")]
+      if rel_path.endswith('.py'):
+        parts.append(self.symbol_names(rel_path))
+      documents[rel_path] = "\n".join(parts)
+    return documents
 
-      print(f"\nProcessing directory at level {level}: {path}")
-      indent = "  " * (level + 1)
+  def symbol_names(self, rel_path: str) -> str:
+    """Names of the classes, methods, functions and top-level variables of a Python file
+
+    Outlines are cached on the file's content hash, so unchanged files are only parsed once per process.
+    """
+    try:
+      with open(os.path.join(self.root_path, rel_path), "rb") as f:
+        content = f.read().decode("utf-8", errors="replace")
+    except OSError as e:
+      logger.warning(f"Error reading file {rel_path}: {str(e)}")
+      return ""
+    outline = get_outline(content)
+    return " ".join(
+      [cls["name"] for cls in outline["classes"]]
+      + [method["name"] for cls in outline["classes"] for method in cls["methods"]]
+      + [func["name"] for func in outline["functions"]]
+      + [var["name"] for var in outline["variables"]]
+    )
+  
+  def get_candidate_structure(self, rel_paths: list[str]) -> str:
+    """Get the XML structure restricted to some files and the folders containing them
+    
+    Args:
+      rel_paths (list[str]): Paths of files to keep
+      
+    Returns:
+      str: XML string in the same format as structure
+    """
+    keep = set(rel_paths)
+    entries = []
+    folders = []  # Indices in entries of open folders that don't contain a kept file yet
+    for entry in self.entries:
+      if entry[0] == "open":
+        folders.append(len(entries))
+        entries.append(entry)
+      elif entry[0] == "close":
+        start = folders.pop()
+        if len(entries) == start + 1:
+          entries.pop()
+        else:
+          entries.append(entry)
+      elif entry[3] in keep:
+        entries.append(entry)
+    return self.render(entries, self.descriptions)
+  
+  def expand(self, rel_dir: str = "", depth: Optional[int] = None) -> str:
+    """Describe the files of a subtree on demand, for directories built with lazy=True
+    
+    Descriptions are remembered, and structure is re-rendered to include them.
+    
+    Args:
+      rel_dir (str): Subdirectory to expand, relative to root_path. Defaults to the root.
+      depth (int, optional): How many levels below rel_dir to describe. None means all of them.
       
-      # Process files first
-      for file in os.listdir(path):
-        file_path = os.path.join(path, file)
-        rel_path = os.path.relpath(file_path, self.root_path)
-        
-        # Check if path should be ignored
-        should_ignore = False
-        for ignore_pattern in self.ignore_paths:
-          if '*' in ignore_pattern:
-            # Handle wildcard patterns
-            pattern = ignore_pattern.replace('*', '')
-            if rel_path.endswith(pattern):
-              print(f"Ignoring {rel_path} - matches wildcard pattern {ignore_pattern}")
-              should_ignore = True
-              break
-          elif ignore_pattern in rel_path:
-            print(f"Ignoring {rel_path} - matches pattern {ignore_pattern}")
-            should_ignore = True
-            break
-        
-        if should_ignore:
+    Returns:
+      str: XML string containing the subtree's structure with descriptions
+    """
+    entries = self.walk(rel_dir, max_depth=depth)
+    logger.info(f"Expanding {rel_dir or self.root_path}")
+    self.expand_files([entry[3] for entry in entries if entry[0] == "file"])
+    return self.render(entries, self.descriptions)
+  
+  def expand_files(self, rel_paths: list[str]) -> None:
+    """Describe specific files on demand, for directories built with lazy=True
+    
+    Files already described are skipped, and structure is re-rendered to include the new descriptions.
+    Safe to call from concurrent tasks: files another call is describing are waited for, not described twice.
+    
+    Args:
+      rel_paths (list[str]): Paths of files relative to root_path
+    """
+    owned, waiting = self._claim_descriptions(rel_paths)
+    logger.info(f"Expanding {len(owned)} files of {self.root_path}")
+    try:
+      descriptions = self.describe_files(owned)
+    except BaseException as e:
+      self._settle_descriptions(owned, None, e)
+      raise
+    self._settle_descriptions(owned, descriptions, None)
+    for future in waiting:
+      future.result()
+  
+  async def aexpand_files(self, rel_paths: list[str]) -> None:
+    """Async version of expand_files"""
+    owned, waiting = self._claim_descriptions(rel_paths)
+    logger.info(f"Expanding {len(owned)} files of {self.root_path}")
+    try:
+      descriptions = await self.adescribe_files(owned)
+    except BaseException as e:
+      self._settle_descriptions(owned, None, e)
+      raise
+    self._settle_descriptions(owned, descriptions, None)
+    await asyncio.gather(*(asyncio.wrap_future(future) for future in waiting))
+  
+  def _claim_descriptions(self, rel_paths: list[str]) -> tuple[list[str], list[Future]]:
+    """Split undescribed files into those the caller must describe and futures for those already being described"""
+    owned, waiting = [], []
+    with self.expand_lock:
+      for rel_path in dict.fromkeys(rel_paths):
+        if rel_path in self.descriptions:
           continue
-        
-        if os.path.isfile(file_path):
-          print(f"Processing file: {rel_path}")
-          with open(file_path, "r") as f:
-            try:
-              content = f.read()
-              print(f"Successfully read file content for {rel_path}")
-            except Exception as e:
-              print(f"Error reading file {rel_path}: {str(e)}")
-              content = ""
-          print(f"Getting AI description for {rel_path}")
-          description = ai(
-            "You are a helpful assistant that writes 1 sentence summaries of files.",
-            f"File: {rel_path}\n\nSummarize this file in 1 sentence: {content}",
-          )
-          output.append(
-            f'{indent}<file name="{escape_xml(file)}" description="{escape_xml(description)}" />'
-          )
+        future = self.expanding.get(rel_path)
+        if future is None:
+          self.expanding[rel_path] = Future()
+          owned.append(rel_path)
+        else:
+          waiting.append(future)
+    return owned, waiting
+  
+  def _settle_descriptions(
+    self,
+    rel_paths: list[str],
+    descriptions: Optional[dict[str, str]],
+    error: Optional[BaseException],
+  ) -> None:
+    """Remember new descriptions, re-render structure with them and wake up everyone waiting on them"""
+    with self.expand_lock:
+      if error is None:
+        self.descriptions.update(descriptions)
+        self.structure = self.render(self.entries, self.descriptions)
+      futures = [self.expanding.pop(rel_path) for rel_path in rel_paths]
+    for future in futures:
+      if error is None:
+        future.set_result(None)
+      else:
+        future.set_exception(error)
+  
+  def refresh(self, structure_path: str) -> str:
+    """Rebuild a cached structure, re-describing only files added or modified since it was written
+    
+    Files whose (mtime, size) or content hash match the manifest keep their
+    description; deleted files drop out. The XML and manifest are rewritten.
+    A cached XML without a manifest is trusted as-is to seed the manifest.
+    
+    Args:
+      structure_path (str): Path of the cached XML structure
+      
+    Returns:
+      str: XML string containing folder structure with descriptions
+    """
+    entries, new_manifest, to_describe = self._plan_refresh(structure_path)
+    descriptions = self.describe_files(to_describe)
+    return self._finish_refresh(structure_path, entries, new_manifest, descriptions)
+  
+  async def arefresh(self, structure_path: str) -> str:
+    """Async version of refresh; walking, hashing and writing run in worker threads"""
+    entries, new_manifest, to_describe = await asyncio.to_thread(self._plan_refresh, structure_path)
+    descriptions = await self.adescribe_files(to_describe)
+    return await asyncio.to_thread(self._finish_refresh, structure_path, entries, new_manifest, descriptions)
+  
+  @classmethod
+  async def aopen(
+    cls,
+    root_path: str,
+    structure_path: str,
+    max_depth: Optional[int] = None,
+    cache_path: Optional[str] = DESCRIPTION_CACHE_PATH,
+    model: str = MODEL,
+    max_workers: int = 16,
+    requests_per_minute: Optional[float] = 500,
+  ) -> "NLDirectory":
+    """Create an NLDirectory refreshed from a cached structure, describing files on the running event loop
+    
+    Takes the same arguments as __init__, with structure_path required.
+    """
+    directory = cls.__new__(cls)
+    directory._setup(root_path, max_depth, cache_path, model, max_workers, requests_per_minute, lazy=False)
+    directory.structure = await directory.arefresh(structure_path)
+    return directory
+  
+  def _plan_refresh(self, structure_path: str) -> tuple[list[tuple], dict[str, dict], list[str]]:
+    """Walk the tree and diff it against the manifest
+    
+    Returns:
+      tuple[list[tuple], dict[str, dict], list[str]]: Walked entries, the new manifest
+                                                      and the paths that need describing
+    """
+    manifest_path = manifest_path_for(structure_path)
+    manifest = {}
+    if os.path.exists(manifest_path):
+      with open(manifest_path, 'r') as f:
+        manifest = json.load(f)["files"]
+    elif os.path.exists(structure_path):
+      logger.info(f"No manifest for {structure_path}, seeding descriptions from the cached structure")
+      with open(structure_path, 'r') as f:
+        manifest = {
+          rel_path: {"description": description}
+          for rel_path, description in parse_descriptions(f.read()).items()
+        }
+    
+    entries = self.walk(max_depth=self.max_depth)
+    new_manifest = {}
+    to_describe = []
+    for entry in entries:
+      if entry[0] != "file":
+        continue
+      rel_path = entry[3]
+      record = {"mtime": entry[5], "size": entry[4]}
+      old = manifest.get(rel_path)
+      
+      if old is not None and "hash" in old and (old["mtime"], old["size"]) == (record["mtime"], record["size"]):
+        new_manifest[rel_path] = {**old, **record}
+        continue
+      
+      with open(os.path.join(self.root_path, rel_path), "rb") as f:
+        record["hash"] = content_hash(f.read())
+      if old is not None and old.get("hash", record["hash"]) == record["hash"]:
+        # Touched but unchanged, or seeded from a manifest-less structure
+        new_manifest[rel_path] = {**record, "description": old["description"]}
+      else:
+        new_manifest[rel_path] = record
+        to_describe.append(rel_path)
+    
+    deleted = len(set(manifest) - set(new_manifest))
+    logger.info(f"Refreshing {structure_path}: {len(to_describe)} added or modified, {deleted} deleted, "
+          f"{len(new_manifest) - len(to_describe)} unchanged")
+    return entries, new_manifest, to_describe
+  
+  def _finish_refresh(
+    self,
+    structure_path: str,
+    entries: list[tuple],
+    new_manifest: dict[str, dict],
+    descriptions: dict[str, str],
+  ) -> str:
+    """Add new descriptions to the manifest, then render and write the structure and manifest"""
+    for rel_path, description in descriptions.items():
+      new_manifest[rel_path]["description"] = description
+    
+    self.entries = entries
+    self.descriptions = {rel_path: record["description"] for rel_path, record in new_manifest.items()}
+    structure = self.render(entries, self.descriptions)
+    write_atomic(structure_path, structure)
+    write_atomic(manifest_path_for(structure_path), json.dumps({"files": new_manifest}, indent=2))
+    return structure
 
-      # Then process subdirectories  
-      for item in os.listdir(path):
-        item_path = os.path.join(path, item)
-        rel_path = os.path.relpath(item_path, self.root_path)
-        
-        # Check if path should be ignored
-        should_ignore = False
-        for ignore_pattern in self.ignore_paths:
-          if '*' in ignore_pattern:
-            pattern = ignore_pattern.replace('*', '')
-            if rel_path.endswith(pattern):
-              print(f"Ignoring directory {rel_path} - matches wildcard pattern {ignore_pattern}")
-              should_ignore = True
-              break
-          elif ignore_pattern in rel_path:
-            print(f"Ignoring directory {rel_path} - matches pattern {ignore_pattern}")
-            should_ignore = True
-            break
-        
-        if should_ignore:
-          continue
-        
-        if os.path.isdir(item_path):
-          print(f"Processing subdirectory: {rel_path}")
-          output.append(f'{indent}<folder name="{escape_xml(item)}">')
-          process_dir(item_path, level + 1)
-          output.append(f"{indent}</folder>")
+def manifest_path_for(structure_path: str) -> str:
+  """Path of the manifest kept next to a cached XML structure"""
+  return os.path.splitext(structure_path)[0] + '.manifest.json'
 
-    process_dir(self.root_path)
-    output.append("</directory>")
-    print("\nFinished processing directory structure")
-    return "\n".join(output)
+def parse_descriptions(structure: str) -> dict[str, str]:
+  """Recover path to description mapping from an XML structure"""
+  descriptions = {}
+  
+  def visit(element: ET.Element, prefix: str) -> None:
+    for child in element:
+      path = os.path.join(prefix, child.get("name", ""))
+      if child.tag == "file":
+        descriptions[path] = child.get("description", "")
+      elif child.tag == "folder":
+        visit(child, path)
+  
+  visit(ET.fromstring(structure), "")
+  return descriptions
 
 if __name__ == "__main__":
   # Create directory object and print XML structure
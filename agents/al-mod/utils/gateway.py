@@ -0,0 +1,470 @@
+"""Single gateway for every LLM call made by al-mod: caching, in-flight dedup, token rate limiting and record/replay"""
+
+import asyncio
+import atexit
+import copy
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Optional
+
+import dspy
+import litellm
+
+from .ratelimit import RateLimiter
+from .tokens import count_tokens
+from .trace import record_llm_call
+
+# Caches that live runs read and write
+PERSISTENT_DIR_CACHES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dir_caches')
+LLM_CACHE_PATH = os.path.join(PERSISTENT_DIR_CACHES, 'llm_cache.sqlite')
+# Shared across every thread and task in the process
+TOKENS_PER_MINUTE = float(os.getenv("AL_MOD_TOKENS_PER_MINUTE", "450000"))
+# Per event loop, so one process can drive many async tasks without flooding the provider
+MAX_CONCURRENT_REQUESTS = int(os.getenv("AL_MOD_MAX_CONCURRENT_REQUESTS", "64"))
+NUM_RETRIES = 3
+# "live" calls the provider, "record" also appends every response to LLM_FIXTURES_PATH,
+# "replay" answers from LLM_FIXTURES_PATH without any network calls
+LLM_MODE = os.getenv("AL_MOD_LLM_MODE", "live")
+LLM_FIXTURES_PATH = os.getenv(
+  "AL_MOD_LLM_FIXTURES",
+  os.path.join(PERSISTENT_DIR_CACHES, 'llm_fixtures.jsonl'),
+)
+
+def _scratch_dir_caches() -> str:
+  """Throwaway copy of the persistent caches, deleted when the process exits
+
+  Replay can answer a changed prompt with a response recorded for a different one,
+  so descriptions, structures and indexes built from it must not reach the caches
+  live runs trust. Starting from a copy keeps replay as warm as a live run.
+  """
+  scratch = tempfile.mkdtemp(prefix='al-mod-replay-')
+  atexit.register(shutil.rmtree, scratch, ignore_errors=True)
+  if os.path.isdir(PERSISTENT_DIR_CACHES):
+    shutil.copytree(
+      PERSISTENT_DIR_CACHES,
+      scratch,
+      dirs_exist_ok=True,
+      ignore=shutil.ignore_patterns('llm_cache.sqlite*', 'llm_fixtures.jsonl', '*.tmp'),
+    )
+  return scratch
+
+# Where descriptions, structures and indexes are kept: a scratch copy when replaying
+DIR_CACHES = _scratch_dir_caches() if LLM_MODE == "replay" else PERSISTENT_DIR_CACHES
+
+def request_key(request: dict) -> str:
+  """Hash of everything that affects a response"""
+  return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+def similar_request_key(request: dict) -> str:
+  """Hash of a request's model and system prompt, which stay the same when only its inputs change"""
+  messages = request["messages"]
+  system_prompt = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+  return hashlib.sha256(json.dumps([request["model"], system_prompt]).encode()).hexdigest()
+
+class Recording:
+  """Responses recorded from live calls, replayed without a network
+
+  Replay looks a request up by its exact key first. A request whose inputs changed
+  since recording (e.g. a different skeleton) gets the responses recorded for the
+  same model and system prompt instead, in order, so changes to the pipeline can
+  still be run offline. Embeddings are recorded per text and must match exactly,
+  since a made-up vector could not match the dimension of an existing index.
+  """
+
+  def __init__(self, path: str, mode: str):
+    """Initialize Recording
+
+    Args:
+      path (str): JSONL file of recorded responses
+      mode (str): "record" to append to path, or "replay" to answer from it
+    """
+    if mode not in ("record", "replay"):
+      raise ValueError(f"Unknown recording mode: {mode}")
+    self.path = path
+    self.mode = mode
+    self.lock = threading.Lock()
+    self.exact: dict[str, list[dict]] = {}
+    self.similar: dict[str, list[dict]] = {}
+    self.embeddings: dict[str, list[float]] = {}
+    self.positions = Counter()
+    self.misses = 0
+    if mode == "replay":
+      with open(path, 'r') as f:
+        for line in f:
+          record = json.loads(line)
+          if "embedding" in record:
+            self.embeddings[record["key"]] = record["embedding"]
+          else:
+            self.exact.setdefault(record["key"], []).append(record["result"])
+            self.similar.setdefault(record["similar_key"], []).append(record["result"])
+    else:
+      os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+  def _append(self, records: list[dict]) -> None:
+    with self.lock, open(self.path, 'a') as f:
+      for record in records:
+        f.write(json.dumps(record) + "\n")
+
+  def record(self, request: dict, result: dict) -> None:
+    self._append([{"key": request_key(request), "similar_key": similar_request_key(request), "result": result}])
+
+  def replay(self, request: dict) -> dict:
+    """Recorded result for a completion request, with prompt tokens counted from the actual prompt
+
+    Raises:
+      KeyError: If nothing was recorded for the request's model and system prompt
+    """
+    with self.lock:
+      for kind, table, key in (("exact", self.exact, request_key(request)), ("similar", self.similar, similar_request_key(request))):
+        responses = table.get(key)
+        if responses:
+          if kind == "similar":
+            self.misses += 1
+          position = self.positions[(kind, key)]
+          self.positions[(kind, key)] += 1
+          result = responses[position % len(responses)]
+          break
+      else:
+        raise KeyError(f"No recorded response for {request['model']} with this system prompt in {self.path}")
+    usage = {**result["usage"], "prompt_tokens": Gateway._prompt_tokens(request)}
+    return {**result, "usage": usage}
+
+  def record_embeddings(self, model: str, texts: list[str], vectors: list[list[float]]) -> None:
+    self._append([
+      {"key": request_key({"model": model, "input": text}), "embedding": vector}
+      for text, vector in zip(texts, vectors)
+    ])
+
+  def replay_embeddings(self, model: str, texts: list[str]) -> list[list[float]]:
+    """Recorded embeddings for texts
+
+    Raises:
+      KeyError: If any text was never embedded with model while recording
+    """
+    vectors = []
+    for text in texts:
+      vector = self.embeddings.get(request_key({"model": model, "input": text}))
+      if vector is None:
+        raise KeyError(f"No recorded embedding from {model} for {text[:80]!r} in {self.path}")
+      vectors.append(vector)
+    return vectors
+
+class Gateway:
+  """Routes chat completions and embeddings through LiteLLM with shared limits
+
+  - Identical cacheable requests in flight at the same time are sent once.
+  - Cacheable responses are stored on disk, keyed on (model, messages, temperature
+    and any other request parameters).
+  - Every request first reserves its estimated prompt tokens from a shared
+    tokens-per-minute bucket, and is charged its completion tokens afterwards,
+    so concurrent tasks slow down instead of hitting 429s.
+  - Async requests are also capped at max_concurrent_requests per event loop.
+  LiteLLM keeps one client per provider and key, so connections are pooled across calls.
+  Sync and async callers share the cache, the in-flight requests and the rate limit.
+  In "replay" mode responses come from a Recording instead, with no cache or rate limit.
+  """
+
+  def __init__(
+    self,
+    cache_path: Optional[str] = LLM_CACHE_PATH,
+    tokens_per_minute: Optional[float] = TOKENS_PER_MINUTE,
+    max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+    mode: str = LLM_MODE,
+    fixtures_path: str = LLM_FIXTURES_PATH,
+  ):
+    """Initialize Gateway
+
+    Args:
+      cache_path (str, optional): SQLite file for cached responses. None disables the disk cache.
+      tokens_per_minute (float, optional): Token rate limit across all calls. None means no limit.
+      max_concurrent_requests (int): Maximum async requests in flight per event loop.
+      mode (str): "live", "record" or "replay"
+      fixtures_path (str): JSONL file responses are recorded to and replayed from
+    """
+    self.recording = Recording(fixtures_path, mode) if mode != "live" else None
+    self.replaying = mode == "replay"
+    if self.replaying:
+      # Deterministic and offline: nothing to cache or throttle
+      cache_path = None
+      tokens_per_minute = None
+    self.rate_limiter = RateLimiter(tokens_per_minute) if tokens_per_minute else None
+    self.max_concurrent_requests = max_concurrent_requests
+    self.semaphores = weakref.WeakKeyDictionary()
+    self.lock = threading.Lock()
+    self.in_flight: dict[str, Future] = {}
+    self.conn = None
+    if cache_path:
+      os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+      self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+      with self.lock, self.conn:
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+
+  def _cache_get(self, key: str) -> Optional[dict]:
+    if self.conn is None:
+      return None
+    with self.lock:
+      row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+  def _cache_set(self, key: str, result: dict) -> None:
+    if self.conn is None:
+      return
+    with self.lock, self.conn:
+      self.conn.execute("INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)", (key, json.dumps(result)))
+
+  def _semaphore(self) -> asyncio.Semaphore:
+    """Concurrency limit for the running event loop"""
+    loop = asyncio.get_running_loop()
+    with self.lock:
+      semaphore = self.semaphores.get(loop)
+      if semaphore is None:
+        semaphore = self.semaphores[loop] = asyncio.Semaphore(self.max_concurrent_requests)
+    return semaphore
+
+  @staticmethod
+  def _prompt_tokens(request: dict) -> int:
+    return sum(count_tokens(str(message.get("content", ""))) for message in request["messages"])
+
+  def _result(self, response: litellm.ModelResponse) -> dict:
+    """Charge completion tokens and keep what callers need from a response"""
+    usage = dict(response.usage) if response.get("usage") else {}
+    if self.rate_limiter is not None:
+      self.rate_limiter.consume(usage.get("completion_tokens", 0))
+
+    return {
+      "outputs": [choice.message.content for choice in response.choices],
+      "usage": {k: v for k, v in usage.items() if isinstance(v, (int, float))},
+      "cost": response._hidden_params.get("response_cost"),
+    }
+
+  def _send(self, request: dict) -> dict:
+    """Make one rate-limited completion request"""
+    if self.replaying:
+      return self.recording.replay(request)
+    if self.rate_limiter is not None:
+      self.rate_limiter.acquire(self._prompt_tokens(request))
+    result = self._result(litellm.completion(**request, num_retries=NUM_RETRIES))
+    if self.recording is not None:
+      self.recording.record(request, result)
+    return result
+
+  async def _asend(self, request: dict) -> dict:
+    """Make one rate-limited completion request without blocking the event loop"""
+    if self.replaying:
+      return self.recording.replay(request)
+    if self.rate_limiter is not None:
+      await self.rate_limiter.aacquire(self._prompt_tokens(request))
+    async with self._semaphore():
+      response = await litellm.acompletion(**request, num_retries=NUM_RETRIES)
+    result = self._result(response)
+    if self.recording is not None:
+      self.recording.record(request, result)
+    return result
+
+  def _claim(self, key: str) -> tuple[Future, bool]:
+    """Get the in-flight future for a request, and whether the caller must send it"""
+    with self.lock:
+      future = self.in_flight.get(key)
+      if future is not None:
+        return future, False
+      future = self.in_flight[key] = Future()
+      return future, True
+
+  def _settle(self, key: str, future: Future, result: Optional[dict], error: Optional[BaseException]) -> None:
+    """Cache a sent request's result and hand it to everyone waiting on it"""
+    if error is None:
+      self._cache_set(key, result)
+      future.set_result({**result, "cached": False})
+    else:
+      future.set_exception(error)
+    with self.lock:
+      del self.in_flight[key]
+
+  def complete(self, model: str, messages: list[dict], cache: bool = True, **kwargs: Any) -> dict:
+    """Get a chat completion, recording it in the current trace
+
+    Args:
+      model (str): LiteLLM model name, e.g. "openai/gpt-4o"
+      messages (list[dict]): Chat messages
+      cache (bool): Whether to reuse cached and in-flight identical requests. Use False for sampling.
+      **kwargs: Other request parameters, e.g. temperature and max_tokens
+
+    Returns:
+      dict: "outputs" (one string per choice), "usage" (token counts), "cost" (USD, None if unknown)
+            and "cached" (whether it was served from the disk cache)
+    """
+    start = time.monotonic()
+    result = self._complete(dict(model=model, messages=messages, **kwargs), cache)
+    record_llm_call(model, result["usage"], result["cost"], result["cached"], time.monotonic() - start)
+    return result
+
+  async def acomplete(self, model: str, messages: list[dict], cache: bool = True, **kwargs: Any) -> dict:
+    """Async version of complete"""
+    start = time.monotonic()
+    result = await self._acomplete(dict(model=model, messages=messages, **kwargs), cache)
+    record_llm_call(model, result["usage"], result["cost"], result["cached"], time.monotonic() - start)
+    return result
+
+  def _complete(self, request: dict, cache: bool) -> dict:
+    if not cache:
+      return {**self._send(request), "cached": False}
+
+    key = request_key(request)
+    cached = self._cache_get(key)
+    if cached is not None:
+      if self.recording is not None:
+        self.recording.record(request, cached)
+      return {**cached, "cached": True}
+
+    # Deduplicate identical requests already in flight
+    future, owner = self._claim(key)
+    if owner:
+      try:
+        self._settle(key, future, self._send(request), None)
+      except BaseException as e:
+        self._settle(key, future, None, e)
+        raise
+      return future.result()
+    # Someone else paid for it
+    return {**future.result(), "cached": True}
+
+  async def _acomplete(self, request: dict, cache: bool) -> dict:
+    if not cache:
+      return {**await self._asend(request), "cached": False}
+
+    key = request_key(request)
+    cached = self._cache_get(key)
+    if cached is not None:
+      if self.recording is not None:
+        self.recording.record(request, cached)
+      return {**cached, "cached": True}
+
+    future, owner = self._claim(key)
+    if owner:
+      try:
+        self._settle(key, future, await self._asend(request), None)
+      except BaseException as e:
+        self._settle(key, future, None, e)
+        raise
+      return future.result()
+    return {**await asyncio.wrap_future(future), "cached": True}
+
+  def embed(self, model: str, texts: list[str]) -> list[list[float]]:
+    """Embed texts in one rate-limited request"""
+    start = time.monotonic()
+    if self.replaying:
+      vectors = self.recording.replay_embeddings(model, texts)
+      record_llm_call(model, {"prompt_tokens": sum(count_tokens(text) for text in texts)}, 0.0, True, time.monotonic() - start)
+      return vectors
+    if self.rate_limiter is not None:
+      self.rate_limiter.acquire(sum(count_tokens(text) for text in texts))
+    response = litellm.embedding(model=model, input=texts, num_retries=NUM_RETRIES)
+    usage = dict(response.usage) if response.get("usage") else {}
+    usage = {k: v for k, v in usage.items() if isinstance(v, (int, float))}
+    record_llm_call(model, usage, response._hidden_params.get("response_cost"), False, time.monotonic() - start)
+    vectors = [item["embedding"] for item in response.data]
+    if self.recording is not None:
+      self.recording.record_embeddings(model, texts, vectors)
+    return vectors
+
+_default_gateway = None
+_default_gateway_lock = threading.Lock()
+
+def get_gateway() -> Gateway:
+  """The process-wide gateway, created on first use"""
+  global _default_gateway
+  with _default_gateway_lock:
+    if _default_gateway is None:
+      _default_gateway = Gateway()
+    return _default_gateway
+
+class GatewayLM(dspy.LM):
+  """dspy.LM that sends its requests through a Gateway instead of calling LiteLLM directly"""
+
+  def __init__(self, model: str, gateway: Optional[Gateway] = None, **kwargs: Any):
+    super().__init__(model, **kwargs)
+    self.gateway = gateway
+
+  def __deepcopy__(self, memo: dict) -> "GatewayLM":
+    # dspy.LM.copy deep-copies; share the gateway instead of copying its locks and connection
+    new = GatewayLM.__new__(GatewayLM)
+    new.__dict__.update({k: (v if k == "gateway" else copy.deepcopy(v, memo)) for k, v in self.__dict__.items()})
+    return new
+
+  def _request(self, prompt, messages, kwargs: dict) -> tuple[list[dict], bool, dict]:
+    cache = kwargs.pop("cache", self.cache)
+    messages = messages or [{"role": "user", "content": prompt}]
+    return messages, cache, {**self.kwargs, **kwargs}
+
+  def __call__(self, prompt=None, messages=None, **kwargs):
+    messages, cache, kwargs = self._request(prompt, messages, kwargs)
+    result = (self.gateway or get_gateway()).complete(self.model, messages, cache=cache, **kwargs)
+    return self._record(prompt, messages, kwargs, result)
+
+  async def acall(self, prompt=None, messages=None, **kwargs):
+    """Async version of __call__"""
+    messages, cache, kwargs = self._request(prompt, messages, kwargs)
+    result = await (self.gateway or get_gateway()).acomplete(self.model, messages, cache=cache, **kwargs)
+    return self._record(prompt, messages, kwargs, result)
+
+  def _record(self, prompt, messages: list[dict], kwargs: dict, result: dict) -> list[str]:
+    # Same history entry as dspy.LM, with cost None on cache hits
+    entry = dict(
+      prompt=prompt,
+      messages=messages,
+      kwargs={k: v for k, v in kwargs.items() if not k.startswith("api_")},
+      response=result,
+      outputs=result["outputs"],
+      usage=result["usage"],
+      cost=None if result["cached"] else result["cost"],
+      timestamp=datetime.now().isoformat(),
+      uuid=str(uuid.uuid4()),
+      model=self.model,
+      model_type=self.model_type,
+    )
+    self.history.append(entry)
+    self.update_global_history(entry)
+    return result["outputs"]
+
+async def apredict(module: dspy.Module, lm: GatewayLM, **inputs: Any) -> dspy.Prediction:
+  """Run a dspy.Predict or dspy.ChainOfThought module on the event loop
+
+  dspy modules only call their LM synchronously, so this formats and parses the
+  request with the module's adapter itself. Like dspy, it retries with the JSON
+  adapter if the chat-formatted reply can't be parsed.
+
+  Args:
+    module (dspy.Module): A dspy.Predict or dspy.ChainOfThought
+    lm (GatewayLM): LM to call
+    **inputs: The module's input fields
+
+  Returns:
+    dspy.Prediction: Same as calling the module with lm in context
+  """
+  predict = getattr(module, '_predict', module)
+  signature = getattr(predict, 'extended_signature', predict.signature)
+  adapter = dspy.settings.adapter or dspy.ChatAdapter()
+  try:
+    outputs = await lm.acall(messages=adapter.format(signature, predict.demos, inputs))
+    values = [adapter.parse(signature, output) for output in outputs]
+  except Exception:
+    if isinstance(adapter, dspy.JSONAdapter):
+      raise
+    adapter = dspy.JSONAdapter()
+    outputs = await lm.acall(
+      messages=adapter.format(signature, predict.demos, inputs),
+      response_format={"type": "json_object"},
+    )
+    values = [adapter.parse(signature, output) for output in outputs]
+  return dspy.Prediction.from_completions(values, signature=signature)
@@ -0,0 +1,228 @@
+"""Precompiled .gitignore matching, including nested .gitignore files"""
+
+import os
+import re
+from typing import Iterable, Optional
+
+# Character classes allowed inside brackets, e.g. [[:digit:]], as regex class contents
+POSIX_CLASSES = {
+  'alnum': 'a-zA-Z0-9',
+  'alpha': 'a-zA-Z',
+  'blank': ' \\t',
+  'cntrl': '\\x00-\\x1f\\x7f',
+  'digit': '0-9',
+  'graph': '!-~',
+  'lower': 'a-z',
+  'print': ' -~',
+  'punct': '!-/:-@\\[-`{-~',
+  'space': ' \\t\\n\\r\\f\\v',
+  'upper': 'A-Z',
+  'xdigit': '0-9A-Fa-f',
+}
+
+def _class_char(glob: str, i: int) -> tuple[str, int]:
+  """The possibly backslash-escaped character at glob[i] inside brackets, and the index after it"""
+  if glob[i] == '\\' and i + 1 < len(glob):
+    return glob[i + 1], i + 2
+  return glob[i], i + 1
+
+def _escape_class(char: str) -> str:
+  return '\\' + char if char in '\\[]^-' else char
+
+def _translate_class(glob: str, start: int) -> Optional[tuple[str, int]]:
+  """Translate the bracket expression opening at glob[start]
+
+  A ']' right after the opening bracket (or its '!' or '^') is a literal, as in
+  fnmatch, [:name:] is a POSIX class and ranges whose ends are out of order match nothing.
+
+  Returns:
+    Optional[tuple[str, int]]: The regex and the index of the closing ']', or None if it is never closed
+  """
+  n = len(glob)
+  i = start + 1
+  negate = i < n and glob[i] in '!^'
+  if negate:
+    i += 1
+  body = []
+  first = True
+  while i < n:
+    if glob[i] == ']' and not first:
+      # Brackets never match a slash, even [[:punct:]] or [!a]
+      if negate:
+        return f"[^/{''.join(body)}]", i
+      return (f"(?!/)[{''.join(body)}]" if body else '(?!)'), i
+    first = False
+    if glob.startswith('[:', i):
+      close = glob.find(':]', i + 2)
+      name = glob[i + 2:close] if close != -1 else None
+      if name in POSIX_CLASSES:
+        body.append(POSIX_CLASSES[name])
+        i = close + 2
+        continue
+    low, i = _class_char(glob, i)
+    if i + 1 < n and glob[i] == '-' and glob[i + 1] != ']':
+      high, i = _class_char(glob, i + 1)
+      if low <= high:
+        body.append(f"{_escape_class(low)}-{_escape_class(high)}")
+    else:
+      body.append(_escape_class(low))
+  return None
+
+def _translate(glob: str) -> str:
+  """Translate a gitignore glob (without leading or trailing slash) into a regex"""
+  out = []
+  i, n = 0, len(glob)
+  while i < n:
+    char = glob[i]
+    if glob.startswith('**', i):
+      at_start = i == 0 or glob[i - 1] == '/'
+      at_end = i + 2 == n or glob[i + 2] == '/'
+      if at_start and at_end:
+        if i + 2 == n:
+          # Trailing "**" matches everything inside
+          out.append('.*')
+        else:
+          # Leading or middle "**/" matches zero or more directories
+          out.append('(?:.*/)?')
+          i += 1
+      else:
+        out.append('[^/]*')
+      i += 2
+      continue
+    if char == '*':
+      out.append('[^/]*')
+    elif char == '?':
+      out.append('[^/]')
+    elif char == '[':
+      translated = _translate_class(glob, i)
+      if translated is None:
+        # Unterminated, so a literal bracket
+        out.append(re.escape(char))
+      else:
+        regex, i = translated
+        out.append(regex)
+    elif char == '\\' and i + 1 < n:
+      i += 1
+      out.append(re.escape(glob[i]))
+    else:
+      out.append(re.escape(char))
+    i += 1
+  return ''.join(out)
+
+class IgnoreRules:
+  """Patterns from one .gitignore, compiled into a single regex per entry kind
+
+  The alternation lists patterns last-first, so the group that matches is the
+  last matching pattern, which is the one gitignore says wins. Patterns without
+  a slash can only match a path's last component, so when every pattern is
+  like that only the basename is matched.
+  """
+
+  def __init__(self, patterns: Iterable[str], base: str = ""):
+    """Initialize IgnoreRules
+
+    Args:
+      patterns (Iterable[str]): Lines of a .gitignore file
+      base (str): Directory the patterns are relative to, relative to the walk root
+    """
+    self.base = base
+    self.patterns = []
+    negated = []
+    anchored_patterns = []
+    file_groups, dir_groups = [], []
+
+    for line in patterns:
+      line = line.rstrip('\n')
+      # Trailing spaces are ignored unless escaped
+      if not line.endswith('\\ '):
+        line = line.rstrip(' ')
+      if not line or line.startswith('#'):
+        continue
+
+      negate = line.startswith('!')
+      if negate:
+        line = line[1:]
+      elif line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+      dir_only = line.endswith('/')
+      line = line.rstrip('/')
+      if not line:
+        continue
+      anchored = '/' in line
+      line = line.lstrip('/')
+
+      self.patterns.append(line)
+      negated.append(negate)
+      anchored_patterns.append(anchored)
+      dir_groups.append((len(self.patterns) - 1, line, anchored))
+      if not dir_only:
+        file_groups.append(dir_groups[-1])
+
+    self.negated = negated
+    self.basename_only = not any(anchored_patterns)
+    file_groups = [self._group(*group) for group in file_groups]
+    dir_groups = [self._group(*group) for group in dir_groups]
+    self.file_regex = re.compile('|'.join(reversed(file_groups))) if file_groups else None
+    self.dir_regex = re.compile('|'.join(reversed(dir_groups))) if dir_groups else None
+
+  def _group(self, index: int, pattern: str, anchored: bool) -> str:
+    regex = _translate(pattern)
+    if not anchored and not self.basename_only:
+      regex = '(?:.*/)?' + regex
+    return f"(?P<p{index}>{regex})"
+
+  def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+    """Check a path relative to base against these rules
+
+    Returns:
+      Optional[bool]: True if ignored, False if re-included by a negated pattern, None if no pattern matches
+    """
+    regex = self.dir_regex if is_dir else self.file_regex
+    if regex is None:
+      return None
+    if self.basename_only:
+      rel_path = rel_path.rpartition('/')[2]
+    match = regex.fullmatch(rel_path)
+    if match is None:
+      return None
+    return not self.negated[int(match.lastgroup[1:])]
+
+class IgnoreMatcher:
+  """Stack of IgnoreRules for a directory and its ancestors, deepest first"""
+
+  def __init__(self, rules: list[IgnoreRules]):
+    self.rules = rules
+
+  @classmethod
+  def for_root(cls, root_path: str, default_patterns: Iterable[str] = ()) -> "IgnoreMatcher":
+    """Matcher for a walk root: default patterns, overridden by the root's .gitignore"""
+    matcher = cls([IgnoreRules(default_patterns)])
+    return matcher.child(root_path, "")
+
+  def child(self, path: str, rel_dir: str) -> "IgnoreMatcher":
+    """Matcher for a subdirectory, adding its .gitignore if it has one
+
+    Args:
+      path (str): Filesystem path of the subdirectory
+      rel_dir (str): Path of the subdirectory relative to the walk root, '/' separated
+    """
+    gitignore_path = os.path.join(path, '.gitignore')
+    if not os.path.isfile(gitignore_path):
+      return self
+    with open(gitignore_path, 'r', errors='replace') as f:
+      rules = IgnoreRules(f.readlines(), rel_dir)
+    return IgnoreMatcher([rules] + self.rules)
+
+  def ignored(self, rel_path: str, is_dir: bool) -> bool:
+    """Check whether a '/' separated path relative to the walk root is ignored
+
+    Patterns in deeper .gitignore files take precedence over shallower ones.
+    """
+    for rules in self.rules:
+      if rules.base:
+        result = rules.match(rel_path[len(rules.base) + 1:], is_dir)
+      else:
+        result = rules.match(rel_path, is_dir)
+      if result is not None:
+        return result
+    return False
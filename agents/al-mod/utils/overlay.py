@@ -0,0 +1,95 @@
+"""Apply SEARCH/REPLACE edits to an in-memory, copy-on-write view of a repository"""
+
+import os
+import re
+from typing import Optional
+
+SEARCH_REPLACE_PATTERN = re.compile(r'<<<<<<< SEARCH\n(.*?)^=======\n(.*?)^>>>>>>> REPLACE', re.DOTALL | re.MULTILINE)
+
+def parse_search_replace(edit_text: str) -> list[tuple[str, str]]:
+  """Parse every SEARCH/REPLACE block in an edit
+
+  Args:
+    edit_text (str): Edit in the format described by SearchReplaceEdit
+
+  Returns:
+    list[tuple[str, str]]: (search, replace) pairs in order, each keeping its trailing newline
+  """
+  return [(match.group(1), match.group(2)) for match in SEARCH_REPLACE_PATTERN.finditer(edit_text)]
+
+class Overlay:
+  """Edited files held in memory over an untouched repository on disk
+
+  Reads fall through to disk until a file is edited. Several overlays can share
+  one read cache, so validating many samples reads each file from disk once.
+  """
+
+  def __init__(self, root_path: str, disk_cache: Optional[dict[str, Optional[str]]] = None):
+    """Initialize Overlay
+
+    Args:
+      root_path (str): Repository root
+      disk_cache (dict, optional): Shared cache of file contents on disk, None for missing files
+    """
+    self.root_path = root_path
+    self.disk_cache = disk_cache if disk_cache is not None else {}
+    self.files: dict[str, str] = {}
+
+  def _check_path(self, rel_path: str) -> str:
+    rel_path = os.path.normpath(rel_path).replace(os.sep, '/')
+    if os.path.isabs(rel_path) or rel_path == '..' or rel_path.startswith('../'):
+      raise ValueError(f"{rel_path} is outside the repository")
+    return rel_path
+
+  def read(self, rel_path: str) -> Optional[str]:
+    """Current content of a file, or None if it doesn't exist"""
+    rel_path = self._check_path(rel_path)
+    if rel_path in self.files:
+      return self.files[rel_path]
+    if rel_path not in self.disk_cache:
+      try:
+        with open(os.path.join(self.root_path, rel_path), 'r', encoding='utf-8') as f:
+          self.disk_cache[rel_path] = f.read()
+      except (FileNotFoundError, IsADirectoryError, UnicodeDecodeError):
+        self.disk_cache[rel_path] = None
+    return self.disk_cache[rel_path]
+
+  def apply(self, rel_path: str, edit_text: str) -> None:
+    """Apply the SEARCH/REPLACE blocks of an edit to a file, in order
+
+    Each SEARCH must occur in the file as it is after the previous blocks and
+    only its first occurrence is replaced. An empty SEARCH creates a file that
+    doesn't exist yet. Edited Python files must still compile.
+
+    Raises:
+      ValueError: If the edit has no blocks, a SEARCH doesn't match or the result doesn't compile
+    """
+    rel_path = self._check_path(rel_path)
+    blocks = parse_search_replace(edit_text)
+    if not blocks:
+      raise ValueError(f"No SEARCH/REPLACE blocks in edit for {rel_path}")
+
+    content = self.read(rel_path)
+    for search, replace in blocks:
+      if not search.strip():
+        if content:
+          raise ValueError(f"Empty SEARCH for existing file {rel_path}")
+        content = replace
+        continue
+      if content is None:
+        raise ValueError(f"{rel_path} does not exist")
+      index = content.find(search)
+      if index == -1 and content.endswith(search[:-1]):
+        # The file's last line has no trailing newline
+        search = search[:-1]
+        index = len(content) - len(search)
+      if index == -1:
+        raise ValueError(f"SEARCH text not found in {rel_path}: {search.splitlines()[0].strip()!r}")
+      content = content[:index] + replace + content[index + len(search):]
+
+    if rel_path.endswith('.py'):
+      try:
+        compile(content, rel_path, 'exec')
+      except (SyntaxError, ValueError) as e:
+        raise ValueError(f"Edited {rel_path} does not compile: {e}")
+    self.files[rel_path] = content
@@ -0,0 +1,67 @@
+"""Thread-safe rate limiting for LLM calls"""
+
+import asyncio
+import threading
+import time
+from typing import Optional
+
+class RateLimiter:
+  """Token bucket allowing a fixed number of units (requests, tokens, ...) per minute
+  
+  The bucket holds up to one minute's worth of units, refilled continuously.
+  Requests larger than the bucket are let through once it is full, so they
+  can't block forever.
+  """
+  
+  def __init__(self, per_minute: float, capacity: Optional[float] = None):
+    """Initialize RateLimiter
+    
+    Args:
+      per_minute (float): Units replenished per minute
+      capacity (float, optional): Maximum burst size. Defaults to per_minute.
+    """
+    self.rate = per_minute / 60.0
+    self.capacity = capacity if capacity is not None else per_minute
+    self.available = self.capacity
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+  
+  def _refill(self) -> None:
+    now = time.monotonic()
+    self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+    self.updated = now
+  
+  def try_acquire(self, amount: float = 1) -> float:
+    """Reserve amount units if available, else return seconds to wait before retrying"""
+    with self.lock:
+      self._refill()
+      needed = min(amount, self.capacity)
+      if self.available >= needed:
+        self.available -= amount
+        return 0.0
+      return (needed - self.available) / self.rate
+  
+  def acquire(self, amount: float = 1) -> None:
+    """Block until amount units are available, then consume them"""
+    while True:
+      wait = self.try_acquire(amount)
+      if wait <= 0:
+        return
+      time.sleep(wait)
+  
+  async def aacquire(self, amount: float = 1) -> None:
+    """Like acquire, but sleeps without blocking the event loop"""
+    while True:
+      wait = self.try_acquire(amount)
+      if wait <= 0:
+        return
+      await asyncio.sleep(wait)
+
+  def consume(self, amount: float) -> None:
+    """Charge amount units without waiting, e.g. for usage only known after a request
+
+    The bucket may go negative, which delays later acquires until it refills.
+    """
+    with self.lock:
+      self._refill()
+      self.available -= amount
@@ -0,0 +1,161 @@
+"""Local hybrid (BM25 + embedding) retrieval index over repository files"""
+
+import hashlib
+import io
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from .ai import embed, EMBEDDING_MODEL
+from .atomic import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Reciprocal rank fusion constant; dampens the weight of top ranks
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def tokenize(text: str) -> list[str]:
+  """Split text into lowercase terms, also splitting snake_case, camelCase and paths"""
+  terms = []
+  for word in re.findall(r'[A-Za-z0-9]+', text):
+    parts = re.findall(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+', word)
+    terms.append(word.lower())
+    if len(parts) > 1:
+      terms.extend(part.lower() for part in parts)
+  return terms
+
+class BM25:
+  """Okapi BM25 over a fixed list of documents"""
+  
+  def __init__(self, documents: list[str]):
+    self.term_counts = [Counter(tokenize(document)) for document in documents]
+    self.lengths = [sum(counts.values()) for counts in self.term_counts]
+    self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+    document_frequency = Counter(term for counts in self.term_counts for term in counts)
+    n = len(documents)
+    self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+  
+  def scores(self, query: str) -> np.ndarray:
+    terms = [term for term in set(tokenize(query)) if term in self.idf]
+    scores = np.zeros(len(self.term_counts))
+    for i, (counts, length) in enumerate(zip(self.term_counts, self.lengths)):
+      norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self.avg_length or 1))
+      for term in terms:
+        tf = counts.get(term)
+        if tf:
+          scores[i] += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores
+
+class FileIndex:
+  """Per-env index of file documents (path, description, symbols) for hybrid search
+  
+  Embeddings are persisted with the index metadata and only recomputed for
+  documents whose text changed, so updates cost one embedding call per
+  changed file.
+  """
+  
+  def __init__(self, index_path: str, model: str = EMBEDDING_MODEL):
+    """Initialize FileIndex, loading any persisted state
+    
+    Args:
+      index_path (str): Path prefix for the persisted index ({index_path}.npz)
+      model (str): Embedding model. Persisted embeddings from another model are discarded.
+    """
+    self.index_path = index_path
+    self.model = model
+    self.paths: list[str] = []
+    self.hashes: list[str] = []
+    self.documents: list[str] = []
+    self.embeddings = np.zeros((0, 0), dtype=np.float32)
+    self.bm25 = BM25([])
+    
+    saved_path = f"{index_path}.npz"
+    if os.path.exists(saved_path):
+      try:
+        with np.load(saved_path) as saved:
+          if str(saved["model"]) == model:
+            self._load(saved["paths"].tolist(), saved["hashes"].tolist(), saved["embeddings"])
+      except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"Discarding unreadable index {saved_path}: {e}")
+  
+  def _load(self, paths: list[str], hashes: list[str], embeddings: np.ndarray) -> None:
+    """Adopt persisted state if every path has exactly one hash and one embedding row"""
+    if len(paths) != len(hashes) or embeddings.ndim != 2 or len(paths) != embeddings.shape[0]:
+      logger.warning(f"Discarding inconsistent index {self.index_path}: {len(paths)} paths, embeddings of shape {embeddings.shape}")
+      return
+    self.paths, self.hashes, self.embeddings = paths, hashes, embeddings
+  
+  def update(self, documents: dict[str, str]) -> None:
+    """Sync the index with the current documents, embedding only new or changed ones
+    
+    Args:
+      documents (dict[str, str]): Mapping of file path to document text
+    """
+    old = {path: (h, i) for i, (path, h) in enumerate(zip(self.paths, self.hashes))}
+    paths = list(documents)
+    hashes = [hashlib.sha256(documents[path].encode()).hexdigest() for path in paths]
+    
+    stale = [i for i, (path, h) in enumerate(zip(paths, hashes)) if old.get(path, (None,))[0] != h]
+    vectors = embed([documents[paths[i]] for i in stale], model=self.model) if stale else []
+    logger.info(f"Updating index {self.index_path}: embedding {len(stale)} of {len(paths)} documents")
+    
+    dim = len(vectors[0]) if vectors else self.embeddings.shape[1]
+    embeddings = np.zeros((len(paths), dim), dtype=np.float32)
+    fresh = dict(zip(stale, vectors))
+    for i, path in enumerate(paths):
+      if i in fresh:
+        vector = np.asarray(fresh[i], dtype=np.float32)
+        embeddings[i] = vector / (np.linalg.norm(vector) or 1.0)
+      else:
+        embeddings[i] = self.embeddings[old[path][1]]
+    
+    self.paths, self.hashes, self.documents, self.embeddings = paths, hashes, [documents[p] for p in paths], embeddings
+    self.bm25 = BM25(self.documents)
+    if stale or len(old) != len(paths):
+      self.save()
+  
+  def save(self) -> None:
+    """Persist the index in one file, replaced atomically so concurrent readers and crashes never see a partial index"""
+    buffer = io.BytesIO()
+    np.savez(
+      buffer,
+      model=np.array(self.model),
+      paths=np.array(self.paths, dtype=str),
+      hashes=np.array(self.hashes, dtype=str),
+      embeddings=self.embeddings,
+    )
+    write_atomic(f"{self.index_path}.npz", buffer.getvalue())
+  
+  def search(self, query: str, k: int, query_embedding: Optional[list[float]] = None) -> list[str]:
+    """Get the top k file paths for a query, fusing BM25 and embedding ranks
+    
+    Args:
+      query (str): Search query, e.g. a problem description
+      k (int): Number of paths to return
+      query_embedding (list[float], optional): Precomputed embedding of query
+      
+    Returns:
+      list[str]: Paths, best first
+    """
+    if not self.paths:
+      return []
+    if query_embedding is None:
+      query_embedding = embed([query], model=self.model)[0]
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    query_vector /= np.linalg.norm(query_vector) or 1.0
+    
+    fused = np.zeros(len(self.paths))
+    for scores in (self.bm25.scores(query), self.embeddings @ query_vector):
+      ranks = np.empty(len(scores), dtype=np.int64)
+      ranks[np.argsort(-scores, kind='stable')] = np.arange(len(scores))
+      fused += 1.0 / (RRF_K + ranks + 1)
+    
+    best = np.argsort(-fused, kind='stable')[:k]
+    return [self.paths[i] for i in best]
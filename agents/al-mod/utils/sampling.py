@@ -0,0 +1,121 @@
+"""Adaptive sampling that stops as soon as a vote can no longer change"""
+
+import asyncio
+import logging
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from .trace import in_context
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+def _top_two(votes: Counter) -> tuple[int, int]:
+  top = votes.most_common(2) + [(None, 0), (None, 0)]
+  return top[0][1], top[1][1]
+
+def _can_settle(votes: Counter, in_flight: int, n_samples: int, submitted: int) -> bool:
+  """Whether the samples in flight could settle the vote on their own"""
+  leader, runner_up = _top_two(votes)
+  return in_flight > 0 and leader + in_flight > runner_up + (n_samples - submitted)
+
+def _settled(votes: Counter, n_samples: int, finished: int) -> bool:
+  """Whether the leader has more votes than the runner-up could still reach"""
+  leader, runner_up = _top_two(votes)
+  if leader > runner_up + (n_samples - finished):
+    logger.info(f"Consensus after {finished} of {n_samples} samples ({leader} votes), skipping the rest")
+    return True
+  return False
+
+def sample_until_consensus(
+  generate: Callable[[], Optional[T]],
+  n_samples: int,
+  tally: Callable[[list[T]], Counter],
+  max_in_flight: int,
+  stop_early: bool = True,
+) -> list[T]:
+  """Draw up to n_samples samples, stopping once one answer has an unassailable majority
+  
+  Samples are voted on as they finish. Once the leading answer has more votes
+  than the runner-up could reach even if every remaining sample went its way,
+  sampling stops. New samples are only submitted while the ones in flight
+  couldn't settle the vote by themselves, so easy tasks never pay for the
+  rest. Requests still running at the end finish in the background and their
+  results are dropped.
+  
+  Args:
+    generate: Draws one sample, or returns None if drawing failed
+    n_samples (int): Maximum number of samples to draw
+    tally: Counts the votes for each answer among the samples so far, the same way
+           the samples are ranked afterwards
+    max_in_flight (int): Maximum number of samples drawn concurrently
+    stop_early (bool): Whether to stop at consensus. False draws all n_samples, e.g. when
+                       they are ranked by something other than votes.
+    
+  Returns:
+    list[T]: Successful samples in the order they finished
+  """
+  samples = []
+  votes = Counter()
+  submitted = finished = 0
+  pending = set()
+  executor = ThreadPoolExecutor(max_workers=max_in_flight)
+  try:
+    while submitted < n_samples or pending:
+      # Hold off while the samples already in flight could settle the vote on their own
+      while (
+        submitted < n_samples and len(pending) < max_in_flight
+        and not (stop_early and _can_settle(votes, len(pending), n_samples, submitted))
+      ):
+        pending.add(executor.submit(in_context(generate)))
+        submitted += 1
+      
+      done, pending = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        finished += 1
+        if future.result() is not None:
+          samples.append(future.result())
+      if stop_early:
+        votes = tally(samples)
+        if _settled(votes, n_samples, finished):
+          break
+  finally:
+    executor.shutdown(wait=False, cancel_futures=True)
+  return samples
+
+async def asample_until_consensus(
+  generate: Callable[[], Awaitable[Optional[T]]],
+  n_samples: int,
+  tally: Callable[[list[T]], Counter],
+  max_in_flight: int,
+  stop_early: bool = True,
+) -> list[T]:
+  """Async version of sample_until_consensus; samples still running at the end are cancelled"""
+  samples = []
+  votes = Counter()
+  submitted = finished = 0
+  pending = set()
+  try:
+    while submitted < n_samples or pending:
+      while (
+        submitted < n_samples and len(pending) < max_in_flight
+        and not (stop_early and _can_settle(votes, len(pending), n_samples, submitted))
+      ):
+        pending.add(asyncio.ensure_future(generate()))
+        submitted += 1
+      
+      done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+      for task in done:
+        finished += 1
+        if task.result() is not None:
+          samples.append(task.result())
+      if stop_early:
+        votes = tally(samples)
+        if _settled(votes, n_samples, finished):
+          break
+  finally:
+    for task in pending:
+      task.cancel()
+  return samples
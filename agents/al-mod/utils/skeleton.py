@@ -0,0 +1,136 @@
+"""Extract classes, methods, functions and top-level variables of Python source with exact line ranges"""
+
+import ast
+import hashlib
+import threading
+
+# Outlines keyed on the sha256 of the source they were extracted from
+_outline_cache: dict[str, dict] = {}
+_outline_cache_lock = threading.Lock()
+
+def definition_start_line(node: ast.AST) -> int:
+  """First line of a definition, including its decorators"""
+  decorators = getattr(node, 'decorator_list', [])
+  return min([node.lineno] + [decorator.lineno for decorator in decorators])
+
+def _span(node: ast.AST, name: str) -> dict:
+  return {'name': name, 'start_line': definition_start_line(node), 'end_line': node.end_lineno}
+
+def _function_span(node: ast.AST, name: str) -> dict:
+  """Span of a function, plus where its body starts after any docstring (None if there is nothing to elide)"""
+  body = node.body
+  body_line = body[0].lineno
+  if isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+    body = body[1:]
+    body_line = node.body[0].end_lineno + 1
+  if not body or body[0].lineno == node.lineno:
+    return {**_span(node, name), 'body_line': None, 'body_col': None}
+  return {**_span(node, name), 'body_line': body_line, 'body_col': body[0].col_offset}
+
+def _assigned_names(node: ast.stmt) -> list[str]:
+  """Names bound by a top-level assignment statement"""
+  if isinstance(node, ast.Assign):
+    targets = node.targets
+  elif isinstance(node, (ast.AnnAssign, ast.AugAssign)):
+    targets = [node.target]
+  else:
+    return []
+
+  names = []
+  for target in targets:
+    for child in ast.walk(target):
+      if isinstance(child, ast.Name):
+        names.append(child.id)
+  return names
+
+def _visit_class(node: ast.ClassDef, qualname: str, classes: list[dict]) -> None:
+  cls = {**_span(node, qualname), 'methods': []}
+  classes.append(cls)
+  for child in node.body:
+    if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+      cls['methods'].append(_function_span(child, child.name))
+    elif isinstance(child, ast.ClassDef):
+      _visit_class(child, f"{qualname}.{child.name}", classes)
+
+def parse_outline(source: str) -> dict:
+  """Extract the outline of Python source
+
+  Args:
+    source (str): Python source code
+
+  Returns:
+    dict: {'classes': [...], 'functions': [...], 'variables': [...]}, where each item has
+          'name', 'start_line' and 'end_line' (1-indexed, inclusive, decorators included)
+          and classes also have 'methods'. Nested classes are listed as 'Outer.Inner'.
+          Functions and methods also have 'body_line' and 'body_col', where their body
+          starts after the docstring, or None if there is nothing to elide.
+          Source that fails to parse gives an empty outline.
+  """
+  outline = {'classes': [], 'functions': [], 'variables': []}
+  try:
+    tree = ast.parse(source)
+  except (SyntaxError, ValueError):
+    return outline
+
+  for node in tree.body:
+    if isinstance(node, ast.ClassDef):
+      _visit_class(node, node.name, outline['classes'])
+    elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+      outline['functions'].append(_function_span(node, node.name))
+    else:
+      for name in _assigned_names(node):
+        outline['variables'].append(_span(node, name))
+  return outline
+
+def get_outline(source: str) -> dict:
+  """Like parse_outline, but cached on the hash of the source
+
+  The returned outline is shared between callers and must not be mutated.
+  """
+  key = hashlib.sha256(source.encode('utf-8', 'surrogatepass')).hexdigest()
+  outline = _outline_cache.get(key)
+  if outline is None:
+    outline = parse_outline(source)
+    with _outline_cache_lock:
+      _outline_cache[key] = outline
+  return outline
+
+def render_signatures(source: str, outline: dict, expand: set[str]) -> str:
+  """Render source with function bodies elided to "..." except for expanded names
+
+  Signatures, decorators, docstrings, class bodies and module-level code are kept.
+
+  Args:
+    source (str): Python source code
+    outline (dict): Outline of source from get_outline
+    expand (set[str]): Names whose full bodies to keep: function names, class names
+                       (all of their methods) or 'Class.method'. Methods are only matched
+                       by their qualified name, so 'save' doesn't expand every class's save.
+
+  Returns:
+    str: The rendered source
+  """
+  elided = {}
+  for func in outline['functions']:
+    if func['name'] not in expand:
+      elided[func['body_line']] = func
+  for cls in outline['classes']:
+    if cls['name'] in expand:
+      continue
+    for method in cls['methods']:
+      if f"{cls['name']}.{method['name']}" not in expand:
+        elided[method['body_line']] = method
+  elided.pop(None, None)
+
+  lines = source.split('\n')
+  output = []
+  line_num = 1
+  while line_num <= len(lines):
+    if line_num in elided:
+      func = elided[line_num]
+      output.append(' ' * func['body_col'] + '...')
+      line_num = func['end_line'] + 1
+      continue
+    output.append(lines[line_num - 1])
+    line_num += 1
+  return '\n'.join(output)
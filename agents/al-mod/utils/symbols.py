@@ -0,0 +1,162 @@
+"""Persistent symbol index (definitions, spans, callers and callees) over a repository's Python files"""
+
+import ast
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+
+from .atomic import write_atomic
+from .skeleton import definition_start_line
+
+logger = logging.getLogger(__name__)
+
+def _called_names(node: ast.AST) -> list[str]:
+  """Simple names of everything called inside a definition, e.g. foo() and self.foo() both give foo"""
+  names = []
+  for child in ast.walk(node):
+    if isinstance(child, ast.Call):
+      func = child.func
+      if isinstance(func, ast.Name):
+        names.append(func.id)
+      elif isinstance(func, ast.Attribute):
+        names.append(func.attr)
+  return sorted(set(names))
+
+def extract_symbols(source: str) -> list[dict]:
+  """Extract classes, methods, functions and top-level variables with their spans and calls
+
+  Args:
+    source (str): Python source code
+
+  Returns:
+    list[dict]: Symbols with 'name' (e.g. 'Class.method'), 'kind' ('class', 'method',
+                'function' or 'variable'), 'start_line', 'end_line' and 'calls'
+  """
+  try:
+    tree = ast.parse(source)
+  except (SyntaxError, ValueError):
+    return []
+
+  symbols = []
+
+  def add(node: ast.AST, name: str, kind: str) -> None:
+    symbols.append({
+      'name': name,
+      'kind': kind,
+      'start_line': definition_start_line(node),
+      'end_line': node.end_lineno,
+      'calls': _called_names(node) if kind != 'class' else [],
+    })
+
+  def visit_class(node: ast.ClassDef, qualname: str) -> None:
+    add(node, qualname, 'class')
+    for child in node.body:
+      if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        add(child, f"{qualname}.{child.name}", 'method')
+      elif isinstance(child, ast.ClassDef):
+        visit_class(child, f"{qualname}.{child.name}")
+
+  for node in tree.body:
+    if isinstance(node, ast.ClassDef):
+      visit_class(node, node.name)
+    elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+      add(node, node.name, 'function')
+    elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+      targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+      for target in targets:
+        for child in ast.walk(target):
+          if isinstance(child, ast.Name):
+            add(node, child.id, 'variable')
+  return symbols
+
+class SymbolIndex:
+  """Per-env index from qualified names ('path/to/file.py:Class.method') to spans, callers and callees
+
+  Files are re-parsed only when their content hash changes. Callers and callees
+  are resolved by simple name, so they over-approximate when names collide.
+  """
+
+  def __init__(self, index_path: str):
+    """Initialize SymbolIndex, loading any persisted state
+
+    Args:
+      index_path (str): Path of the persisted JSON index
+    """
+    self.index_path = index_path
+    self.files: dict[str, dict] = {}
+    if os.path.exists(index_path):
+      with open(index_path, 'r') as f:
+        self.files = json.load(f)["files"]
+    self._build_lookups()
+
+  def update(self, root_path: str, rel_paths: list[str]) -> None:
+    """Sync the index with the Python files of a repository, re-parsing only changed ones
+
+    Args:
+      root_path (str): Repository root
+      rel_paths (list[str]): Paths of all files relative to root_path; non-Python files are skipped
+    """
+    files = {}
+    parsed = 0
+    for rel_path in rel_paths:
+      if not rel_path.endswith('.py'):
+        continue
+      with open(os.path.join(root_path, rel_path), 'rb') as f:
+        raw = f.read()
+      file_hash = hashlib.sha256(raw).hexdigest()
+      old = self.files.get(rel_path)
+      if old is not None and old['hash'] == file_hash:
+        files[rel_path] = old
+        continue
+      files[rel_path] = {'hash': file_hash, 'symbols': extract_symbols(raw.decode('utf-8', errors='replace'))}
+      parsed += 1
+
+    changed = parsed > 0 or set(files) != set(self.files)
+    self.files = files
+    self._build_lookups()
+    logger.info(f"Updating symbol index {self.index_path}: parsed {parsed} of {len(files)} files")
+    if changed:
+      write_atomic(self.index_path, json.dumps({"files": self.files}))
+
+  def _build_lookups(self) -> None:
+    self.symbols: dict[str, dict] = {}
+    self.by_file_name: dict[tuple[str, str], str] = {}
+    by_simple_name: dict[str, list[str]] = {}
+    for rel_path, record in self.files.items():
+      for symbol in record['symbols']:
+        qualname = f"{rel_path}:{symbol['name']}"
+        self.symbols[qualname] = {**symbol, 'file': rel_path, 'qualname': qualname}
+        self.by_file_name[(rel_path, symbol['name'])] = qualname
+        simple_name = symbol['name'].rsplit('.', 1)[-1]
+        # Unqualified method names resolve too, to the first definition in the file
+        self.by_file_name.setdefault((rel_path, simple_name), qualname)
+        if symbol['kind'] != 'variable':
+          by_simple_name.setdefault(simple_name, []).append(qualname)
+
+    self.callees: dict[str, list[str]] = {}
+    self.callers: dict[str, list[str]] = {qualname: [] for qualname in self.symbols}
+    for qualname, symbol in self.symbols.items():
+      callees = [callee for name in symbol['calls'] for callee in by_simple_name.get(name, []) if callee != qualname]
+      self.callees[qualname] = callees
+      for callee in callees:
+        self.callers[callee].append(qualname)
+
+  def resolve(self, file_path: str, name: str) -> Optional[dict]:
+    """Find a symbol by file and name ('Class.method', 'Class', 'function', 'method' or 'VARIABLE')
+
+    Returns:
+      Optional[dict]: The symbol, with 'qualname', 'file', 'kind', 'start_line', 'end_line'
+                      and 'calls', or None if there is no such symbol
+    """
+    qualname = self.by_file_name.get((file_path, name))
+    return self.symbols[qualname] if qualname is not None else None
+
+  def get_callers(self, qualname: str) -> list[dict]:
+    """Symbols that call the given symbol"""
+    return [self.symbols[caller] for caller in self.callers.get(qualname, [])]
+
+  def get_callees(self, qualname: str) -> list[dict]:
+    """Symbols called by the given symbol"""
+    return [self.symbols[callee] for callee in self.callees.get(qualname, [])]
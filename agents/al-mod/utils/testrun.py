@@ -0,0 +1,86 @@
+"""Run a repository's tests against candidate edits, each in its own disposable copy"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+# Not needed to run tests, and .git can be large
+COPY_IGNORE = shutil.ignore_patterns('.git', '__pycache__', '*.pyc', '.pytest_cache', '.venv', 'venv', 'node_modules')
+DEFAULT_TIMEOUT = 300
+
+def parse_junit(xml_path: str) -> dict:
+  """Count test outcomes in a pytest --junitxml report"""
+  counts = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+  root = ET.parse(xml_path).getroot()
+  suites = [root] if root.tag == 'testsuite' else root.iter('testsuite')
+  for suite in suites:
+    for name in counts:
+      counts[name] += int(suite.get(name, 0))
+  counts['passed'] = counts['tests'] - counts['failures'] - counts['errors'] - counts['skipped']
+  return counts
+
+def run_tests(
+  root_path: str,
+  files: dict[str, str],
+  test_paths: Optional[list[str]] = None,
+  timeout: float = DEFAULT_TIMEOUT,
+) -> dict:
+  """Copy a repository, write edited files over the copy and run pytest in a subprocess
+
+  Args:
+    root_path (str): Repository root, left untouched
+    files (dict[str, str]): Edited file contents by path relative to root_path
+    test_paths (list[str], optional): Test files, directories or node ids to run. None runs everything.
+    timeout (float): Seconds before the run is killed
+
+  Returns:
+    dict: 'passed', 'failures', 'errors', 'skipped' and 'tests' counts, plus 'timed_out'
+  """
+  with tempfile.TemporaryDirectory(prefix='al-mod-candidate-') as tmp_dir:
+    work_dir = os.path.join(tmp_dir, 'repo')
+    shutil.copytree(root_path, work_dir, ignore=COPY_IGNORE, symlinks=True)
+    for rel_path, content in files.items():
+      path = os.path.join(work_dir, rel_path)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+    xml_path = os.path.join(tmp_dir, 'report.xml')
+    command = [sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider', f'--junitxml={xml_path}', *(test_paths or [])]
+    try:
+      subprocess.run(command, cwd=work_dir, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+      return {'tests': 0, 'passed': 0, 'failures': 0, 'errors': 0, 'skipped': 0, 'timed_out': True}
+
+    if not os.path.exists(xml_path):
+      # pytest couldn't even collect, e.g. a bad conftest
+      return {'tests': 0, 'passed': 0, 'failures': 0, 'errors': 1, 'skipped': 0, 'timed_out': False}
+    return {**parse_junit(xml_path), 'timed_out': False}
+
+def run_candidates(
+  root_path: str,
+  candidates: list[dict[str, str]],
+  test_paths: Optional[list[str]] = None,
+  timeout: float = DEFAULT_TIMEOUT,
+  max_workers: Optional[int] = None,
+) -> list[dict]:
+  """Run the tests for several candidates in parallel processes
+
+  Args:
+    root_path (str): Repository root
+    candidates (list[dict[str, str]]): Edited files of each candidate
+    test_paths (list[str], optional): Tests to run for every candidate. None runs everything.
+    timeout (float): Seconds before each run is killed
+    max_workers (int, optional): Maximum concurrent runs. Defaults to the CPU count.
+
+  Returns:
+    list[dict]: Results from run_tests, in the order of candidates
+  """
+  max_workers = max_workers or os.cpu_count() or 1
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    return list(executor.map(lambda files: run_tests(root_path, files, test_paths, timeout), candidates))
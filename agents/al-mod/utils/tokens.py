@@ -0,0 +1,14 @@
+"""Token counting for prompt budgeting"""
+
+try:
+  import tiktoken
+  _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+  # tiktoken comes with litellm; without it (or its encoding files), estimate
+  _encoding = None
+
+def count_tokens(text: str) -> int:
+  """Count gpt-4o tokens in text, or estimate at ~4 characters per token"""
+  if _encoding is None:
+    return (len(text) + 3) // 4
+  return len(_encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,137 @@
+"""Logging setup and per-task traces of step timings, LLM calls, tokens and cost"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+LOG_LEVEL = os.getenv("AL_MOD_LOG_LEVEL", "INFO")
+TRACES_DIR = os.getenv("AL_MOD_TRACES_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'traces'))
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_current_step: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("step", default=None)
+
+logger = logging.getLogger(__name__)
+
+def configure_logging(level: str = LOG_LEVEL) -> None:
+  """Send al-mod's log records to stderr at the given level, e.g. DEBUG for per-file progress"""
+  # The agent's package logger, e.g. 'agents.al-mod'
+  package_logger = logging.getLogger(__name__.rsplit('.', 2)[0])
+  package_logger.setLevel(level.upper())
+  if not package_logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    package_logger.addHandler(handler)
+    package_logger.propagate = False
+
+class Trace:
+  """Timings of the steps of one task, and every LLM call made during them
+
+  Thread-safe, so calls made from worker threads can be recorded too.
+  """
+
+  def __init__(self, **metadata: Any):
+    """Initialize Trace
+
+    Args:
+      **metadata: Anything identifying the task, exported as-is
+    """
+    self.metadata = metadata
+    self.started = time.time()
+    self.steps: list[dict] = []
+    self.llm_calls: list[dict] = []
+    self.lock = threading.Lock()
+
+  def add_step(self, name: str, start: float, duration: float) -> None:
+    with self.lock:
+      self.steps.append({"name": name, "start": start - self.started, "duration": duration})
+
+  def add_llm_call(self, call: dict) -> None:
+    with self.lock:
+      self.llm_calls.append(call)
+
+  def summary(self) -> dict:
+    """Totals per step: wall time, number of LLM calls, cache hits, tokens and cost"""
+    with self.lock:
+      steps = {}
+      
+      def totals_for(name: str) -> dict:
+        return steps.setdefault(name, {"duration": 0.0, "calls": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+      
+      for step in self.steps:
+        totals_for(step["name"])["duration"] += step["duration"]
+      for call in self.llm_calls:
+        totals = totals_for(call["step"] or "other")
+        totals["calls"] += 1
+        totals["cached"] += call["cached"]
+        totals["prompt_tokens"] += call["usage"].get("prompt_tokens", 0)
+        totals["completion_tokens"] += call["usage"].get("completion_tokens", 0)
+        # Cache hits cost nothing
+        totals["cost"] += (call["cost"] or 0.0) if not call["cached"] else 0.0
+      return steps
+
+  def to_dict(self) -> dict:
+    with self.lock:
+      steps, llm_calls = list(self.steps), list(self.llm_calls)
+    return {
+      **self.metadata,
+      "started": self.started,
+      "duration": time.time() - self.started,
+      "summary": self.summary(),
+      "steps": steps,
+      "llm_calls": llm_calls,
+    }
+
+  def export(self, path: str) -> None:
+    """Write the trace as JSON"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+      json.dump(self.to_dict(), f, indent=2)
+
+@contextmanager
+def tracing(**metadata: Any) -> Iterator[Trace]:
+  """Make a new Trace current for the enclosed code, including asyncio tasks it starts"""
+  trace = Trace(**metadata)
+  token = _current_trace.set(trace)
+  try:
+    yield trace
+  finally:
+    _current_trace.reset(token)
+
+@contextmanager
+def step(name: str) -> Iterator[None]:
+  """Time a step of the current trace and attribute LLM calls inside it to the step"""
+  token = _current_step.set(name)
+  start = time.time()
+  try:
+    yield
+  finally:
+    duration = time.time() - start
+    _current_step.reset(token)
+    trace = _current_trace.get()
+    if trace is not None:
+      trace.add_step(name, start, duration)
+    logger.info(f"Step {name} took {duration:.2f}s")
+
+def record_llm_call(model: str, usage: dict, cost: Optional[float], cached: bool, duration: float) -> None:
+  """Add an LLM call to the current trace, if there is one"""
+  trace = _current_trace.get()
+  if trace is None:
+    return
+  trace.add_llm_call({
+    "step": _current_step.get(),
+    "model": model,
+    "usage": usage,
+    "cost": cost,
+    "cached": cached,
+    "duration": duration,
+  })
+
+def in_context(fn: Callable) -> Callable:
+  """Wrap fn to run in a copy of the caller's context, so worker threads record to the caller's trace and step"""
+  context = contextvars.copy_context()
+  return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
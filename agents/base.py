@@ -0,0 +1,56 @@
+"""Long-lived agent interface: set up once, then run many tasks"""
+
+import importlib
+import inspect
+from abc import ABC, abstractmethod
+from typing import Any, Callable
+
+from tasks.models import Task
+
+
+class Agent(ABC):
+  """Base class for agents that keep state across tasks
+
+  do_things.py creates one instance per run, calls setup() once, run(task) for
+  every task and close() at the end. run() may be called from several threads
+  at once (--workers), so state shared across tasks must be safe to share.
+  """
+
+  def setup(self) -> None:
+    """Build anything expensive that every task needs"""
+
+  @abstractmethod
+  def run(self, task: Task) -> Any:
+    """Solve one task"""
+
+  def close(self) -> None:
+    """Release anything setup() acquired"""
+
+
+class FunctionAgent(Agent):
+  """Agent for a main.py that only defines a main(task) function"""
+
+  def __init__(self, main: Callable[[Task], Any]):
+    self.main = main
+
+  def run(self, task: Task) -> Any:
+    return self.main(task)
+
+
+def load_agent(name: str) -> Agent:
+  """Import agents/<name>/main.py and create its agent, not yet set up
+
+  Uses the Agent subclass defined in the module if there is one, otherwise wraps its main().
+
+  Raises:
+    ImportError: If the module can't be imported
+    AttributeError: If the module defines neither an Agent subclass nor main()
+  """
+  module = importlib.import_module(f"agents.{name}.main")
+  for value in vars(module).values():
+    if (
+      isinstance(value, type) and issubclass(value, Agent)
+      and value.__module__ == module.__name__ and not inspect.isabstract(value)
+    ):
+      return value()
+  return FunctionAgent(module.main)
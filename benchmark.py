@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from agents.base import load_agent
+from do_things import load_tasks, run_tasks
+
+
+def summarize_traces(traces: list[dict]) -> dict:
+  """Per-step latency, LLM calls and prompt sizes across task traces
+
+  Returns:
+    dict: For each step, mean/median/max duration in seconds, mean LLM calls
+          and mean prompt tokens per task
+  """
+  by_step: dict[str, list[dict]] = {}
+  for trace in traces:
+    for name, totals in trace["summary"].items():
+      by_step.setdefault(name, []).append(totals)
+
+  return {
+    name: {
+      "mean_duration": statistics.mean(t["duration"] for t in totals),
+      "median_duration": statistics.median(t["duration"] for t in totals),
+      "max_duration": max(t["duration"] for t in totals),
+      "mean_calls": statistics.mean(t["calls"] for t in totals),
+      "mean_prompt_tokens": statistics.mean(t["prompt_tokens"] for t in totals),
+      "mean_completion_tokens": statistics.mean(t["completion_tokens"] for t in totals),
+    }
+    for name, totals in by_step.items()
+  }
+
+
+def print_report(report: dict) -> None:
+  print("\n=== Benchmark ===")
+  print(f"Tasks: {report['tasks']}, done: {report['done']}, errors: {report['tasks'] - report['done']}")
+  print(f"Wall time: {report['wall_time']:.2f}s, throughput: {report['tasks_per_minute']:.2f} tasks/min")
+  print(f"Peak traced memory: {report['peak_memory_mb']:.1f} MB")
+  if report["task_peak_memory_mb"]:
+    print(f"Peak traced memory per task: max {max(report['task_peak_memory_mb']):.1f} MB")
+
+  print(f"\n{'step':<12}{'mean s':>10}{'median s':>10}{'max s':>10}{'calls':>8}{'prompt tok':>12}{'compl tok':>11}")
+  for name, step in report["steps"].items():
+    print(
+      f"{name:<12}{step['mean_duration']:>10.3f}{step['median_duration']:>10.3f}{step['max_duration']:>10.3f}"
+      f"{step['mean_calls']:>8.1f}{step['mean_prompt_tokens']:>12.0f}{step['mean_completion_tokens']:>11.0f}"
+    )
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark an agent's pipeline, offline by default")
+  parser.add_argument("--agent", default="al-mod", help="Name of agent folder")
+  parser.add_argument("--tasks", nargs="*", help="Names of tasks files (default: every tasks/*.jsonl)")
+  parser.add_argument(
+    "--mode",
+    choices=["replay", "record", "live"],
+    default="replay",
+    help="replay recorded LLM responses (no network), record them from live calls, or only call live",
+  )
+  parser.add_argument("--fixtures", help="JSONL file of recorded LLM responses (default: the agent's own)")
+  parser.add_argument("--workers", type=int, default=1, help="Number of tasks to run concurrently")
+  parser.add_argument("--repeat", type=int, default=1, help="Run every task this many times")
+  parser.add_argument("--output", help="Also write the report to this JSON file")
+  args = parser.parse_args()
+
+  # The agent reads these when it is imported
+  trace_dir = tempfile.mkdtemp(prefix="benchmark-traces-")
+  os.environ["AL_MOD_LLM_MODE"] = args.mode
+  os.environ["AL_MOD_TRACES_DIR"] = trace_dir
+  if args.fixtures:
+    os.environ["AL_MOD_LLM_FIXTURES"] = args.fixtures
+
+  try:
+    agent = load_agent(args.agent)
+  except (ImportError, AttributeError) as e:
+    raise SystemExit(f"Could not load agent {args.agent}: {e}")
+
+  task_files = [Path("tasks") / name for name in args.tasks] if args.tasks else sorted(Path("tasks").glob("*.jsonl"))
+  tasks = [task for tasks_file in task_files for task in load_tasks(tasks_file)] * args.repeat
+  if not tasks:
+    raise SystemExit("No tasks to run")
+
+  # Peaks per task only mean something when tasks run one at a time
+  task_peaks: list[float] = []
+
+  def measured_main(task):
+    if args.workers > 1:
+      return agent.run(task)
+    tracemalloc.reset_peak()
+    try:
+      return agent.run(task)
+    finally:
+      task_peaks.append(tracemalloc.get_traced_memory()[1] / 2**20)
+
+  # Warm agents reuse per-env state, so later repeats show the steady-state cost
+  agent.setup()
+  tracemalloc.start()
+  start = time.perf_counter()
+  try:
+    outcomes = run_tasks(measured_main, tasks, workers=args.workers)
+  finally:
+    agent.close()
+  wall_time = time.perf_counter() - start
+  peak = tracemalloc.get_traced_memory()[1] / 2**20
+  tracemalloc.stop()
+
+  traces = []
+  for trace_path in sorted(Path(trace_dir).glob("*.json")):
+    with open(trace_path) as f:
+      traces.append(json.load(f))
+
+  report = {
+    "agent": args.agent,
+    "mode": args.mode,
+    "tasks": len(outcomes),
+    "done": sum(1 for outcome in outcomes if outcome["status"] == "done"),
+    "wall_time": wall_time,
+    "tasks_per_minute": len(outcomes) / wall_time * 60,
+    "peak_memory_mb": max([peak] + task_peaks),
+    "task_peak_memory_mb": task_peaks,
+    "steps": summarize_traces(traces),
+  }
+  print_report(report)
+  for outcome in outcomes:
+    if outcome["error"]:
+      print(f"\n[{outcome['index'] + 1}] Error: {outcome['error'].splitlines()[0]}")
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
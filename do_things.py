@@ -1,40 +1,214 @@
 import argparse
+import hashlib
 import json
-import importlib
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Any, Callable, Optional
+from pydantic import BaseModel
+from agents.base import load_agent
 from tasks.models import Task
 
+RUNS_DIR = Path("runs")
+
+
+def load_tasks(tasks_file: Path) -> list[Task]:
+  """Load tasks from a jsonl file, skipping blank and invalid lines"""
+  tasks = []
+  with open(tasks_file) as f:
+    for line in f:
+      if not line.strip():
+        continue
+      try:
+        tasks.append(Task(**json.loads(line)))
+      except json.JSONDecodeError:
+        print(f"Invalid JSON in line: {line}")
+      except Exception as e:
+        print(f"Invalid task in line: {line} ({e})")
+  return tasks
+
+
+def task_hash(task: Task) -> str:
+  """Stable content hash identifying a task across runs"""
+  payload = json.dumps(task.model_dump(), sort_keys=True)
+  return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def to_jsonable(value: Any) -> Any:
+  """json.dump default hook for agent results (e.g. lists of pydantic models)"""
+  if isinstance(value, BaseModel):
+    return value.model_dump()
+  if isinstance(value, (set, tuple)):
+    return list(value)
+  return str(value)
+
+
+class Journal:
+  """Append-only jsonl checkpoint journal with one entry per finished task
+
+  Entries are flushed and fsynced as each task finishes, so a crashed or
+  killed run keeps every result it already paid for.
+  """
+
+  def __init__(self, run_dir: Path):
+    self.run_dir = run_dir
+    self.path = run_dir / "journal.jsonl"
+    self.results_dir = run_dir / "results"
+    self.results_dir.mkdir(parents=True, exist_ok=True)
+
+  def completed(self) -> set[str]:
+    """Hashes of tasks whose latest journal entry is done"""
+    status = {}
+    if self.path.exists():
+      with open(self.path) as f:
+        for line in f:
+          try:
+            entry = json.loads(line)
+          except json.JSONDecodeError:
+            # A partially written last line from a killed run
+            continue
+          status[entry["task_hash"]] = entry["status"]
+    return {h for h, s in status.items() if s == "done"}
+
+  def record(self, outcome: dict) -> None:
+    """Write the task result (if any) and append its journal entry"""
+    h = task_hash(outcome["task"])
+    result_path = None
+    if outcome["status"] == "done":
+      result_path = self.results_dir / f"{h}.json"
+      with open(result_path, "w") as f:
+        json.dump(outcome["result"], f, indent=2, default=to_jsonable)
+
+    entry = {
+      "task_hash": h,
+      "status": outcome["status"],
+      "started_at": outcome["started_at"],
+      "duration": outcome["duration"],
+      "result_path": str(result_path) if result_path else None,
+      "error": outcome["error"],
+    }
+    with open(self.path, "a") as f:
+      f.write(json.dumps(entry) + "\n")
+      f.flush()
+      os.fsync(f.fileno())
+
+
+def run_task(agent_main: Callable[[Task], Any], index: int, task: Task) -> dict:
+  """Run one task and capture its outcome instead of raising
+
+  Returns:
+    dict: index, task, status ("done" or "error"), result, error, started_at and duration in seconds
+  """
+  started_at = time.time()
+  start = time.perf_counter()
+  try:
+    result = agent_main(task)
+    status, error = "done", None
+  except Exception as e:
+    result = None
+    status, error = "error", f"{e}\n{traceback.format_exc()}"
+  return {
+    "index": index,
+    "task": task,
+    "status": status,
+    "result": result,
+    "error": error,
+    "started_at": started_at,
+    "duration": time.perf_counter() - start,
+  }
+
+
+def run_tasks(
+  agent_main: Callable[[Task], Any],
+  tasks: list[Task],
+  workers: int = 1,
+  on_done: Optional[Callable[[dict], None]] = None,
+) -> list[dict]:
+  """Run tasks on a bounded worker pool
+
+  Args:
+    agent_main: The agent entrypoint, called once per task
+    tasks: Tasks to run
+    workers (int): Number of tasks to run concurrently. 1 runs tasks serially in this thread.
+    on_done (callable, optional): Called in this thread with each outcome as soon as its task finishes
+
+  Returns:
+    list[dict]: Outcomes from run_task, in the same order as tasks
+  """
+  def finish(outcome: dict) -> dict:
+    print(f"[{outcome['index'] + 1}/{len(tasks)}] {outcome['status']} in {outcome['duration']:.1f}s")
+    if on_done is not None:
+      on_done(outcome)
+    return outcome
+
+  if workers <= 1:
+    return [finish(run_task(agent_main, i, task)) for i, task in enumerate(tasks)]
+
+  outcomes: list[Optional[dict]] = [None] * len(tasks)
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(run_task, agent_main, i, task) for i, task in enumerate(tasks)]
+    for future in as_completed(futures):
+      outcome = finish(future.result())
+      outcomes[outcome["index"]] = outcome
+  return outcomes
+
+
+def print_summary(outcomes: list[dict], wall_time: float) -> None:
+  """Print per-task outcomes in task order, followed by totals"""
+  print("\n=== Results ===")
+  for outcome in outcomes:
+    task = outcome["task"]
+    print(f"[{outcome['index'] + 1}] {outcome['status']} ({outcome['duration']:.1f}s) {task.env}: {task.problem[:80]}")
+    if outcome["error"]:
+      print(f"    Error: {outcome['error'].splitlines()[0]}")
+
+  done = sum(1 for outcome in outcomes if outcome["status"] == "done")
+  task_time = sum(outcome["duration"] for outcome in outcomes)
+  print("\n=== Summary ===")
+  print(f"Tasks: {len(outcomes)}, done: {done}, errors: {len(outcomes) - done}")
+  print(f"Wall time: {wall_time:.1f}s, summed task time: {task_time:.1f}s")
+
+
 if __name__ == "__main__":
   # Parse command line arguments
   parser = argparse.ArgumentParser()
   parser.add_argument("--agent", required=True, help="Name of agent folder")
   parser.add_argument("--tasks", required=True, help="Name of tasks file")
+  parser.add_argument("--workers", type=int, default=1, help="Number of tasks to run concurrently")
+  parser.add_argument("--run-dir", help="Directory for the checkpoint journal and results (default: runs/<agent>/<tasks>)")
+  parser.add_argument("--resume", action="store_true", help="Skip tasks already marked done in the journal")
   args = parser.parse_args()
 
-  # Import the agent's main function
+  # Create the agent once; it is reused for every task
   try:
-    agent_module = importlib.import_module(f"agents.{args.agent}.main")
-    agent_main = agent_module.main
+    agent = load_agent(args.agent)
   except ImportError as e:
-    print(f"Could not import agent {args.agent}: {e}")
+    raise SystemExit(f"Could not import agent {args.agent}: {e}")
   except AttributeError:
-    print(f"Agent {args.agent} does not have a main() function")
+    raise SystemExit(f"Agent {args.agent} has neither an Agent class nor a main() function")
 
   # Load tasks from jsonl file
   tasks_file = Path("tasks") / args.tasks
   if not tasks_file.exists():
-    print(f"Tasks file {tasks_file} does not exist")
+    raise SystemExit(f"Tasks file {tasks_file} does not exist")
+  tasks = load_tasks(tasks_file)
+
+  # Journal each task as it finishes; on --resume, skip the ones already done
+  run_dir = Path(args.run_dir) if args.run_dir else RUNS_DIR / args.agent / tasks_file.stem
+  journal = Journal(run_dir)
+  if args.resume:
+    done = journal.completed()
+    skipped = sum(1 for task in tasks if task_hash(task) in done)
+    tasks = [task for task in tasks if task_hash(task) not in done]
+    print(f"Resuming from {journal.path}: skipping {skipped} done tasks, {len(tasks)} remaining")
 
   # Process each task
-  with open(tasks_file) as f:
-    for line in f:
-      if not line.strip():
-        continue
-      try:
-        task_dict = json.loads(line)
-        task = Task(**task_dict)
-        agent_main(task)
-      except json.JSONDecodeError:
-        print(f"Invalid JSON in line: {line}")
-      except Exception as e:
-        print(f"Error processing task: {e}")
\ No newline at end of file
+  agent.setup()
+  try:
+    start = time.perf_counter()
+    outcomes = run_tasks(agent.run, tasks, workers=args.workers, on_done=journal.record)
+    print_summary(outcomes, time.perf_counter() - start)
+  finally:
+    agent.close()
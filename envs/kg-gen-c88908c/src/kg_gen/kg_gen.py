@@ -1,22 +1,30 @@
-from typing import Union, List, Dict, Optional
+from typing import Awaitable, Union, List, Dict, Optional, Tuple
 from openai import OpenAI
 
-from .steps._1_get_entities import get_entities
-from .steps._2_get_relations import get_relations
-from .steps._3_cluster_graph import cluster_graph
+from .steps._1_get_entities import get_entities, aget_entities
+from .steps._2_get_relations import get_relations, aget_relations
+from .steps._3_cluster_graph import cluster_graph, acluster_graph, update_clustered_graph, aupdate_clustered_graph
 from .utils.chunk_text import chunk_text
+from .utils.rate_limiter import RateLimiter, estimate_tokens
+from .utils.extraction_cache import ExtractionCache
 from .models import Graph
+import asyncio
 import dspy
+import inspect
 import json
 import os
-from concurrent.futures import ThreadPoolExecutor
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
   
 class KGGen:
   def __init__(
     self,
     model: str = "openai/gpt-4o",
     temperature: float = 0.0,
-    api_key: str = None
+    api_key: str = None,
+    max_concurrency: int = 8,
+    tokens_per_minute: Optional[float] = None,
+    cache_path: Optional[str] = None
   ):
     """Initialize KGGen with optional model configuration
     
@@ -24,11 +32,21 @@ class KGGen:
         model: Name of model to use (e.g. 'gpt-4')
         temperature: Temperature for model sampling
         api_key: API key for model access
+        max_concurrency: Maximum number of model calls in flight when processing chunks,
+            and across all async calls on an event loop
+        tokens_per_minute: Estimated prompt tokens allowed per minute across all calls, or None for no limit
+        cache_path: SQLite file caching the entities and relations extracted from each chunk,
+            so unchanged text isn't sent to the model again. None disables the cache.
     """
     self.dspy = dspy
     self.model = model
     self.temperature = temperature
     self.api_key = api_key
+    self.max_concurrency = max_concurrency
+    self.rate_limiter = RateLimiter(tokens_per_minute) if tokens_per_minute else None
+    self.extraction_cache = ExtractionCache(cache_path) if cache_path else None
+    # One semaphore per event loop, shared by every async call on it
+    self.semaphores = weakref.WeakKeyDictionary()
     self.init_model(model, temperature, api_key)
       
   def init_model(
@@ -39,6 +57,9 @@ class KGGen:
   ):
     """Initialize or reinitialize the model with new parameters
     
+    The LM belongs to this instance and is only set for the duration of each
+    call, so instances with different models can run concurrently.
+    
     Args:
         model: Name of model to use (e.g. 'gpt-4')
         temperature: Temperature for model sampling
@@ -53,12 +74,148 @@ class KGGen:
       self.api_key = api_key
       
     # Initialize dspy LM with current settings
-    if self.api_key:
-      self.lm = dspy.LM(model=self.model, api_key=self.api_key, temperature=self.temperature)
-    else:
-      self.lm = dspy.LM(model=self.model, temperature=self.temperature)
+    self.lm = self._create_lm(self.model, self.temperature, self.api_key)
+    
+  def _create_lm(self, model: str, temperature: float, api_key: Optional[str]) -> dspy.LM:
+    if api_key:
+      return dspy.LM(model=model, api_key=api_key, temperature=temperature)
+    return dspy.LM(model=model, temperature=temperature)
+
+  def _lm_for_call(self, model: str = None, temperature: float = None, api_key: str = None) -> dspy.LM:
+    """LM for one call: this instance's own, or one with the given overrides, leaving the instance unchanged"""
+    if model is None and temperature is None and api_key is None:
+      return self.lm
+    return self._create_lm(
+      model or self.model,
+      temperature if temperature is not None else self.temperature,
+      api_key or self.api_key
+    )
+    
+  def _process_input(self, input_data: Union[str, List[Dict]]) -> Tuple[str, bool]:
+    """Turn text or a messages array into text to extract from, and whether it is a conversation"""
+    is_conversation = isinstance(input_data, list)
+    if is_conversation:
+      # Extract text from messages
+      text_content = []
+      for message in input_data:
+        if not isinstance(message, dict) or 'role' not in message or 'content' not in message:
+          raise ValueError("Messages must be dicts with 'role' and 'content' keys")
+        if message['role'] in ['user', 'assistant']:
+          text_content.append(f"{message['role']}: {message['content']}")
       
-    self.dspy.configure(lm=self.lm)
+      # Join with newlines to preserve message boundaries
+      return "\n".join(text_content), True
+    return input_data, False
+
+  # dspy.context is per thread, so these set the LM themselves when run in worker threads
+  def _get_entities(self, lm: dspy.LM, text: str, is_conversation: bool) -> List[str]:
+    if self.rate_limiter is not None:
+      self.rate_limiter.acquire(estimate_tokens(text))
+    with dspy.context(lm=lm):
+      return get_entities(self.dspy, text, is_conversation=is_conversation)
+
+  def _get_relations(self, lm: dspy.LM, text: str, entities: List[str], is_conversation: bool) -> List[Tuple[str, str, str]]:
+    if self.rate_limiter is not None:
+      self.rate_limiter.acquire(estimate_tokens(text, *entities))
+    with dspy.context(lm=lm):
+      return get_relations(self.dspy, text, entities, is_conversation=is_conversation)
+
+  def _cached_extraction(self, lm: dspy.LM, text: str, is_conversation: bool) -> Optional[Tuple[List[str], List[Tuple[str, str, str]]]]:
+    if self.extraction_cache is None:
+      return None
+    return self.extraction_cache.get(text, lm.model, lm.kwargs.get("temperature"), is_conversation)
+
+  def _cache_extraction(self, lm: dspy.LM, text: str, is_conversation: bool, entities: List[str], relations: List[Tuple[str, str, str]]) -> None:
+    if self.extraction_cache is not None:
+      self.extraction_cache.set(text, lm.model, lm.kwargs.get("temperature"), is_conversation, entities, relations)
+
+  def _extract_chunk(self, lm: dspy.LM, text: str, is_conversation: bool) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+    """Extract entities and then relations from one chunk, unless they are cached"""
+    cached = self._cached_extraction(lm, text, is_conversation)
+    if cached is not None:
+      return cached
+    entities = self._get_entities(lm, text, is_conversation)
+    relations = self._get_relations(lm, text, entities, is_conversation)
+    self._cache_extraction(lm, text, is_conversation, entities, relations)
+    return entities, relations
+
+  def _extract_chunks(self, lm: dspy.LM, chunks: List[Tuple[str, bool]]) -> List[Tuple[List[str], List[Tuple[str, str, str]]]]:
+    """Extract entities and then relations from every chunk, with at most max_concurrency calls in flight
+    
+    A chunk's relations are requested as soon as its entities arrive, ahead of chunks
+    not started yet, so entity extraction for later chunks overlaps relation
+    extraction for earlier ones. Cached chunks are skipped.
+    
+    Args:
+        lm: LM to extract with
+        chunks: (text, is_conversation) pairs
+        
+    Returns:
+        (entities, relations) for each chunk, in order
+    """
+    results = [None] * len(chunks)
+    not_started = iter(range(len(chunks)))
+    with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+      # Future -> (chunk index, its entities once known)
+      in_flight = {}
+
+      def start_next_chunk():
+        for index in not_started:
+          text, is_conversation = chunks[index]
+          results[index] = self._cached_extraction(lm, text, is_conversation)
+          if results[index] is None:
+            in_flight[executor.submit(self._get_entities, lm, text, is_conversation)] = (index, None)
+            return
+
+      for _ in range(self.max_concurrency):
+        start_next_chunk()
+      while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+          index, entities = in_flight.pop(future)
+          text, is_conversation = chunks[index]
+          if entities is None:
+            entities = future.result()
+            in_flight[executor.submit(self._get_relations, lm, text, entities, is_conversation)] = (index, entities)
+          else:
+            results[index] = (entities, future.result())
+            self._cache_extraction(lm, text, is_conversation, *results[index])
+            start_next_chunk()
+    return results
+
+  def _semaphore(self) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = self.semaphores.get(loop)
+    if semaphore is None:
+      semaphore = self.semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+    return semaphore
+
+  async def _aextract_chunk(self, lm: dspy.LM, text: str, is_conversation: bool) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+    """Extract entities and then relations from a chunk on the event loop, unless they are cached"""
+    cached = self._cached_extraction(lm, text, is_conversation)
+    if cached is not None:
+      return cached
+    if self.rate_limiter is not None:
+      await self.rate_limiter.aacquire(estimate_tokens(text))
+    entities = await aget_entities(lm, text, is_conversation, self._semaphore())
+    if self.rate_limiter is not None:
+      await self.rate_limiter.aacquire(estimate_tokens(text, *entities))
+    relations = await aget_relations(lm, text, entities, is_conversation, self._semaphore())
+    self._cache_extraction(lm, text, is_conversation, entities, relations)
+    return entities, relations
+
+  def _write_graph(self, output_folder: str, entities: set[str], relations: set[Tuple[str, str, str]], edges: set[str]) -> None:
+    os.makedirs(output_folder, exist_ok=True)
+    output_path = os.path.join(output_folder, 'graph.json')
+    
+    graph_dict = {
+      'entities': list(entities),
+      'relations': list(relations),
+      'edges': list(edges)
+    }
+    
+    with open(output_path, 'w') as f:
+      json.dump(graph_dict, f, indent=2)
     
   def generate(
     self,
@@ -96,45 +253,19 @@ class KGGen:
         Generated knowledge graph
     """
     
-    # Process input data
-    is_conversation = isinstance(input_data, list)
-    if is_conversation:
-      # Extract text from messages
-      text_content = []
-      for message in input_data:
-        if not isinstance(message, dict) or 'role' not in message or 'content' not in message:
-          raise ValueError("Messages must be dicts with 'role' and 'content' keys")
-        if message['role'] in ['user', 'assistant']:
-          text_content.append(f"{message['role']}: {message['content']}")
-      
-      # Join with newlines to preserve message boundaries
-      processed_input = "\n".join(text_content)
-    else:
-      processed_input = input_data
+    processed_input, is_conversation = self._process_input(input_data)
 
-    if any([model, temperature, api_key]):
-      self.init_model(
-        model=model or self.model,
-        temperature=temperature or self.temperature,
-        api_key=api_key or self.api_key
-      )
+    lm = self._lm_for_call(model, temperature, api_key)
     
     if not chunk_size:
-      entities = get_entities(self.dspy, processed_input, is_conversation=is_conversation)
-      relations = get_relations(self.dspy, processed_input, entities, is_conversation=is_conversation)
+      entities, relations = self._extract_chunk(lm, processed_input, is_conversation)
     else:
       chunks = chunk_text(processed_input, chunk_size)
       entities = set()
       relations = set()
 
-      def process_chunk(chunk):
-        chunk_entities = get_entities(self.dspy, chunk, is_conversation=is_conversation)
-        chunk_relations = get_relations(self.dspy, chunk, chunk_entities, is_conversation=is_conversation)
-        return chunk_entities, chunk_relations
-
-      # Process chunks in parallel using ThreadPoolExecutor
-      with ThreadPoolExecutor() as executor:
-        results = list(executor.map(process_chunk, chunks))
+      # Process chunks in parallel, pipelining entity and relation extraction
+      results = self._extract_chunks(lm, [(chunk, is_conversation) for chunk in chunks])
         
       # Combine results
       for chunk_entities, chunk_relations in results:
@@ -148,23 +279,107 @@ class KGGen:
     )
     
     if cluster:
-      graph = self.cluster(graph, context)
+      graph = self.cluster(graph, context, model=model, temperature=temperature, api_key=api_key)
     
     if output_folder:
-      os.makedirs(output_folder, exist_ok=True)
-      output_path = os.path.join(output_folder, 'graph.json')
+      self._write_graph(output_folder, entities, relations, graph.edges)
       
-      graph_dict = {
-        'entities': list(entities),
-        'relations': list(relations),
-        'edges': list(graph.edges)
-      }
-      
-      with open(output_path, 'w') as f:
-        json.dump(graph_dict, f, indent=2)
+    return graph
+    
+  async def agenerate(
+    self,
+    input_data: Union[str, List[Dict]],
+    model: str = None,
+    api_key: str = None,
+    context: str = "",
+    chunk_size: Optional[int] = None,
+    cluster: bool = False,
+    temperature: float = None,
+    output_folder: Optional[str] = None
+  ) -> Graph:
+    """Async version of generate.
+    
+    Every chunk is extracted concurrently. Model calls go through LiteLLM's async
+    client, capped by max_concurrency across all async calls on the event loop
+    and by tokens_per_minute. They share the LiteLLM disk cache with generate and
+    are recorded in the LM's history, but skip DSPy's in-memory cache and any
+    DSPy callbacks.
+    """
+    processed_input, is_conversation = self._process_input(input_data)
+
+    lm = self._lm_for_call(model, temperature, api_key)
+    
+    chunks = chunk_text(processed_input, chunk_size) if chunk_size else [processed_input]
+    results = await asyncio.gather(*(self._aextract_chunk(lm, chunk, is_conversation) for chunk in chunks))
+    entities = set()
+    relations = set()
+    for chunk_entities, chunk_relations in results:
+      entities.update(chunk_entities)
+      relations.update(chunk_relations)
+    
+    graph = Graph(
+      entities = entities,
+      relations = relations,
+      edges = {relation[1] for relation in relations}
+    )
+    
+    if cluster:
+      graph = await self.acluster(graph, context, model=model, temperature=temperature, api_key=api_key)
+    
+    if output_folder:
+      self._write_graph(output_folder, entities, relations, graph.edges)
       
     return graph
     
+  def generate_many(
+    self,
+    inputs: List[Union[str, List[Dict]]],
+    model: str = None,
+    api_key: str = None,
+    chunk_size: Optional[int] = None,
+    temperature: float = None,
+  ) -> List[Graph]:
+    """Generate one knowledge graph per input, extracting from all of them concurrently.
+    
+    Chunks of every input share one pipeline bounded by max_concurrency and
+    tokens_per_minute, so large corpora can be ingested without bursts of requests.
+    Combine the results with aggregate() and cluster() if needed.
+    
+    Args:
+        inputs: Text strings or lists of message dicts
+        model: Name of model to use
+        api_key (str): API key for making model calls
+        chunk_size: Max size of text chunks in characters to process
+        temperature: Temperature for model sampling
+        
+    Returns:
+        Generated knowledge graphs, in the same order as inputs
+    """
+    lm = self._lm_for_call(model, temperature, api_key)
+
+    chunks = []
+    owners = []
+    for i, input_data in enumerate(inputs):
+      processed_input, is_conversation = self._process_input(input_data)
+      for chunk in chunk_text(processed_input, chunk_size) if chunk_size else [processed_input]:
+        chunks.append((chunk, is_conversation))
+        owners.append(i)
+
+    entities = [set() for _ in inputs]
+    relations = [set() for _ in inputs]
+    for i, (chunk_entities, chunk_relations) in zip(owners, self._extract_chunks(lm, chunks)):
+      entities[i].update(chunk_entities)
+      relations[i].update(chunk_relations)
+
+    return [
+      Graph(
+        entities = input_entities,
+        relations = input_relations,
+        edges = {relation[1] for relation in input_relations}
+      )
+      for input_entities, input_relations in zip(entities, relations)
+    ]
+    
   def cluster(
     self, 
     graph: Graph,
@@ -173,15 +388,24 @@ class KGGen:
     temperature: float = None,
     api_key: str = None,
   ) -> Graph:
-    # Initialize dspy with new parameters if any are provided
-    if any([model, temperature, api_key]):
-      self.init_model(
-        model=model or self.model,
-        temperature=temperature or self.temperature,
-        api_key=api_key or self.api_key
-      )
+    # Use a model with the new parameters for this call if any are provided
+    lm = self._lm_for_call(model, temperature, api_key)
 
-    return cluster_graph(self.dspy, graph, context)
+    with dspy.context(lm=lm):
+      return cluster_graph(self.dspy, graph, context)
+  
+  async def acluster(
+    self, 
+    graph: Graph,
+    context: str = "",
+    model: str = None,
+    temperature: float = None,
+    api_key: str = None,
+  ) -> Graph:
+    """Async version of cluster, clustering entities and edges concurrently"""
+    lm = self._lm_for_call(model, temperature, api_key)
+
+    return await acluster_graph(lm, graph, context, self._semaphore())
   
   def aggregate(self, graphs: list[Graph]) -> Graph:
     # Initialize empty sets for combined graph
@@ -201,3 +425,67 @@ class KGGen:
       relations=all_relations,
       edges=all_edges
     )
+  
+  async def aaggregate(self, graphs: list[Union[Graph, Awaitable[Graph]]]) -> Graph:
+    """Async version of aggregate that also accepts pending graphs, e.g. agenerate calls, and awaits them together"""
+    async def resolve(graph: Union[Graph, Awaitable[Graph]]) -> Graph:
+      return await graph if inspect.isawaitable(graph) else graph
+
+    return self.aggregate(await asyncio.gather(*(resolve(graph) for graph in graphs)))
+
+  def update(
+    self,
+    graph: Graph,
+    new_input: Union[str, List[Dict]],
+    context: str = "",
+    chunk_size: Optional[int] = None,
+    model: str = None,
+    temperature: float = None,
+    api_key: str = None,
+  ) -> Graph:
+    """Add new text or messages to an existing knowledge graph.
+    
+    Only new_input is extracted. If graph is clustered, its new entities and edges
+    are added to the existing clusters (or start clusters of their own) instead of
+    reclustering everything, so keeping a graph fresh costs work proportional to
+    the new input. An unclustered graph is simply aggregated with the new one.
+    
+    Args:
+        graph: Existing graph, e.g. from generate(..., cluster=True)
+        new_input: Text string or list of message dicts to add
+        context: Description of data context
+        chunk_size: Max size of text chunks in characters to process
+        model: Name of model to use
+        temperature: Temperature for model sampling
+        api_key (str): API key for making model calls
+        
+    Returns:
+        Merged knowledge graph
+    """
+    new_graph = self.generate(new_input, model=model, api_key=api_key, context=context, chunk_size=chunk_size, temperature=temperature)
+    if graph.entity_clusters is None or graph.edge_clusters is None:
+      return self.aggregate([graph, new_graph])
+
+    lm = self._lm_for_call(model, temperature, api_key)
+
+    with dspy.context(lm=lm):
+      return update_clustered_graph(self.dspy, graph, new_graph, context)
+
+  async def aupdate(
+    self,
+    graph: Graph,
+    new_input: Union[str, List[Dict]],
+    context: str = "",
+    chunk_size: Optional[int] = None,
+    model: str = None,
+    temperature: float = None,
+    api_key: str = None,
+  ) -> Graph:
+    """Async version of update"""
+    new_graph = await self.agenerate(new_input, model=model, api_key=api_key, context=context, chunk_size=chunk_size, temperature=temperature)
+    if graph.entity_clusters is None or graph.edge_clusters is None:
+      return self.aggregate([graph, new_graph])
+
+    lm = self._lm_for_call(model, temperature, api_key)
+
+    return await aupdate_clustered_graph(lm, graph, new_graph, context, self._semaphore())
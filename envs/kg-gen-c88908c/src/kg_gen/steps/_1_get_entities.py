@@ -1,6 +1,9 @@
-from typing import List
+import asyncio
+from typing import List, Optional
 import dspy 
 
+from ..utils.async_predict import apredict
+
 class TextEntities(dspy.Signature):
   """Extract key entities from the source text. Extracted entities are subjects or objects.
   This is for an extraction task, please be THOROUGH and accurate to the reference text."""
@@ -25,3 +28,11 @@ def get_entities(dspy: dspy.dspy, input_data: str, is_conversation: bool = False
   result = extract(source_text=input_data)
   return result.entities
 
+async def aget_entities(lm: dspy.LM, input_data: str, is_conversation: bool = False, semaphore: Optional[asyncio.Semaphore] = None) -> List[str]:
+  if is_conversation:
+    extract = dspy.Predict(ConversationEntities)
+  else:
+    extract = dspy.Predict(TextEntities)
+    
+  result = await apredict(extract, lm, semaphore, source_text=input_data)
+  return result.entities
@@ -1,6 +1,9 @@
-from typing import List
+import asyncio
+from typing import List, Optional, Tuple
 import dspy
 
+from ..utils.async_predict import apredict
+
 class TextRelations(dspy.Signature):
   """Extract subject-predicate-object triples from the source text. Subject and object must be from entities list. Entities provided were previously extracted from the same source text.
   This is for an extraction task, please be THOROUGH, accurate, and faithful to the reference text."""
@@ -33,4 +36,16 @@ def get_relations(dspy: dspy.dspy, input_data: str, entities: list[str], is_conv
     (s, p, o) for s, p, o in result.relations 
     if s in entities and o in entities
   ]
-  return filtered_relations
\ No newline at end of file
+  return filtered_relations
+
+async def aget_relations(lm: dspy.LM, input_data: str, entities: list[str], is_conversation: bool = False, semaphore: Optional[asyncio.Semaphore] = None) -> List[Tuple[str, str, str]]:
+  if is_conversation:
+    extract = dspy.Predict(ConversationRelations)
+  else:
+    extract = dspy.Predict(TextRelations)
+    
+  result = await apredict(extract, lm, semaphore, source_text=input_data, entities=entities)
+  return [
+    (s, p, o) for s, p, o in result.relations 
+    if s in entities and o in entities
+  ]
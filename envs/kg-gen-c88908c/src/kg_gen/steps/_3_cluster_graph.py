@@ -1,9 +1,15 @@
 from ..models import Graph
+from ..utils.async_predict import apredict
+import asyncio
 import dspy
-from typing import Optional
+import heapq
+from difflib import SequenceMatcher
+from typing import Any, Generator, Optional
 
 LOOP_N = 8 
 BATCH_SIZE = 10
+# Most existing clusters shown to the model when assigning a batch of items
+MAX_CANDIDATE_CLUSTERS = 50
 
 class ExtractCluster(dspy.Signature):
   """Find one cluster of related items from the list.
@@ -41,30 +47,36 @@ class CheckExistingClusters(dspy.Signature):
   cluster_reps_that_items_belong_to: list[Optional[str]] = dspy.OutputField(desc="ordered list of cluster representatives where each is the cluster where that item belongs to, or None if no match. THIS LIST LENGTH IS SAME AS ITEMS LIST LENGTH")
 
 
-def cluster_items(dspyi: dspy.dspy, items: set[str], item_type: str = "entities", context: str = "") -> tuple[set[str], dict[str, set[str]]]:
-  """Returns item set and cluster dict mapping representatives to sets of items"""
+# Each model call in clustering, as (module, inputs), answered with the module's prediction
+ClusterSteps = Generator[tuple[dspy.Module, dict[str, Any]], dspy.Prediction, tuple[set[str], dict[str, set[str]]]]
+
+def _cluster_items(items: set[str], item_type: str = "entities", context: str = "") -> ClusterSteps:
+  """Clustering algorithm shared by cluster_items and acluster_items
+  
+  Yields each model call instead of making it, so the same steps can be driven
+  synchronously or on an event loop.
+  """
   
   context = f"{item_type} of a graph extracted from source text." + context
   remaining_items = items.copy()
   clusters = {} 
   no_progress_count = 0
   
-  extract = dspyi.Predict(ExtractCluster)
-  validate = dspyi.Predict(ValidateCluster)
-  choose_rep = dspyi.Predict(ChooseRepresentative)
-  check_existing = dspyi.ChainOfThought(CheckExistingClusters)
+  extract = dspy.Predict(ExtractCluster)
+  validate = dspy.Predict(ValidateCluster)
+  choose_rep = dspy.Predict(ChooseRepresentative)
   
   while len(remaining_items) > 0:
-    e_result = extract(items=remaining_items, context=context)
+    e_result = yield extract, dict(items=remaining_items, context=context)
     suggested_cluster = e_result.cluster
     
     if len(suggested_cluster) > 0:
-      v_result = validate(cluster=suggested_cluster, context=context)
+      v_result = yield validate, dict(cluster=suggested_cluster, context=context)
       validated_cluster = v_result.validated_items
       
       if len(validated_cluster) > 1:
         no_progress_count = 0
-        r_result = choose_rep(cluster=validated_cluster, context=context)
+        r_result = yield choose_rep, dict(cluster=validated_cluster, context=context)
         representative = r_result.representative
         
         clusters[representative] = validated_cluster
@@ -77,54 +89,119 @@ def cluster_items(dspyi: dspy.dspy, items: set[str], item_type: str = "entities"
       break
     
   if len(remaining_items) > 0:
-    items_to_process = list(remaining_items) 
-      
-    for i in range(0, len(items_to_process), BATCH_SIZE):
-      batch = items_to_process[i:min(i + BATCH_SIZE, len(items_to_process))]
-      
-      if not clusters:
-        for item in batch:
-          clusters[item] = {item}
-        continue
-      
-      c_result = check_existing(
-        items=batch,
-        clusters=clusters,
-        context=context
-      )
-      cluster_reps = c_result.cluster_reps_that_items_belong_to  
-      
-      # Process each item with its corresponding representative
-      for i, item in enumerate(batch):
-        rep = cluster_reps[i] if i < len(cluster_reps) else None
-        if rep is not None and rep in clusters:
-          new_cluster = clusters[rep] | {item}
-          v_result = validate(cluster=new_cluster, context=context)
-          validated_items = v_result.validated_items
-          if len(validated_items) == len(clusters[rep]) + 1:
-            clusters[rep].add(item)
-          else:
-            clusters[item] = {item}
-        else:
-          clusters[item] = {item}
+    yield from _assign_to_clusters(list(remaining_items), clusters, context)
   new_items = set(clusters.keys())
   
   return new_items, clusters
 
-def cluster_graph(dspy: dspy.dspy, graph: Graph, context: str = "") -> Graph:
-  """Cluster entities and edges in a graph, updating relations accordingly.
+def _candidate_clusters(batch: list[str], clusters: dict[str, set[str]], keys: dict[str, set[str]], limit: int) -> dict[str, set[str]]:
+  """The limit clusters whose members are most similar to an item in batch
   
-  Args:
-      dspy: The DSPy runtime
-      graph: Input graph with entities, edges, and relations
-      context: Additional context string for clustering
-      
-  Returns:
-      Graph with clustered entities and edges, updated relations, and cluster mappings
+  Cluster members differ only in tense, plural form, stem or case, so an item
+  shares most of its characters with a member of the cluster it belongs to.
+  keys maps each representative to the lowercased names in its cluster.
   """
-  entities, entity_clusters = cluster_items(dspy, graph.entities, "entities", context)
-  edges, edge_clusters = cluster_items(dspy, graph.edges, "edges", context)
+  if len(clusters) <= limit:
+    return clusters
+  
+  batch_keys = [item.lower() for item in batch]
+  # SequenceMatcher caches what it learns about seq2, so each member is analyzed once
+  matcher = SequenceMatcher()
+  
+  def similarity(rep: str) -> float:
+    best = 0.0
+    for member in keys[rep]:
+      matcher.set_seq2(member)
+      for item in batch_keys:
+        matcher.set_seq1(item)
+        if matcher.real_quick_ratio() > best and matcher.quick_ratio() > best:
+          best = max(best, matcher.ratio())
+    return best
+  
+  return {rep: clusters[rep] for rep in heapq.nlargest(limit, clusters, key=similarity)}
+
+def _assign_to_clusters(items: list[str], clusters: dict[str, set[str]], context: str, max_candidates: Optional[int] = None) -> Generator[tuple[dspy.Module, dict[str, Any]], dspy.Prediction, dict[str, set[str]]]:
+  """Add each item to the existing cluster it belongs to, or to a new cluster of its own
+  
+  Updates clusters in place, in batches of BATCH_SIZE items. If max_candidates is
+  given, each batch is only shown that many of the existing clusters, the ones
+  most similar to it, so prompts stay the same size as clusters grows. Otherwise
+  every batch sees every cluster. context should already describe the item type.
+  """
+  validate = dspy.Predict(ValidateCluster)
+  check_existing = dspy.ChainOfThought(CheckExistingClusters)
+  keys = {rep: {name.lower() for name in cluster | {rep}} for rep, cluster in clusters.items()} if max_candidates else {}
   
+  def add(rep: str, item: str) -> None:
+    clusters.setdefault(rep, set()).add(item)
+    if max_candidates:
+      keys.setdefault(rep, {rep.lower()}).add(item.lower())
+  
+  for i in range(0, len(items), BATCH_SIZE):
+    batch = items[i:min(i + BATCH_SIZE, len(items))]
+    
+    if not clusters:
+      for item in batch:
+        add(item, item)
+      continue
+    
+    c_result = yield check_existing, dict(
+      items=batch,
+      clusters=_candidate_clusters(batch, clusters, keys, max_candidates) if max_candidates else clusters,
+      context=context
+    )
+    cluster_reps = c_result.cluster_reps_that_items_belong_to  
+    
+    # Process each item with its corresponding representative
+    for i, item in enumerate(batch):
+      rep = cluster_reps[i] if i < len(cluster_reps) else None
+      if rep is not None and rep in clusters:
+        new_cluster = clusters[rep] | {item}
+        v_result = yield validate, dict(cluster=new_cluster, context=context)
+        validated_items = v_result.validated_items
+        if len(validated_items) == len(clusters[rep]) + 1:
+          add(rep, item)
+        else:
+          add(item, item)
+      else:
+        add(item, item)
+  
+  return clusters
+
+def _run(steps: Generator[tuple[dspy.Module, dict[str, Any]], dspy.Prediction, Any]) -> Any:
+  """Make each model call a step generator asks for with the configured LM, returning its result"""
+  try:
+    module, inputs = next(steps)
+    while True:
+      module, inputs = steps.send(module(**inputs))
+  except StopIteration as done:
+    return done.value
+
+async def _arun(steps: Generator[tuple[dspy.Module, dict[str, Any]], dspy.Prediction, Any], lm: dspy.LM, semaphore: Optional[asyncio.Semaphore] = None) -> Any:
+  """Async version of _run, calling lm directly"""
+  try:
+    module, inputs = next(steps)
+    while True:
+      module, inputs = steps.send(await apredict(module, lm, semaphore, **inputs))
+  except StopIteration as done:
+    return done.value
+
+def cluster_items(dspyi: dspy.dspy, items: set[str], item_type: str = "entities", context: str = "") -> tuple[set[str], dict[str, set[str]]]:
+  """Returns item set and cluster dict mapping representatives to sets of items"""
+  return _run(_cluster_items(items, item_type, context))
+
+async def acluster_items(lm: dspy.LM, items: set[str], item_type: str = "entities", context: str = "", semaphore: Optional[asyncio.Semaphore] = None) -> tuple[set[str], dict[str, set[str]]]:
+  """Async version of cluster_items, calling lm directly"""
+  return await _arun(_cluster_items(items, item_type, context), lm, semaphore)
+
+def _clustered_graph(
+  graph: Graph,
+  entities: set[str],
+  entity_clusters: dict[str, set[str]],
+  edges: set[str],
+  edge_clusters: dict[str, set[str]]
+) -> Graph:
+  """Map a graph's relations onto its clustered entities and edges"""
   # Update relations based on clusters
   relations: set[tuple[str, str, str]] = set()
   for s, p, o in graph.relations:
@@ -159,6 +236,78 @@ def cluster_graph(dspy: dspy.dspy, graph: Graph, context: str = "") -> Graph:
     edge_clusters=edge_clusters
   )
 
+def cluster_graph(dspy: dspy.dspy, graph: Graph, context: str = "") -> Graph:
+  """Cluster entities and edges in a graph, updating relations accordingly.
+  
+  Args:
+      dspy: The DSPy runtime
+      graph: Input graph with entities, edges, and relations
+      context: Additional context string for clustering
+      
+  Returns:
+      Graph with clustered entities and edges, updated relations, and cluster mappings
+  """
+  entities, entity_clusters = cluster_items(dspy, graph.entities, "entities", context)
+  edges, edge_clusters = cluster_items(dspy, graph.edges, "edges", context)
+  return _clustered_graph(graph, entities, entity_clusters, edges, edge_clusters)
+
+async def acluster_graph(lm: dspy.LM, graph: Graph, context: str = "", semaphore: Optional[asyncio.Semaphore] = None) -> Graph:
+  """Async version of cluster_graph, clustering entities and edges concurrently"""
+  (entities, entity_clusters), (edges, edge_clusters) = await asyncio.gather(
+    acluster_items(lm, graph.entities, "entities", context, semaphore),
+    acluster_items(lm, graph.edges, "edges", context, semaphore)
+  )
+  return _clustered_graph(graph, entities, entity_clusters, edges, edge_clusters)
+
+def _update_clusters(graph: Graph, new_graph: Graph, context: str, item_type: str) -> Generator[tuple[dspy.Module, dict[str, Any]], dspy.Prediction, dict[str, set[str]]]:
+  """Steps adding the new entities or edges of new_graph to graph's clusters
+  
+  Items that already are a cluster member cost no model calls.
+  """
+  clusters = graph.entity_clusters if item_type == "entities" else graph.edge_clusters
+  clusters = {rep: set(cluster) for rep, cluster in clusters.items()}
+  known = set(clusters).union(*clusters.values())
+  items = new_graph.entities if item_type == "entities" else new_graph.edges
+  new_items = sorted(item for item in items if item not in known)
+  context = f"{item_type} of a graph extracted from source text." + context
+  return (yield from _assign_to_clusters(new_items, clusters, context, MAX_CANDIDATE_CLUSTERS))
+
+def _updated_graph(graph: Graph, new_graph: Graph, entity_clusters: dict[str, set[str]], edge_clusters: dict[str, set[str]]) -> Graph:
+  merged = Graph(
+    entities=graph.entities | new_graph.entities,
+    edges=graph.edges | new_graph.edges,
+    relations=graph.relations | new_graph.relations
+  )
+  return _clustered_graph(merged, set(entity_clusters), entity_clusters, set(edge_clusters), edge_clusters)
+
+def update_clustered_graph(dspy: dspy.dspy, graph: Graph, new_graph: Graph, context: str = "") -> Graph:
+  """Merge a newly extracted graph into a clustered graph without reclustering it.
+  
+  Each new entity and edge is added to the existing cluster it belongs to, or
+  becomes a cluster of its own. The number of model calls grows with the new
+  items, and each prompt shows at most MAX_CANDIDATE_CLUSTERS existing clusters.
+  
+  Args:
+      dspy: The DSPy runtime
+      graph: Clustered graph, with entity_clusters and edge_clusters
+      new_graph: Unclustered graph to merge in
+      context: Additional context string for clustering
+      
+  Returns:
+      Graph with the relations of both graphs mapped onto the updated clusters
+  """
+  entity_clusters = _run(_update_clusters(graph, new_graph, context, "entities"))
+  edge_clusters = _run(_update_clusters(graph, new_graph, context, "edges"))
+  return _updated_graph(graph, new_graph, entity_clusters, edge_clusters)
+
+async def aupdate_clustered_graph(lm: dspy.LM, graph: Graph, new_graph: Graph, context: str = "", semaphore: Optional[asyncio.Semaphore] = None) -> Graph:
+  """Async version of update_clustered_graph, updating entity and edge clusters concurrently"""
+  entity_clusters, edge_clusters = await asyncio.gather(
+    _arun(_update_clusters(graph, new_graph, context, "entities"), lm, semaphore),
+    _arun(_update_clusters(graph, new_graph, context, "edges"), lm, semaphore)
+  )
+  return _updated_graph(graph, new_graph, entity_clusters, edge_clusters)
+
 if __name__ == "__main__":
   import os
   from ..kg_gen import KGGen
@@ -0,0 +1,86 @@
+import asyncio
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Any, Optional
+
+import dspy
+import litellm
+
+async def acomplete(lm: dspy.LM, messages: list[dict], semaphore: Optional[asyncio.Semaphore] = None, **kwargs: Any) -> list[str]:
+  """Send a chat request with an LM's model and settings through LiteLLM's async client
+
+  Like calling the LM, the reply is read from and written to the LiteLLM disk
+  cache DSPy configures, unless the LM was created with cache=False, and is
+  recorded in lm.history. DSPy's in-memory cache and LM callbacks are skipped.
+
+  Args:
+      lm: LM whose model, settings, cache and retries to use
+      messages: Chat messages
+      semaphore: Caps the number of requests in flight, if given
+      **kwargs: Settings overriding the LM's own
+
+  Returns:
+      The text of each choice
+  """
+  kwargs = {**lm.kwargs, **kwargs}
+  async with semaphore or nullcontext():
+    response = await litellm.acompletion(
+      model=lm.model,
+      messages=messages,
+      num_retries=lm.num_retries,
+      cache={"no-cache": not lm.cache, "no-store": not lm.cache},
+      **kwargs
+    )
+  outputs = [choice.message.content for choice in response.choices]
+  entry = dict(
+    prompt=None,
+    messages=messages,
+    kwargs={k: v for k, v in kwargs.items() if not k.startswith("api_")},
+    response=response,
+    outputs=outputs,
+    usage=dict(response["usage"]),
+    cost=response.get("_hidden_params", {}).get("response_cost"),
+    timestamp=datetime.now().isoformat(),
+    uuid=str(uuid.uuid4()),
+    model=lm.model,
+    model_type=lm.model_type
+  )
+  lm.history.append(entry)
+  lm.update_global_history(entry)
+  return outputs
+
+async def apredict(module: dspy.Module, lm: dspy.LM, semaphore: Optional[asyncio.Semaphore] = None, **inputs: Any) -> dspy.Prediction:
+  """Run a dspy.Predict or dspy.ChainOfThought module without blocking the event loop
+
+  DSPy modules only call their LM synchronously, so this formats and parses the
+  request with the module's adapter itself. Like DSPy, it retries with the JSON
+  adapter if the chat-formatted reply can't be parsed.
+
+  Args:
+      module: A dspy.Predict or dspy.ChainOfThought
+      lm: LM to call
+      semaphore: Caps the number of requests in flight, if given
+      **inputs: The module's input fields
+
+  Returns:
+      Same as calling the module with lm configured
+  """
+  predict = getattr(module, '_predict', module)
+  signature = getattr(predict, 'extended_signature', predict.signature)
+  adapter = dspy.settings.adapter or dspy.ChatAdapter()
+  try:
+    outputs = await acomplete(lm, adapter.format(signature, predict.demos, inputs), semaphore)
+    values = [adapter.parse(signature, output) for output in outputs]
+  except Exception:
+    if isinstance(adapter, dspy.JSONAdapter):
+      raise
+    adapter = dspy.JSONAdapter()
+    outputs = await acomplete(
+      lm,
+      adapter.format(signature, predict.demos, inputs),
+      semaphore,
+      response_format={"type": "json_object"}
+    )
+    values = [adapter.parse(signature, output) for output in outputs]
+  return dspy.Prediction.from_completions(values, signature=signature)
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+import dspy
+
+from ..steps._1_get_entities import TextEntities, ConversationEntities
+from ..steps._2_get_relations import TextRelations, ConversationRelations
+
+def signature_version(*signatures: type[dspy.Signature]) -> str:
+  """Hash of the instructions and fields of signatures, which changes whenever a prompt does"""
+  parts = [
+    [signature.__name__, signature.instructions, {name: [str(field.annotation), str(field.json_schema_extra)] for name, field in signature.fields.items()}]
+    for signature in signatures
+  ]
+  return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+
+# Results extracted with older prompts are never reused
+SIGNATURE_VERSION = signature_version(TextEntities, ConversationEntities, TextRelations, ConversationRelations)
+
+class ExtractionCache:
+  """SQLite cache of the entities and relations extracted from each chunk of text
+
+  Keyed on the chunk's content hash, model, temperature, extraction prompts and
+  whether the text is a conversation, so only new or changed chunks need the LLM.
+  Safe to share across threads.
+  """
+
+  def __init__(self, path: str):
+    """Initialize ExtractionCache
+
+    Args:
+        path: SQLite file, created if missing
+    """
+    self.path = path
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    with self.lock, self.connection:
+      self.connection.execute(
+        "CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, entities TEXT NOT NULL, relations TEXT NOT NULL)"
+      )
+
+  @staticmethod
+  def key(text: str, model: str, temperature: Optional[float], is_conversation: bool) -> str:
+    text_hash = hashlib.sha256(text.encode()).hexdigest()
+    # 0 and 0.0 sample the same way, so they must share a key
+    temperature = float(temperature) if temperature is not None else None
+    return hashlib.sha256(json.dumps([text_hash, model, temperature, SIGNATURE_VERSION, is_conversation]).encode()).hexdigest()
+
+  def get(
+    self,
+    text: str,
+    model: str,
+    temperature: Optional[float],
+    is_conversation: bool
+  ) -> Optional[Tuple[List[str], List[Tuple[str, str, str]]]]:
+    """Cached (entities, relations) for a chunk, or None"""
+    with self.lock:
+      row = self.connection.execute(
+        "SELECT entities, relations FROM extractions WHERE key = ?",
+        (self.key(text, model, temperature, is_conversation),)
+      ).fetchone()
+    if row is None:
+      return None
+    return json.loads(row[0]), [tuple(relation) for relation in json.loads(row[1])]
+
+  def set(
+    self,
+    text: str,
+    model: str,
+    temperature: Optional[float],
+    is_conversation: bool,
+    entities: List[str],
+    relations: List[Tuple[str, str, str]]
+  ) -> None:
+    with self.lock, self.connection:
+      self.connection.execute(
+        "INSERT OR REPLACE INTO extractions (key, entities, relations) VALUES (?, ?, ?)",
+        (self.key(text, model, temperature, is_conversation), json.dumps(list(entities)), json.dumps(list(relations)))
+      )
+
+  def close(self) -> None:
+    """Close the underlying connection; the cache can't be used afterwards"""
+    with self.lock:
+      self.connection.close()
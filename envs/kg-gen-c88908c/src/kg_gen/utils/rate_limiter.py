@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+# Rough characters per token for English text, good enough to pace requests
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(*texts: str) -> int:
+  """Estimate the number of tokens in some texts without a tokenizer"""
+  return sum(len(text) for text in texts) // CHARS_PER_TOKEN + 1
+
+class RateLimiter:
+  """Thread-safe token bucket allowing a fixed number of tokens per minute
+
+  The bucket holds up to one minute's worth of tokens and refills continuously.
+  Requests larger than the bucket are let through once it is full, so they
+  can't block forever.
+  """
+
+  def __init__(self, tokens_per_minute: float, capacity: Optional[float] = None):
+    """Initialize RateLimiter
+
+    Args:
+        tokens_per_minute: Tokens replenished per minute
+        capacity: Maximum burst size. Defaults to tokens_per_minute.
+    """
+    self.rate = tokens_per_minute / 60.0
+    self.capacity = capacity if capacity is not None else tokens_per_minute
+    self.available = self.capacity
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def _refill(self) -> None:
+    now = time.monotonic()
+    self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def try_acquire(self, tokens: float) -> float:
+    """Take tokens if available, else return the seconds to wait before trying again"""
+    with self.lock:
+      self._refill()
+      needed = min(tokens, self.capacity)
+      if self.available >= needed:
+        self.available -= tokens
+        return 0.0
+      return (needed - self.available) / self.rate
+
+  def acquire(self, tokens: float) -> None:
+    """Block until tokens are available, then take them"""
+    while True:
+      wait = self.try_acquire(tokens)
+      if wait <= 0:
+        return
+      time.sleep(wait)
+
+  async def aacquire(self, tokens: float) -> None:
+    """Like acquire, but sleeps without blocking the event loop"""
+    while True:
+      wait = self.try_acquire(tokens)
+      if wait <= 0:
+        return
+      await asyncio.sleep(wait)
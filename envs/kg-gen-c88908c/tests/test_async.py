@@ -0,0 +1,42 @@
+from src.kg_gen import KGGen
+import asyncio
+import os
+from dotenv import load_dotenv
+
+async def main():
+  kg = KGGen(
+    model="openai/gpt-4o",
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_concurrency=16
+  )
+  
+  # Test texts
+  text1 = "Linda is Joshua's mother. Ben is Josh's brother. Andrew is Josh's father."
+  text2 = "Judy is Andrew's sister. Josh is Judy's nephew. Judy is Josh's aunt. Josh also goes by Joshua."
+  
+  # Generate both graphs on one event loop and combine them as they finish
+  combined_graph = await kg.aaggregate([
+    kg.agenerate(input_data=text1, context="Family relationships"),
+    kg.agenerate(input_data=text2, context="Family relationships")
+  ])
+  
+  # Cluster entities and edges concurrently
+  clustered_graph = await kg.acluster(combined_graph, context="Family relationships")
+  
+  print("\nCombined Graph:")
+  print("Entities:", combined_graph.entities)
+  print("Relations:", combined_graph.relations)
+  print("Edges:", combined_graph.edges)
+
+  print("\nClustered Combined Graph:")
+  print("Entities:", clustered_graph.entities)
+  print("Relations:", clustered_graph.relations)
+  print("Edges:", clustered_graph.edges)
+  print("Entity Clusters:", clustered_graph.entity_clusters)
+  print("Edge Clusters:", clustered_graph.edge_clusters)
+
+if __name__ == "__main__":
+  # Load environment variables
+  load_dotenv()
+  
+  asyncio.run(main())
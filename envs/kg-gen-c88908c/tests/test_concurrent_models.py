@@ -0,0 +1,29 @@
+from src.kg_gen import KGGen
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+if __name__ == "__main__":
+  # Load environment variables
+  load_dotenv()
+  
+  # Two instances with different models, used from several threads at once
+  kg_openai = KGGen(model="openai/gpt-4o", api_key=os.getenv("OPENAI_API_KEY"))
+  kg_anthropic = KGGen(model="anthropic/claude-3-5-sonnet-20240620", api_key=os.getenv("ANTHROPIC_API_KEY"))
+  
+  text = "Linda is Josh's mother. Ben is Josh's brother. Andrew is Josh's father."
+  
+  jobs = [
+    ("openai", lambda: kg_openai.generate(input_data=text)),
+    ("anthropic", lambda: kg_anthropic.generate(input_data=text)),
+    # A per-call override applies to that call only
+    ("openai with gpt-4o-mini", lambda: kg_openai.generate(input_data=text, model="openai/gpt-4o-mini")),
+  ]
+  
+  with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+    futures = [(name, executor.submit(job)) for name, job in jobs]
+    for name, future in futures:
+      print(f"\n{name}:")
+      print(future.result())
+  
+  print("\nkg_openai still uses", kg_openai.model)
@@ -0,0 +1,44 @@
+from src.kg_gen import KGGen
+import os
+import time
+from dotenv import load_dotenv
+
+if __name__ == "__main__":
+  # Load environment variables
+  load_dotenv()
+  
+  # At most 4 calls in flight and 30k estimated prompt tokens per minute
+  kg = KGGen(
+    model="openai/gpt-4o",
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_concurrency=4,
+    tokens_per_minute=30000
+  )
+  
+  # Test texts
+  texts = [
+    "Linda is Josh's mother. Ben is Josh's brother. Andrew is Josh's father.",
+    "Judy is Andrew's sister. Josh is Judy's nephew. Judy is Josh's aunt.",
+    "Harry has two parents - his dad James Potter and his mom Lily Potter.",
+    [
+      {"role": "user", "content": "What is the capital of France?"},
+      {"role": "assistant", "content": "The capital of France is Paris."}
+    ]
+  ]
+  
+  # Extract from every input at once, one graph per input
+  start = time.time()
+  graphs = kg.generate_many(texts)
+  print(f"Generated {len(graphs)} graphs in {time.time() - start:.1f}s")
+  
+  for i, graph in enumerate(graphs):
+    print(f"\nGraph {i + 1}:")
+    print("Entities:", graph.entities)
+    print("Relations:", graph.relations)
+    print("Edges:", graph.edges)
+  
+  # Combine them as usual
+  combined_graph = kg.aggregate(graphs)
+  print("\nCombined Graph:")
+  print("Entities:", combined_graph.entities)
+  print("Relations:", combined_graph.relations)
@@ -0,0 +1,21 @@
+from src.kg_gen import KGGen
+import os
+from dotenv import load_dotenv
+
+if __name__ == "__main__":
+  # Load environment variables
+  load_dotenv()
+  
+  kg = KGGen(model="openai/gpt-4o", api_key=os.getenv("OPENAI_API_KEY"))
+  
+  text1 = "Linda is Joshua's mother. Ben is Josh's brother. Andrew is Josh's father."
+  text2 = "Judy is Andrew's sister. Josh is Judy's nephew. Joshua also goes by Joe."
+  
+  graph = kg.generate(input_data=text1, context="Family relationships", cluster=True)
+  print("Initial graph:")
+  print(graph)
+  
+  # Only text2 is extracted, and its entities and edges join the existing clusters
+  graph = kg.update(graph, text2, context="Family relationships")
+  print("\nUpdated graph:")
+  print(graph)
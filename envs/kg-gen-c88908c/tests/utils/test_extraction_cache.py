@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+from src.kg_gen.utils.extraction_cache import ExtractionCache
+
+class TestExtractionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "extractions.sqlite")
+        self.cache = ExtractionCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        """Test that cached relations come back as tuples."""
+        self.cache.set("Linda is Josh's mother.", "openai/gpt-4o", 0.0, False,
+                       ["Linda", "Josh"], [("Linda", "is mother of", "Josh")])
+        entities, relations = self.cache.get("Linda is Josh's mother.", "openai/gpt-4o", 0.0, False)
+        self.assertEqual(entities, ["Linda", "Josh"])
+        self.assertEqual(relations, [("Linda", "is mother of", "Josh")])
+
+    def test_miss(self):
+        """Test that unknown text is not found."""
+        self.assertIsNone(self.cache.get("Ben is Josh's brother.", "openai/gpt-4o", 0.0, False))
+
+    def test_key_includes_settings(self):
+        """Test that a different model, temperature or input type misses the cache."""
+        text = "Linda is Josh's mother."
+        self.cache.set(text, "openai/gpt-4o", 0.0, False, ["Linda", "Josh"], [])
+        self.assertIsNone(self.cache.get(text, "openai/gpt-4o-mini", 0.0, False))
+        self.assertIsNone(self.cache.get(text, "openai/gpt-4o", 0.7, False))
+        self.assertIsNone(self.cache.get(text, "openai/gpt-4o", 0.0, True))
+        self.assertIsNone(self.cache.get(text + " ", "openai/gpt-4o", 0.0, False))
+
+    def test_integer_temperature_shares_key(self):
+        """Test that a temperature of 0 finds results cached at 0.0."""
+        self.cache.set("Linda is Josh's mother.", "openai/gpt-4o", 0.0, False, ["Linda"], [])
+        self.assertEqual(self.cache.get("Linda is Josh's mother.", "openai/gpt-4o", 0, False), (["Linda"], []))
+        self.assertEqual(ExtractionCache.key("x", "m", 1, False), ExtractionCache.key("x", "m", 1.0, False))
+
+    def test_persists_across_instances(self):
+        """Test that results written by one cache are read by another on the same file."""
+        self.cache.set("Linda is Josh's mother.", "openai/gpt-4o", 0.0, False, ["Linda"], [])
+        other = ExtractionCache(self.path)
+        try:
+            self.assertEqual(other.get("Linda is Josh's mother.", "openai/gpt-4o", 0.0, False), (["Linda"], []))
+        finally:
+            other.close()
+
+if __name__ == '__main__':
+    unittest.main()
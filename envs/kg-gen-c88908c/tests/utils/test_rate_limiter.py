@@ -0,0 +1,44 @@
+import time
+import unittest
+from src.kg_gen.utils.rate_limiter import RateLimiter, estimate_tokens
+
+class TestRateLimiter(unittest.TestCase):
+    def test_burst_within_capacity(self):
+        """Test that requests within the bucket go through without waiting."""
+        limiter = RateLimiter(tokens_per_minute=6000)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire(1000)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_waits_when_empty(self):
+        """Test that an empty bucket reports how long to wait for a refill."""
+        limiter = RateLimiter(tokens_per_minute=6000)
+        limiter.acquire(6000)
+        wait = limiter.try_acquire(100)
+        # 100 tokens at 100 tokens per second
+        self.assertAlmostEqual(wait, 1.0, delta=0.05)
+
+    def test_blocks_until_refilled(self):
+        """Test that acquire sleeps until enough tokens have been refilled."""
+        limiter = RateLimiter(tokens_per_minute=60000)
+        limiter.acquire(60000)
+        start = time.monotonic()
+        limiter.acquire(100)
+        # 100 tokens at 1000 tokens per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_request_larger_than_capacity(self):
+        """Test that a request larger than the bucket goes through once it is full."""
+        limiter = RateLimiter(tokens_per_minute=600)
+        self.assertEqual(limiter.try_acquire(1000), 0.0)
+        self.assertGreater(limiter.try_acquire(1), 0.0)
+
+    def test_estimate_tokens(self):
+        """Test that token estimates grow with the length of all texts."""
+        self.assertEqual(estimate_tokens(""), 1)
+        self.assertEqual(estimate_tokens("a" * 400), 101)
+        self.assertEqual(estimate_tokens("a" * 200, "b" * 200), 101)
+
+if __name__ == '__main__':
+    unittest.main()
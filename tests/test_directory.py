@@ -0,0 +1,76 @@
+import asyncio
+import importlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+
+directory = importlib.import_module("agents.al-mod.utils.directory")
+
+class TestLazyExpansion(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    for i in range(6):
+      with open(os.path.join(self.tmp_dir.name, f"f{i}.py"), "w") as f:
+        f.write(f"x = {i}\n")
+    self.directory = directory.NLDirectory(self.tmp_dir.name, cache_path=None, lazy=True)
+    self.calls = Counter()
+
+    def describe_file(rel_path: str) -> str:
+      self.calls[rel_path] += 1
+      time.sleep(0.05)
+      return f"Sets x in {rel_path}"
+
+    async def adescribe_file(rel_path: str) -> str:
+      self.calls[rel_path] += 1
+      await asyncio.sleep(0.05)
+      return f"Sets x in {rel_path}"
+
+    # Stand-ins for the LLM call, so the test runs offline
+    self.directory.describe_file = describe_file
+    self.directory.adescribe_file = adescribe_file
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_lists_without_describing(self):
+    """Test that a lazy directory renders sizes and makes no description calls."""
+    self.assertIn('size="6"', self.directory.structure)
+    self.assertEqual(self.calls, Counter())
+
+  def test_concurrent_expansions_describe_each_file_once(self):
+    """Test that overlapping sync and async expansions share descriptions in flight."""
+    paths = [f"f{i}.py" for i in range(6)]
+    threads = [threading.Thread(target=self.directory.expand_files, args=(paths[i:i + 4],)) for i in range(3)]
+    for thread in threads:
+      thread.start()
+
+    async def expand():
+      await asyncio.gather(*(self.directory.aexpand_files(paths[i:]) for i in range(3)))
+
+    asyncio.run(expand())
+    for thread in threads:
+      thread.join()
+    self.assertEqual(set(self.calls), set(paths))
+    self.assertEqual(max(self.calls.values()), 1)
+    self.assertEqual(self.directory.structure.count("Sets x in"), 6)
+    self.assertEqual(self.directory.expanding, {})
+
+  def test_failed_expansion_can_be_retried(self):
+    """Test that a failed description is not remembered and is retried by the next expansion."""
+    describe_file = self.directory.describe_file
+
+    def failing(rel_path: str) -> str:
+      raise RuntimeError("provider down")
+
+    self.directory.describe_file = failing
+    with self.assertRaises(RuntimeError):
+      self.directory.expand_files(["f0.py"])
+    self.directory.describe_file = describe_file
+    self.directory.expand_files(["f0.py"])
+    self.assertEqual(self.directory.descriptions, {"f0.py": "Sets x in f0.py"})
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,157 @@
+import importlib
+import os
+import re
+import tempfile
+import unittest
+
+ignore = importlib.import_module("agents.al-mod.utils.ignore")
+
+class TestTranslate(unittest.TestCase):
+  def matches(self, glob: str, path: str) -> bool:
+    return re.fullmatch(ignore._translate(glob), path) is not None
+
+  def test_wildcards_stay_in_one_component(self):
+    """Test that * and ? never match a slash."""
+    self.assertTrue(self.matches("*.py", "main.py"))
+    self.assertFalse(self.matches("*.py", "src/main.py"))
+    self.assertTrue(self.matches("?.py", "a.py"))
+    self.assertFalse(self.matches("a?b", "a/b"))
+
+  def test_double_star(self):
+    """Test that leading, middle and trailing ** match any number of directories."""
+    self.assertTrue(self.matches("**/build", "build"))
+    self.assertTrue(self.matches("**/build", "a/b/build"))
+    self.assertTrue(self.matches("a/**/b", "a/b"))
+    self.assertTrue(self.matches("a/**/b", "a/x/y/b"))
+    self.assertTrue(self.matches("a/**", "a/x/y"))
+    self.assertFalse(self.matches("a/**", "b/x"))
+    self.assertFalse(self.matches("a**", "ab/c"))
+
+  def test_character_classes(self):
+    """Test that bracket expressions, negated ones and unclosed brackets are translated."""
+    self.assertTrue(self.matches("[abc].py", "b.py"))
+    self.assertFalse(self.matches("[!abc].py", "b.py"))
+    self.assertTrue(self.matches("[!abc].py", "d.py"))
+    self.assertTrue(self.matches("[a", "[a"))
+
+  def test_leading_bracket_is_literal(self):
+    """Test that ']' first in a class is a member and a bracket that is never closed is literal."""
+    self.assertTrue(self.matches("[]abc].py", "].py"))
+    self.assertTrue(self.matches("[]abc].py", "b.py"))
+    self.assertFalse(self.matches("[!]a].py", "].py"))
+    self.assertTrue(self.matches("[!]a].py", "b.py"))
+    self.assertTrue(self.matches("[]", "[]"))
+    self.assertTrue(self.matches("[!]", "[!]"))
+    self.assertTrue(self.matches("a[", "a["))
+
+  def test_posix_classes(self):
+    """Test that [:name:] classes match their characters, alone or with others."""
+    self.assertTrue(self.matches("[[:alpha:]]1", "x1"))
+    self.assertFalse(self.matches("[[:alpha:]]1", "11"))
+    self.assertTrue(self.matches("v[[:digit:]_]", "v_"))
+    self.assertTrue(self.matches("[![:upper:]]", "a"))
+    self.assertFalse(self.matches("[![:upper:]]", "A"))
+    self.assertFalse(self.matches("a[[:punct:]]b", "a/b"))
+    self.assertTrue(self.matches("a[[:punct:]]b", "a-b"))
+
+  def test_ranges(self):
+    """Test that ranges match their span, inverted ranges match nothing and escapes are literal."""
+    self.assertTrue(self.matches("[a-c]", "b"))
+    self.assertFalse(self.matches("[a-c]", "d"))
+    self.assertFalse(self.matches("[c-a]", "b"))
+    self.assertTrue(self.matches("[a-]", "-"))
+    self.assertTrue(self.matches("[\\]]", "]"))
+
+  def test_escapes(self):
+    """Test that escaped and regex special characters match literally."""
+    self.assertTrue(self.matches("\\*.py", "*.py"))
+    self.assertFalse(self.matches("\\*.py", "a.py"))
+    self.assertFalse(self.matches("a.b", "axb"))
+
+class TestIgnoreRules(unittest.TestCase):
+  def test_last_matching_pattern_wins(self):
+    """Test that a later pattern overrides an earlier one, in either direction."""
+    rules = ignore.IgnoreRules(["*.log", "!keep.log"])
+    self.assertTrue(rules.match("debug.log", False))
+    self.assertFalse(rules.match("keep.log", False))
+    self.assertIsNone(rules.match("main.py", False))
+    rules = ignore.IgnoreRules(["!keep.log", "*.log"])
+    self.assertTrue(rules.match("keep.log", False))
+
+  def test_unanchored_patterns_match_at_any_depth(self):
+    """Test that patterns without a slash match the last component anywhere."""
+    rules = ignore.IgnoreRules(["*.pyc"])
+    self.assertTrue(rules.match("a/b/c.pyc", False))
+    rules = ignore.IgnoreRules(["*.tmp", "docs/*.md"])
+    self.assertTrue(rules.match("src/x.tmp", False))
+
+  def test_anchored_patterns(self):
+    """Test that patterns with a slash only match relative to the base."""
+    rules = ignore.IgnoreRules(["/build", "docs/*.md"])
+    self.assertTrue(rules.match("build", True))
+    self.assertIsNone(rules.match("src/build", True))
+    self.assertTrue(rules.match("docs/a.md", False))
+    self.assertIsNone(rules.match("docs/sub/a.md", False))
+
+  def test_directory_only_patterns(self):
+    """Test that a trailing slash only matches directories."""
+    rules = ignore.IgnoreRules(["out/"])
+    self.assertTrue(rules.match("out", True))
+    self.assertIsNone(rules.match("out", False))
+
+  def test_unusual_brackets_compile(self):
+    """Test that any bracket expression in a valid .gitignore builds a matcher."""
+    rules = ignore.IgnoreRules(["[]", "[]abc]", "[[:alpha:]]x", "[z-a]", "[[:bogus:]]"])
+    self.assertTrue(rules.match("b", False))
+    self.assertTrue(rules.match("ax", False))
+    self.assertIsNone(rules.match("1x", False))
+
+  def test_comments_blanks_and_escapes(self):
+    """Test that comments and blank lines are skipped and escaped # and ! are literal."""
+    rules = ignore.IgnoreRules(["# comment\n", "\n", "\\#notes\n", "\\!bang\n", "trailing   \n"])
+    self.assertEqual(rules.patterns, ["#notes", "!bang", "trailing"])
+    self.assertTrue(rules.match("#notes", False))
+    self.assertTrue(rules.match("!bang", False))
+    self.assertTrue(rules.match("trailing", False))
+
+class TestIgnoreMatcher(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.root = self.tmp_dir.name
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def write_gitignore(self, rel_dir: str, content: str) -> None:
+    os.makedirs(os.path.join(self.root, rel_dir), exist_ok=True)
+    with open(os.path.join(self.root, rel_dir, ".gitignore"), "w") as f:
+      f.write(content)
+
+  def test_root_gitignore_overrides_defaults(self):
+    """Test that the root .gitignore can re-include a default pattern."""
+    self.write_gitignore("", "!keep.pyc\n")
+    matcher = ignore.IgnoreMatcher.for_root(self.root, ["*.pyc"])
+    self.assertTrue(matcher.ignored("a.pyc", False))
+    self.assertFalse(matcher.ignored("keep.pyc", False))
+
+  def test_nested_gitignore_overrides_parent(self):
+    """Test that a subdirectory's .gitignore takes precedence and is relative to it."""
+    self.write_gitignore("", "*.log\n")
+    self.write_gitignore("sub", "!keep.log\n/local\n")
+    matcher = ignore.IgnoreMatcher.for_root(self.root, ["__pycache__"])
+    sub = matcher.child(os.path.join(self.root, "sub"), "sub")
+    self.assertTrue(sub.ignored("sub/a.log", False))
+    self.assertFalse(sub.ignored("sub/keep.log", False))
+    self.assertTrue(matcher.ignored("keep.log", False))
+    self.assertTrue(sub.ignored("sub/local", True))
+    self.assertTrue(sub.ignored("sub/__pycache__", True))
+    self.assertFalse(sub.ignored("sub/main.py", False))
+
+  def test_child_without_gitignore_reuses_matcher(self):
+    """Test that directories without a .gitignore don't create a new matcher."""
+    os.makedirs(os.path.join(self.root, "plain"))
+    matcher = ignore.IgnoreMatcher.for_root(self.root)
+    self.assertIs(matcher.child(os.path.join(self.root, "plain"), "plain"), matcher)
+
+if __name__ == '__main__':
+  unittest.main()
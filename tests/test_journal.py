@@ -0,0 +1,52 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from do_things import Journal, task_hash
+from tasks.models import Task
+
+def outcome(task: Task, status: str, result=None, error=None) -> dict:
+  return {"task": task, "status": status, "result": result, "error": error, "started_at": 0.0, "duration": 1.0}
+
+class TestJournal(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.run_dir = Path(self.tmp_dir.name) / "run"
+    self.journal = Journal(self.run_dir)
+    self.task = Task(problem="Fix the bug", env="kg-gen-c88908c")
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_empty(self):
+    """Test that a new journal has no completed tasks."""
+    self.assertEqual(self.journal.completed(), set())
+
+  def test_latest_entry_wins(self):
+    """Test that a task counts as completed only if its latest entry is done."""
+    other = Task(problem="Fix another bug", env="kg-gen-c88908c")
+    self.journal.record(outcome(self.task, "error", error="boom"))
+    self.journal.record(outcome(self.task, "done", result=[]))
+    self.journal.record(outcome(other, "done", result=[]))
+    self.journal.record(outcome(other, "error", error="boom"))
+    self.assertEqual(Journal(self.run_dir).completed(), {task_hash(self.task)})
+
+  def test_result_written(self):
+    """Test that done tasks get a result file referenced from their entry."""
+    self.journal.record(outcome(self.task, "done", result=[{"full_file_path": "a.py"}]))
+    with open(self.journal.path) as f:
+      entry = json.loads(f.readline())
+    self.assertEqual(entry["task_hash"], task_hash(self.task))
+    with open(entry["result_path"]) as f:
+      self.assertEqual(json.load(f), [{"full_file_path": "a.py"}])
+
+  def test_partial_last_line_ignored(self):
+    """Test that a line cut off by a killed run doesn't break resuming."""
+    self.journal.record(outcome(self.task, "done", result=[]))
+    with open(self.journal.path, "a") as f:
+      f.write('{"task_hash": "abc", "sta')
+    self.assertEqual(self.journal.completed(), {task_hash(self.task)})
+
+if __name__ == '__main__':
+  unittest.main()
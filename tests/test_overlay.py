@@ -0,0 +1,132 @@
+import importlib
+import os
+import tempfile
+import unittest
+
+overlay = importlib.import_module("agents.al-mod.utils.overlay")
+d_rerank = importlib.import_module("agents.al-mod.steps.d_rerank")
+sampling = importlib.import_module("agents.al-mod.utils.sampling")
+
+def edit(*blocks: tuple[str, str]) -> str:
+  return "".join(f"<<<<<<< SEARCH\n{search}=======\n{replace}>>>>>>> REPLACE\n" for search, replace in blocks)
+
+class TestParseSearchReplace(unittest.TestCase):
+  def test_blocks_in_order(self):
+    """Test that every block is parsed in order, keeping trailing newlines."""
+    text = "### a.py\n" + edit(("x = 1\n", "x = 2\n"), ("y = 1\n", ""))
+    self.assertEqual(overlay.parse_search_replace(text), [("x = 1\n", "x = 2\n"), ("y = 1\n", "")])
+
+  def test_no_blocks(self):
+    """Test that text without complete blocks gives no pairs."""
+    self.assertEqual(overlay.parse_search_replace("x = 2"), [])
+    self.assertEqual(overlay.parse_search_replace("<<<<<<< SEARCH\nx = 1\n=======\n"), [])
+
+class TestOverlay(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.root = self.tmp_dir.name
+    self.write("a.py", "def f():\n  return 1\n\ndef g():\n  return 1\n")
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def write(self, rel_path: str, content: str) -> None:
+    with open(os.path.join(self.root, rel_path), "w") as f:
+      f.write(content)
+
+  def test_edits_stay_in_memory(self):
+    """Test that edits are visible through the overlay but never written to disk."""
+    view = overlay.Overlay(self.root)
+    view.apply("a.py", edit(("def f():\n  return 1\n", "def f():\n  return 2\n")))
+    self.assertEqual(view.read("a.py"), "def f():\n  return 2\n\ndef g():\n  return 1\n")
+    with open(os.path.join(self.root, "a.py")) as f:
+      self.assertIn("return 1\n\ndef g", f.read())
+
+  def test_blocks_apply_in_order_to_first_occurrence(self):
+    """Test that each SEARCH sees the previous blocks' result and only its first match is replaced."""
+    view = overlay.Overlay(self.root)
+    view.apply("a.py", edit(("  return 1\n", "  return 2\n"), ("  return 2\n", "  return 3\n")))
+    self.assertEqual(view.read("a.py"), "def f():\n  return 3\n\ndef g():\n  return 1\n")
+
+  def test_rejects_bad_edits(self):
+    """Test that missing SEARCH text, missing blocks and uncompilable results raise and change nothing."""
+    view = overlay.Overlay(self.root)
+    with self.assertRaises(ValueError):
+      view.apply("a.py", edit(("  return 9\n", "  return 2\n")))
+    with self.assertRaises(ValueError):
+      view.apply("a.py", "  return 2\n")
+    with self.assertRaises(ValueError):
+      view.apply("a.py", edit(("def f():\n", "def f(:\n")))
+    self.assertEqual(view.files, {})
+
+  def test_empty_search_creates_new_file(self):
+    """Test that an empty SEARCH creates a missing file but can't overwrite an existing one."""
+    view = overlay.Overlay(self.root)
+    view.apply("b.py", edit(("", "x = 1\n")))
+    self.assertEqual(view.read("b.py"), "x = 1\n")
+    with self.assertRaises(ValueError):
+      view.apply("a.py", edit(("", "x = 1\n")))
+    with self.assertRaises(ValueError):
+      view.apply("c.py", edit(("x = 1\n", "x = 2\n")))
+
+  def test_last_line_without_newline(self):
+    """Test that a SEARCH ending in a newline matches a last line that has none."""
+    self.write("c.py", "x = 1")
+    view = overlay.Overlay(self.root)
+    view.apply("c.py", edit(("x = 1\n", "x = 2\n")))
+    self.assertEqual(view.read("c.py"), "x = 2\n")
+
+  def test_paths_outside_repository(self):
+    """Test that paths escaping the root are rejected."""
+    view = overlay.Overlay(self.root)
+    for rel_path in ("../a.py", "sub/../../a.py", os.path.abspath(os.path.join(self.root, "a.py"))):
+      with self.assertRaises(ValueError):
+        view.read(rel_path)
+
+  def test_shared_disk_cache(self):
+    """Test that overlays sharing a disk cache read each file from disk once."""
+    disk_cache = {}
+    first = overlay.Overlay(self.root, disk_cache)
+    first.apply("a.py", edit(("  return 1\n", "  return 2\n")))
+    os.remove(os.path.join(self.root, "a.py"))
+    second = overlay.Overlay(self.root, disk_cache)
+    self.assertEqual(second.read("a.py"), "def f():\n  return 1\n\ndef g():\n  return 1\n")
+    self.assertIsNone(second.read("missing.py"))
+    self.assertIn("missing.py", disk_cache)
+
+class TestApplyingSamples(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    with open(os.path.join(self.tmp_dir.name, "a.py"), "w") as f:
+      f.write("def f():\n  return 1\n")
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def sample(self, search: str) -> list:
+    return [d_rerank.SearchReplaceEdit(full_file_path="a.py", search_replace_edit=edit((search, "def f():\n  return 2\n")))]
+
+  def test_applying_sample(self):
+    """Test that samples that apply are kept and the rest are treated as failed draws."""
+    valid = self.sample("def f():\n  return 1\n")
+    self.assertEqual(d_rerank.applying_sample(valid, self.tmp_dir.name, {}), valid)
+    self.assertIsNone(d_rerank.applying_sample(self.sample("def g():\n"), self.tmp_dir.name, {}))
+    self.assertIsNone(d_rerank.applying_sample([], self.tmp_dir.name, {}))
+
+  def test_unanimous_invalid_samples_dont_stop_sampling(self):
+    """Test that agreeing samples that don't apply never settle the vote, so valid ones are still drawn."""
+    drawn = [self.sample("def g():\n")] * 5 + [self.sample("def f():\n  return 1\n")] * 3
+    draws = iter(drawn)
+    disk_cache = {}
+    samples = sampling.sample_until_consensus(
+      lambda: d_rerank.applying_sample(next(draws), self.tmp_dir.name, disk_cache),
+      n_samples=8,
+      tally=d_rerank.tally_votes,
+      max_in_flight=1,
+    )
+    # Two valid samples after the five rejected ones settle the vote with one draw left
+    self.assertEqual(samples, drawn[5:7])
+    self.assertEqual(d_rerank.d(samples, root_path=self.tmp_dir.name), drawn[5])
+
+if __name__ == '__main__':
+  unittest.main()
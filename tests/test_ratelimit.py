@@ -0,0 +1,58 @@
+import asyncio
+import importlib
+import time
+import unittest
+
+ratelimit = importlib.import_module("agents.al-mod.utils.ratelimit")
+
+class TestRateLimiter(unittest.TestCase):
+  def test_burst_within_capacity(self):
+    """Test that requests within the bucket go through without waiting."""
+    limiter = ratelimit.RateLimiter(6000)
+    start = time.monotonic()
+    for _ in range(5):
+      limiter.acquire(1000)
+    self.assertLess(time.monotonic() - start, 0.1)
+
+  def test_waits_when_empty(self):
+    """Test that an empty bucket reports how long to wait for a refill."""
+    limiter = ratelimit.RateLimiter(6000)
+    limiter.acquire(6000)
+    # 100 units at 100 units per second
+    self.assertAlmostEqual(limiter.try_acquire(100), 1.0, delta=0.05)
+
+  def test_oversized_request_waits_for_full_bucket(self):
+    """Test that a request larger than the bucket goes through once it is full."""
+    limiter = ratelimit.RateLimiter(60)
+    self.assertEqual(limiter.try_acquire(100), 0.0)
+    self.assertLess(limiter.available, 0)
+
+  def test_consume_delays_later_acquires(self):
+    """Test that charging usage after the fact can overdraw the bucket."""
+    limiter = ratelimit.RateLimiter(6000)
+    limiter.consume(7000)
+    # 1000 units overdrawn plus 1 requested, at 100 units per second
+    self.assertAlmostEqual(limiter.try_acquire(1), 10.01, delta=0.05)
+
+  def test_aacquire_sleeps_until_refilled(self):
+    """Test that aacquire waits for a refill without blocking the event loop."""
+    limiter = ratelimit.RateLimiter(60000)
+    limiter.acquire(60000)
+    ticks = []
+
+    async def tick():
+      for _ in range(3):
+        ticks.append(time.monotonic())
+        await asyncio.sleep(0.01)
+
+    async def main():
+      start = time.monotonic()
+      await asyncio.gather(limiter.aacquire(100), tick())
+      return time.monotonic() - start
+
+    # 100 units at 1000 units per second
+    self.assertGreaterEqual(asyncio.run(main()), 0.09)
+    self.assertEqual(len(ticks), 3)
+
+if __name__ == '__main__':
+  unittest.main()
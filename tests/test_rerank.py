@@ -0,0 +1,98 @@
+import importlib
+import unittest
+
+d_rerank = importlib.import_module("agents.al-mod.steps.d_rerank")
+
+def sample(replace: str, path: str = "a.py") -> list:
+  text = f"<<<<<<< SEARCH\ndef f():\n  pass\n=======\n{replace}>>>>>>> REPLACE\n"
+  return [d_rerank.SearchReplaceEdit(full_file_path=path, search_replace_edit=text)]
+
+class TestNormalizeCode(unittest.TestCase):
+  def test_formatting_and_comments_ignored(self):
+    """Test that layout and comments don't change the normalized form."""
+    self.assertEqual(
+      d_rerank.normalize_code("x = f(1,2)  # why\n"),
+      d_rerank.normalize_code("x = f(1, 2)\n"),
+    )
+
+  def test_hash_in_string_kept(self):
+    """Test that a '#' inside a string literal is not treated as a comment."""
+    self.assertNotEqual(d_rerank.normalize_code('x = "#a"\n'), d_rerank.normalize_code('x = "#b"\n'))
+
+  def test_indentation_kept(self):
+    """Test that fragments at different indentation stay different."""
+    self.assertNotEqual(d_rerank.normalize_code("    x = 1\n"), d_rerank.normalize_code("x = 1\n"))
+
+  def test_fragments_that_dont_parse(self):
+    """Test that fragments which aren't valid Python are compared by their tokens."""
+    self.assertEqual(
+      d_rerank.normalize_code("else:\n  y = 1  # fallback\n"),
+      d_rerank.normalize_code("else:\n    y = 1\n"),
+    )
+    self.assertNotEqual(d_rerank.normalize_code("else:\n  y = 1\n"), d_rerank.normalize_code("else:\n  y = 2\n"))
+
+class TestClusterSamples(unittest.TestCase):
+  def cluster(self, samples: list) -> list:
+    clusters = d_rerank.cluster_samples(d_rerank.normalize_samples(samples))
+    return [[sample["sample_id"] for group in cluster for sample in group] for cluster in clusters]
+
+  def test_equal_up_to_formatting(self):
+    """Test that samples differing only in formatting form one group."""
+    clusters = d_rerank.cluster_samples(d_rerank.normalize_samples([
+      sample("def f():\n  return 1\n"),
+      sample("def f():\n    return 1  # done\n"),
+    ]))
+    self.assertEqual(len(clusters), 1)
+    self.assertEqual(len(clusters[0]), 1)
+
+  def test_similar_strings_merge(self):
+    """Test that samples differing only in a slightly reworded message share a cluster."""
+    self.assertEqual(self.cluster([
+      sample('def f():\n  raise ValueError("width must be positive")\n'),
+      sample('def f():\n  raise ValueError("width must be positive.")\n'),
+      sample('def f():\n  logger.warning("width must be positive")\n'),
+      sample('def f():\n  logger.warning("the width must be positive")\n'),
+      sample('def f():\n  raise ValueError("nope")\n'),
+    ]), [[0, 1], [2, 3], [4]])
+
+  def test_identifier_strings_stay_apart(self):
+    """Test that dict keys, attribute names and format specs are compared exactly."""
+    self.assertEqual(self.cluster([
+      sample('def f():\n  return config["timeout_x"]\n'),
+      sample('def f():\n  return config["timeout_y"]\n'),
+      sample('def f():\n  return getattr(obj, "x")\n'),
+      sample('def f():\n  return getattr(obj, "y")\n'),
+      sample('def f():\n  raise ValueError("{:.2f}".format(x))\n'),
+      sample('def f():\n  raise ValueError("{:.3f}".format(x))\n'),
+    ]), [[0], [1], [2], [3], [4], [5]])
+
+  def test_non_message_strings_stay_apart(self):
+    """Test that strings with spaces outside a message call are compared exactly."""
+    self.assertEqual(self.cluster([
+      sample('def f():\n  return "width must be positive"\n'),
+      sample('def f():\n  return "width must be positive."\n'),
+    ]), [[0], [1]])
+
+  def test_code_differences_stay_apart(self):
+    """Test that different code, names or files never merge."""
+    self.assertEqual(self.cluster([
+      sample("def f():\n  return 1\n"),
+      sample("def f():\n  return 2\n"),
+      sample("def f():\n  return 1\n", path="b.py"),
+    ]), [[0], [1], [2]])
+
+  def test_empty_samples_skipped(self):
+    """Test that samples without edits get no votes."""
+    self.assertEqual(self.cluster([[], sample("def f():\n  return 1\n")]), [[1]])
+
+  def test_tally_votes(self):
+    """Test that votes are counted per cluster, as majority voting counts them."""
+    votes = d_rerank.tally_votes([
+      sample('def f():\n  raise ValueError("width must be positive")\n'),
+      sample("def f():\n  return 2\n"),
+      sample('def f():\n  raise ValueError("width must be positive.")\n'),
+    ])
+    self.assertEqual(sorted(votes.values()), [1, 2])
+
+if __name__ == '__main__':
+  unittest.main()
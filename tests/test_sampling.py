@@ -0,0 +1,63 @@
+import asyncio
+import importlib
+import unittest
+from collections import Counter
+
+sampling = importlib.import_module("agents.al-mod.utils.sampling")
+
+class TestCanSettle(unittest.TestCase):
+  def test_nothing_in_flight(self):
+    """Test that with no samples in flight more must be submitted."""
+    self.assertFalse(sampling._can_settle(Counter(a=3), 0, 5, 3))
+
+  def test_in_flight_could_settle(self):
+    """Test that submitting stops while the samples in flight could decide the vote."""
+    # 2 + 2 in flight beats 0 + 1 still to submit
+    self.assertTrue(sampling._can_settle(Counter(a=2), 2, 5, 4))
+    # 1 in flight can't beat the 4 still to submit
+    self.assertFalse(sampling._can_settle(Counter(), 1, 5, 1))
+    # A tie isn't settled
+    self.assertFalse(sampling._can_settle(Counter(a=1, b=1), 1, 4, 3))
+
+  def test_settled(self):
+    """Test that the vote is settled once the runner-up can't catch up."""
+    self.assertTrue(sampling._settled(Counter(a=3), 5, 4))
+    self.assertFalse(sampling._settled(Counter(a=2, b=1), 5, 3))
+    self.assertFalse(sampling._settled(Counter(a=2, b=2), 4, 4))
+
+class TestSampleUntilConsensus(unittest.TestCase):
+  def test_stops_at_unassailable_majority(self):
+    """Test that unanimous samples stop as soon as the rest can't change the winner."""
+    calls = []
+    def generate():
+      calls.append(1)
+      return "x"
+    samples = sampling.sample_until_consensus(generate, n_samples=8, tally=Counter, max_in_flight=1)
+    self.assertEqual(samples, ["x"] * 5)
+    self.assertEqual(len(calls), 5)
+
+  def test_failed_samples_not_counted(self):
+    """Test that None results are dropped but still use up the sample budget."""
+    results = iter([None, "x", None, "y", "x"])
+    samples = sampling.sample_until_consensus(lambda: next(results), n_samples=5, tally=Counter, max_in_flight=1)
+    self.assertEqual(samples, ["x", "y", "x"])
+
+  def test_draws_everything_without_early_stop(self):
+    """Test that stop_early=False draws every sample even when they all agree."""
+    samples = sampling.sample_until_consensus(lambda: "x", n_samples=8, tally=Counter, max_in_flight=3, stop_early=False)
+    self.assertEqual(samples, ["x"] * 8)
+
+    async def generate():
+      return "x"
+    samples = asyncio.run(sampling.asample_until_consensus(generate, n_samples=8, tally=Counter, max_in_flight=3, stop_early=False))
+    self.assertEqual(samples, ["x"] * 8)
+
+  def test_async_stops_at_unassailable_majority(self):
+    """Test that the async sampler stops at the same point."""
+    async def generate():
+      return "x"
+    samples = asyncio.run(sampling.asample_until_consensus(generate, n_samples=8, tally=Counter, max_in_flight=1))
+    self.assertEqual(samples, ["x"] * 5)
+
+if __name__ == '__main__':
+  unittest.main()
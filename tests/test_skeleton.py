@@ -0,0 +1,51 @@
+import importlib
+import unittest
+
+skeleton = importlib.import_module("agents.al-mod.utils.skeleton")
+
+SOURCE = '''def save():
+  return "function"
+
+class A:
+  def __init__(self):
+    self.a = 1
+
+  def save(self):
+    return "A"
+
+class B:
+  def __init__(self):
+    self.b = 1
+
+  def save(self):
+    return "B"
+'''
+
+class TestRenderSignatures(unittest.TestCase):
+  def render(self, *expand: str) -> str:
+    return skeleton.render_signatures(SOURCE, skeleton.get_outline(SOURCE), set(expand))
+
+  def test_qualified_method_expands_one_class(self):
+    """Test that Class.method keeps only that class's body."""
+    rendered = self.render("A.save")
+    self.assertIn('return "A"', rendered)
+    self.assertNotIn('return "B"', rendered)
+    self.assertNotIn('return "function"', rendered)
+
+  def test_bare_name_doesnt_expand_methods(self):
+    """Test that a bare name expands the function of that name, not same-named methods."""
+    rendered = self.render("save", "__init__")
+    self.assertIn('return "function"', rendered)
+    self.assertNotIn('return "A"', rendered)
+    self.assertNotIn("self.a = 1", rendered)
+    self.assertNotIn("self.b = 1", rendered)
+
+  def test_class_expands_all_its_methods(self):
+    """Test that a class name keeps every method of that class."""
+    rendered = self.render("B")
+    self.assertIn('return "B"', rendered)
+    self.assertIn("self.b = 1", rendered)
+    self.assertNotIn("self.a = 1", rendered)
+
+if __name__ == '__main__':
+  unittest.main()